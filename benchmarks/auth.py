@@ -0,0 +1,89 @@
+"""
+Stand-ins for Globus Auth, so that benchmarks can drive the Flask app
+without a client id, tokens or network access.
+
+Every bearer token is valid: it stands for its own identity, with the
+token as username, and its dependent tokens for the SSH servers are
+f"ssh-{token}", which benchmarks.ssh_server accepts as passwords.
+"""
+import time
+import uuid
+from typing import FrozenSet, Iterable, NamedTuple
+
+from globus_action_provider_tools.flask.apt_blueprint import ActionProviderBlueprint
+
+from provider.config import SshConfig
+
+TOKEN_LIFETIME_SECONDS = 48 * 60 * 60
+
+
+class _DependentTokens(NamedTuple):
+    by_resource_server: dict
+
+
+class StubAuthState:
+    """
+    The parts of globus_action_provider_tools.AuthState the provider uses
+    """
+
+    def __init__(self, bearer_token: str):
+        self.bearer_token = bearer_token
+        self.effective_identity = (
+            f"urn:globus:auth:identity:{uuid.uuid5(uuid.NAMESPACE_URL, bearer_token)}"
+        )
+        self.identities: FrozenSet[str] = frozenset([self.effective_identity])
+        self.groups: FrozenSet[str] = frozenset()
+        self.errors = []
+
+    @property
+    def principals(self) -> FrozenSet[str]:
+        return self.identities.union(self.groups)
+
+    def check_authorization(
+        self,
+        allowed_principals: Iterable[str],
+        allow_public: bool = False,
+        allow_all_authenticated_users: bool = False,
+    ) -> bool:
+        allowed_set = frozenset(allowed_principals)
+        return bool(
+            (allow_public and "public" in allowed_set)
+            or allowed_set.intersection(self.principals)
+            or (allow_all_authenticated_users and "all_authenticated_users" in allowed_set)
+        )
+
+    def introspect_token(self):
+        return {
+            "active": True,
+            "sub": self.effective_identity,
+            "username": f"{self.bearer_token}@example.org",
+            "exp": time.time() + TOKEN_LIFETIME_SECONDS,
+        }
+
+    def get_dependent_tokens(self, bypass_cache_lookup: bool = False):
+        scopes = {entry["scope"] for entry in SshConfig.KNOWN_SERVER_SCOPES.values()}
+        return _DependentTokens(
+            by_resource_server={
+                scope: {
+                    "scope": scope,
+                    "access_token": f"ssh-{self.bearer_token}",
+                    "expires_at_seconds": int(time.time()) + TOKEN_LIFETIME_SECONDS,
+                }
+                for scope in scopes
+            }
+        )
+
+
+class StubTokenChecker:
+    def check_token(self, access_token: str) -> StubAuthState:
+        return StubAuthState(access_token)
+
+
+def stub_auth(blueprint: ActionProviderBlueprint):
+    """
+    Make blueprint accept any bearer token, before it is registered
+    """
+    for f in list(blueprint.deferred_functions):
+        if f.__name__ == "_create_token_checker":
+            blueprint.deferred_functions.remove(f)
+    blueprint.checker = StubTokenChecker()
@@ -0,0 +1,154 @@
+"""
+Run/status/release mix against the ActionDatabase storage backends,
+from several processes at once as several pods would
+
+    poetry run python -m benchmarks.backends --workers 1 --workers 4
+    poetry run python -m benchmarks.backends --backend redis --redis-url redis://redis.internal:6379/0
+
+Without --redis-url the redis backend is measured against the in-process
+stand-in from benchmarks.resp_server, which shows protocol and round-trip
+cost but not the behaviour of a real server.
+"""
+import contextlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import typer
+
+from benchmarks.payloads import make_action
+from benchmarks.resp_server import RespServer
+from provider.local_db import ActionDatabase, LocalStore
+from provider.redis_store import RedisStore
+
+app = typer.Typer(add_completion=False)
+
+OPERATIONS = ("run", "status", "release")
+
+
+def _percentile(samples: List[float], fraction: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def _make_database(backend: str, directory: str, redis_url: Optional[str]):
+    if backend == "sqlite":
+        os.chdir(directory)
+        return ActionDatabase(store=LocalStore("bench_backends"))
+    return ActionDatabase(store=RedisStore(redis_url, namespace="bench_backends"))
+
+
+def _worker(backend, directory, redis_url, actions, output_size, start, results):
+    action_db = _make_database(backend, directory, redis_url)
+    status, request = make_action(output_size)
+    latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+    start.wait()
+    for i in range(actions):
+        action_id = f"{os.getpid()}-{i}"
+        status.action_id = action_id
+
+        began = time.perf_counter()
+        action_db.store_action_request(status, request=request, action_id=action_id)
+        latencies["run"].append(time.perf_counter() - began)
+
+        # Clients usually poll a few times before releasing
+        for _ in range(3):
+            began = time.perf_counter()
+            action_db.get_action_request(action_id)
+            latencies["status"].append(time.perf_counter() - began)
+
+        began = time.perf_counter()
+        action_db.delete_action_request(action_id)
+        latencies["release"].append(time.perf_counter() - began)
+    results.put(latencies)
+
+
+def measure(
+    backend: str,
+    workers: int,
+    actions: int,
+    output_size: int,
+    redis_url: Optional[str] = None,
+) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(
+                target=_worker,
+                args=(backend, directory, redis_url, actions, output_size, start, results),
+            )
+            for _ in range(workers)
+        ]
+        for p in procs:
+            p.start()
+        began = time.perf_counter()
+        start.set()
+        latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+        for _ in procs:
+            for op, samples in results.get().items():
+                latencies[op].extend(samples)
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - began
+
+    total = sum(len(samples) for samples in latencies.values())
+    result = {
+        "backend": backend,
+        "workers": workers,
+        "operations": total,
+        "seconds": round(elapsed, 3),
+        "ops_per_second": round(total / elapsed, 1),
+    }
+    for op, samples in latencies.items():
+        for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            result[f"{op}_{name}_ms"] = round(_percentile(samples, fraction) * 1000, 3)
+    return result
+
+
+@app.command()
+def main(
+    backend: List[str] = typer.Option(["sqlite", "redis"], help="Backends to compare"),
+    workers: List[int] = typer.Option([1, 4], help="Client process counts"),
+    actions: int = typer.Option(200, help="Actions run, polled and released per process"),
+    output_size: int = typer.Option(1024, help="Bytes of command output per action"),
+    redis_url: Optional[str] = typer.Option(
+        None, help="Redis server to use instead of the in-process stand-in"
+    ),
+    json_path: Optional[str] = typer.Option(
+        None, "--json", help="Also write the results to this file as JSON"
+    ),
+):
+    with contextlib.ExitStack() as stack:
+        if "redis" in backend and redis_url is None:
+            redis_url = stack.enter_context(RespServer()).url
+        results = [
+            measure(b, w, actions, output_size, redis_url)
+            for b in backend
+            for w in workers
+        ]
+
+    typer.echo(
+        f"{'backend':>7} {'workers':>7} {'ops/s':>9} "
+        + " ".join(f"{op + ' p50/p95/p99 ms':>28}" for op in OPERATIONS)
+    )
+    for r in results:
+        latencies = " ".join(
+            f"{r[op + '_p50_ms']:>9} {r[op + '_p95_ms']:>8} {r[op + '_p99_ms']:>9}"
+            for op in OPERATIONS
+        )
+        typer.echo(
+            f"{r['backend']:>7} {r['workers']:>7} {r['ops_per_second']:>9} {latencies}"
+        )
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"benchmark": "backends", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,68 @@
+"""
+Compare the stored-action codecs against the legacy dill format
+
+    poetry run python -m benchmarks.codec --rounds 2000 --json results.json
+"""
+import json
+import time
+from typing import List, Optional
+
+import typer
+
+from benchmarks.payloads import OUTPUT_SIZES, make_action
+from provider import codec as action_codec
+
+app = typer.Typer(add_completion=False)
+
+
+def measure(codec_name: str, output_size: int, rounds: int) -> dict:
+    status, request = make_action(output_size)
+    codec = action_codec.get_codec(codec_name)
+
+    start = time.perf_counter_ns()
+    for _ in range(rounds):
+        encoded = codec.encode(status, request)
+    encode_ns = (time.perf_counter_ns() - start) / rounds
+
+    start = time.perf_counter_ns()
+    for _ in range(rounds):
+        action_codec.decode(encoded)
+    decode_ns = (time.perf_counter_ns() - start) / rounds
+
+    return {
+        "codec": codec_name,
+        "output_bytes": output_size,
+        "row_bytes": len(encoded),
+        "encode_us": round(encode_ns / 1000, 2),
+        "decode_us": round(decode_ns / 1000, 2),
+    }
+
+
+@app.command()
+def main(
+    rounds: int = typer.Option(1000, help="Encode/decode calls per measurement"),
+    codecs: List[str] = typer.Option(
+        ["dill", "json", "json+zlib"], "--codec", help="Codecs to compare"
+    ),
+    json_path: Optional[str] = typer.Option(
+        None, "--json", help="Also write the results to this file as JSON"
+    ),
+):
+    results = [
+        measure(name, size, rounds) for size in OUTPUT_SIZES for name in codecs
+    ]
+    typer.echo(
+        f"{'codec':<10} {'output':>8} {'row bytes':>10} {'encode us':>10} {'decode us':>10}"
+    )
+    for r in results:
+        typer.echo(
+            f"{r['codec']:<10} {r['output_bytes']:>8} {r['row_bytes']:>10} "
+            f"{r['encode_us']:>10} {r['decode_us']:>10}"
+        )
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"benchmark": "codec", "rounds": rounds, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    app()
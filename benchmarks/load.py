@@ -0,0 +1,210 @@
+"""
+End-to-end load on the Flask app: clients run actions through /run, poll
+their status until they finish and release them, while the commands run
+through the SSH pool on the in-process stand-in from benchmarks.ssh_server
+
+    poetry run python -m benchmarks.load --concurrency 1 --concurrency 16
+    poetry run python -m benchmarks.load --latency 0.2 --output-size 102400
+    poetry run python -m benchmarks.load --sync
+
+Globus Auth is replaced by benchmarks.auth, each client being its own
+user.  The clients are threads calling the app through Flask's test
+client: HTTP parsing and network time are left out, and they share the
+GIL with the provider and the SSH server.
+"""
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import typer
+from flask import Flask
+
+from benchmarks.auth import stub_auth
+from benchmarks.backends import _percentile
+from benchmarks.ssh_server import SshServer
+from provider import load_ssh_provider, provider_bp
+from provider.config import SshConfig
+from provider.logs import init_logging
+from provider.ssh_pool import ssh_pool
+
+app = typer.Typer(add_completion=False)
+
+OPERATIONS = ("run", "status", "release", "complete")
+SERVER = next(iter(SshConfig.KNOWN_SERVER_SCOPES))
+
+
+def make_app() -> Flask:
+    """
+    The provider's Flask app, letting any bearer token run actions
+    """
+    os.environ.setdefault(SshConfig.CLIENT_ID_ENV, "benchmark-client")
+    os.environ.setdefault(SshConfig.CLIENT_SECRET_ENV, "benchmark-secret")
+    stub_auth(provider_bp)
+    config = dict(SshConfig.BP_CONFIG, runnable_by=["all_authenticated_users"])
+    return load_ssh_provider(Flask(__name__), config)
+
+
+@contextlib.contextmanager
+def routed_to(server: SshServer):
+    """
+    Connect the SSH pool to server whatever the server name
+    """
+    ssh_pool.close_all()
+    ssh_pool._open_socket = server.open_socket
+    try:
+        yield
+    finally:
+        del ssh_pool._open_socket
+        ssh_pool.close_all()
+
+
+def _client(
+    flask_app: Flask,
+    token: str,
+    actions: int,
+    command: str,
+    poll_interval: float,
+    latencies: Dict[str, List[float]],
+    errors: List[str],
+):
+    client = flask_app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def timed(op, call, *args, **kwargs):
+        began = time.perf_counter()
+        response = call(*args, headers=headers, **kwargs)
+        latencies[op].append(time.perf_counter() - began)
+        if response.status_code >= 400:
+            errors.append(f"{op}: HTTP {response.status_code}")
+        return response
+
+    for _ in range(actions):
+        began = time.perf_counter()
+        response = timed(
+            "run",
+            client.post,
+            "/run",
+            json={
+                "request_id": str(uuid.uuid4()),
+                "body": {"ssh_server": SERVER, "command": command},
+            },
+        )
+        if response.status_code >= 400:
+            continue
+        status = response.get_json()
+        action_id = status["action_id"]
+        while status["status"] not in ("SUCCEEDED", "FAILED"):
+            time.sleep(poll_interval)
+            status = timed("status", client.get, f"/actions/{action_id}").get_json()
+        latencies["complete"].append(time.perf_counter() - began)
+        if status["status"] == "FAILED":
+            errors.append(f"action: {status['details']}")
+        timed("release", client.post, f"/{action_id}/release")
+
+
+def measure(
+    flask_app: Flask,
+    concurrency: int,
+    actions: int,
+    latency: float,
+    output_size: int,
+    poll_interval: float,
+) -> dict:
+    command = f"run latency={latency} output={output_size}"
+    latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+    errors: List[str] = []
+    clients = [
+        threading.Thread(
+            target=_client,
+            args=(
+                flask_app,
+                f"bench-user-{i}",
+                actions,
+                command,
+                poll_interval,
+                latencies,
+                errors,
+            ),
+        )
+        for i in range(concurrency)
+    ]
+    began = time.perf_counter()
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    elapsed = time.perf_counter() - began
+
+    completed = len(latencies["complete"])
+    result = {
+        "concurrency": concurrency,
+        "actions": completed,
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "actions_per_second": round(completed / elapsed, 1),
+    }
+    for op, samples in latencies.items():
+        for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            result[f"{op}_{name}_ms"] = round(_percentile(samples, fraction) * 1000, 3)
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+@app.command()
+def main(
+    concurrency: List[int] = typer.Option([1, 8, 32], help="Concurrent client counts"),
+    actions: int = typer.Option(20, help="Actions run, polled and released per client"),
+    latency: float = typer.Option(0.05, help="Seconds each command runs"),
+    output_size: int = typer.Option(1024, help="Bytes of output of each command"),
+    poll_interval: float = typer.Option(0.01, help="Seconds between status polls"),
+    async_execution: bool = typer.Option(
+        True, "--async/--sync", help="Run commands in the background or within /run"
+    ),
+    log_level: str = typer.Option("warning", help="Level of the provider's logs"),
+    json_path: Optional[str] = typer.Option(
+        None, "--json", help="Also write the results to this file as JSON"
+    ),
+):
+    init_logging(log_level)
+    SshConfig.ASYNC_EXECUTION = async_execution
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # Actions and their output are stored in the working directory
+        os.chdir(directory)
+        try:
+            flask_app = make_app()
+            with SshServer() as server, routed_to(server):
+                results = [
+                    measure(flask_app, c, actions, latency, output_size, poll_interval)
+                    for c in concurrency
+                ]
+        finally:
+            os.chdir(cwd)
+
+    typer.echo(
+        f"{'clients':>7} {'actions/s':>9} {'errors':>6} "
+        + " ".join(f"{op + ' p50/p95/p99 ms':>28}" for op in OPERATIONS)
+    )
+    for r in results:
+        latencies = " ".join(
+            f"{r[op + '_p50_ms']:>9} {r[op + '_p95_ms']:>8} {r[op + '_p99_ms']:>9}"
+            for op in OPERATIONS
+        )
+        typer.echo(
+            f"{r['concurrency']:>7} {r['actions_per_second']:>9} {r['errors']:>6} {latencies}"
+        )
+        if "first_error" in r:
+            typer.echo(f"        first error: {r['first_error']}")
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"benchmark": "load", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    app()
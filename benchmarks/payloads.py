@@ -0,0 +1,72 @@
+import random
+import string
+import uuid
+from typing import Tuple
+
+from globus_action_provider_tools.data_types import (
+    ActionFailedDetails,
+    ActionRequest,
+    ActionStatus,
+    ActionStatusValue,
+)
+
+from provider.util import SshUtil
+
+OUTPUT_SIZES = (0, 1024, 10 * 1024, 100 * 1024)
+
+
+def command_output(size: int, seed: int = 0) -> str:
+    """
+    Text shaped like `ls -l`/build logs: printable lines of varying width
+    """
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + "  ./-_"
+    lines = []
+    length = 0
+    while length < size:
+        line = "".join(rng.choice(alphabet) for _ in range(rng.randint(20, 120)))
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)[:size]
+
+
+def make_action(
+    output_size: int = 0, failed: bool = False, seed: int = 0
+) -> Tuple[ActionStatus, ActionRequest]:
+    """
+    An (ActionStatus, ActionRequest) pair like the ones the provider
+    stores, carrying output_size bytes of command output in its details
+    """
+    identity = f"urn:globus:auth:identity:{uuid.uuid4()}"
+    request = ActionRequest(
+        request_id=str(uuid.uuid4()),
+        body={
+            "ssh_server": "ssh.my.server.edu",
+            "command": "ls -la /projects/shared/data",
+            "limit": 100_000,
+        },
+        label="Benchmark ssh action",
+        monitor_by={identity},
+        manage_by={identity},
+    )
+    output = command_output(output_size, seed)
+    if failed:
+        details = ActionFailedDetails(code="Failed", description=f"Error: {output}")
+    else:
+        details = {
+            "ssh_output": output,
+            "output_size": len(output),
+            "output_truncated": False,
+            "execution_time_ms": 1234,
+        }
+    status = ActionStatus(
+        status=ActionStatusValue.FAILED if failed else ActionStatusValue.SUCCEEDED,
+        display_status=ActionStatusValue.FAILED if failed else ActionStatusValue.SUCCEEDED,
+        creator_id=identity,
+        monitor_by=request.monitor_by,
+        manage_by=request.manage_by,
+        start_time=SshUtil.iso_tz_now(),
+        completion_time=SshUtil.iso_tz_now(),
+        details=details,
+    )
+    return status, request
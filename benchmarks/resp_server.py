@@ -0,0 +1,208 @@
+"""
+In-process stand-in for a Redis server, for tests and benchmarks of
+provider.redis_store.RedisStore when no real server is available.
+
+Only implements the commands RedisStore uses, keeping everything in a
+dict guarded by one lock.
+"""
+import fnmatch
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _write(self, reply):
+        self.wfile.write(_encode_reply(reply))
+
+    def handle(self):
+        # Versions of the WATCHed keys, and the commands queued after MULTI
+        watched: Dict[bytes, int] = {}
+        queued: Optional[List[list]] = None
+        while True:
+            command = self._read_command()
+            if command is None:
+                return
+            name = command[0].upper()
+            try:
+                if name == b"WATCH":
+                    watched.update(self.server.versions_of(command[1:]))
+                    reply = "OK"
+                elif name in (b"UNWATCH", b"DISCARD"):
+                    watched.clear()
+                    queued = None
+                    reply = "OK"
+                elif name == b"MULTI":
+                    queued = []
+                    reply = "OK"
+                elif name == b"EXEC":
+                    reply = self.server.execute_transaction(queued or [], watched)
+                    watched.clear()
+                    queued = None
+                elif queued is not None:
+                    queued.append(command)
+                    reply = "QUEUED"
+                else:
+                    reply = self.server.execute(command)
+            except Exception as e:
+                reply = RespError(str(e))
+            self._write(reply)
+
+
+class RespError(Exception):
+    pass
+
+
+def _encode_reply(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, RespError):
+        return b"-ERR %s\r\n" % str(reply).encode()
+    if isinstance(reply, bool):
+        return b":%d\r\n" % int(reply)
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, str):
+        return b"+%s\r\n" % reply.encode()
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(_encode_reply(r) for r in reply)
+    raise TypeError(f"Can't encode {reply!r}")
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """
+    Usage:
+            * with RespServer() as server:
+            *     store = RedisStore(server.url, "globus_actions")
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        super().__init__((host, port), _RespHandler)
+        self.latency = latency
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        # Bumped by every write of a key, for WATCH
+        self.versions: Dict[bytes, int] = {}
+        self.lock = threading.RLock()
+        self.commands = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+    def _live(self, key: bytes, now: float) -> Optional[bytes]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= now:
+            del self.data[key]
+            return None
+        return value
+
+    def versions_of(self, keys) -> Dict[bytes, int]:
+        with self.lock:
+            return {k: self.versions.get(k, 0) for k in keys}
+
+    def execute_transaction(self, commands, watched: Dict[bytes, int]):
+        """
+        Run commands together, or none of them (a nil reply) if a watched
+        key was written since it was watched
+        """
+        with self.lock:
+            if self.versions_of(watched) != watched:
+                return None
+            return [self.execute(command) for command in commands]
+
+    def execute(self, command):
+        if self.latency:
+            time.sleep(self.latency)
+        name = command[0].upper().decode()
+        args = command[1:]
+        now = time.time()
+        with self.lock:
+            self.commands += 1
+            if name == "PING":
+                return "PONG"
+            if name in ("AUTH", "SELECT", "FLUSHDB"):
+                if name == "FLUSHDB":
+                    self.data.clear()
+                return "OK"
+            if name == "GET":
+                return self._live(args[0], now)
+            if name == "MGET":
+                return [self._live(k, now) for k in args]
+            if name == "SET":
+                expires_at = None
+                options = [a.upper() for a in args[2:]]
+                if b"EX" in options:
+                    expires_at = now + float(args[2 + options.index(b"EX") + 1])
+                if b"PX" in options:
+                    expires_at = now + float(args[2 + options.index(b"PX") + 1]) / 1000
+                previous = self._live(args[0], now)
+                self.data[args[0]] = (args[1], expires_at)
+                self.versions[args[0]] = self.versions.get(args[0], 0) + 1
+                return previous if b"GET" in options else "OK"
+            if name == "APPEND":
+                value = (self._live(args[0], now) or b"") + args[1]
+                expires_at = self.data.get(args[0], (None, None))[1]
+                self.data[args[0]] = (value, expires_at)
+                self.versions[args[0]] = self.versions.get(args[0], 0) + 1
+                return len(value)
+            if name == "STRLEN":
+                return len(self._live(args[0], now) or b"")
+            if name == "GETRANGE":
+                value = self._live(args[0], now) or b""
+                start, end = int(args[1]), int(args[2])
+                if end < 0:
+                    end += len(value)
+                return value[start:end + 1]
+            if name == "PEXPIRE":
+                value = self._live(args[0], now)
+                if value is None:
+                    return 0
+                self.data[args[0]] = (value, now + float(args[1]) / 1000)
+                return 1
+            if name == "DEL":
+                for k in args:
+                    self.versions[k] = self.versions.get(k, 0) + 1
+                return sum(self.data.pop(k, None) is not None for k in args)
+            if name == "SCAN":
+                pattern = b"*"
+                if b"MATCH" in [a.upper() for a in args]:
+                    pattern = args[[a.upper() for a in args].index(b"MATCH") + 1]
+                keys = [
+                    k for k in list(self.data)
+                    if fnmatch.fnmatchcase(k.decode(), pattern.decode())
+                    and self._live(k, now) is not None
+                ]
+                return [b"0", keys]
+            raise RespError(f"unknown command '{name}'")
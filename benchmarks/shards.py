@@ -0,0 +1,78 @@
+"""
+Multi-process write throughput of LocalStore for several shard counts
+
+    poetry run python -m benchmarks.shards --workers 1 --workers 4 --shards 1 --shards 8
+"""
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+from typing import List, Optional
+
+import typer
+
+from provider.local_db import LocalStore
+
+app = typer.Typer(add_completion=False)
+
+
+def _writer(directory: str, shard_count: int, writes: int, value_bytes: int, start):
+    os.chdir(directory)
+    store = LocalStore("bench_shards", shard_count=shard_count)
+    value = os.urandom(value_bytes // 2).hex()
+    start.wait()
+    for _ in range(writes):
+        store.put(uuid.uuid4().hex, value)
+
+
+def measure(shard_count: int, workers: int, writes: int, value_bytes: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        start = multiprocessing.Event()
+        procs = [
+            multiprocessing.Process(
+                target=_writer,
+                args=(directory, shard_count, writes, value_bytes, start),
+            )
+            for _ in range(workers)
+        ]
+        for p in procs:
+            p.start()
+        began = time.perf_counter()
+        start.set()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - began
+    return {
+        "shards": shard_count,
+        "workers": workers,
+        "writes": writes * workers,
+        "seconds": round(elapsed, 3),
+        "writes_per_second": round(writes * workers / elapsed, 1),
+    }
+
+
+@app.command()
+def main(
+    workers: List[int] = typer.Option([1, 2, 4, 8], help="Writer process counts"),
+    shards: List[int] = typer.Option([1, 4, 8], help="Shard counts to compare"),
+    writes: int = typer.Option(500, help="Writes per process"),
+    value_bytes: int = typer.Option(1024, help="Size of each stored value"),
+    json_path: Optional[str] = typer.Option(
+        None, "--json", help="Also write the results to this file as JSON"
+    ),
+):
+    results = [
+        measure(s, w, writes, value_bytes) for s in shards for w in workers
+    ]
+    typer.echo(f"{'shards':>6} {'workers':>7} {'writes/s':>10}")
+    for r in results:
+        typer.echo(f"{r['shards']:>6} {r['workers']:>7} {r['writes_per_second']:>10}")
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"benchmark": "shards", "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,193 @@
+"""
+In-process stand-in for an OAuth SSH server, for tests and benchmarks
+that run commands through provider.ssh_pool without a real server.
+
+It accepts a (dependent) access token as the password of any user, like
+an OAuth SSH server does, and answers commands from a script instead of
+running them: see scripted_reply().
+"""
+import shlex
+import socket
+import socketserver
+import threading
+import time
+from typing import Callable, NamedTuple, Optional, Set
+
+import paramiko
+
+from benchmarks.payloads import command_output
+
+_host_key: Optional[paramiko.RSAKey] = None
+_host_key_lock = threading.Lock()
+
+
+def host_key() -> paramiko.RSAKey:
+    # Generating a key takes a while, every server shares one
+    global _host_key
+    with _host_key_lock:
+        if _host_key is None:
+            _host_key = paramiko.RSAKey.generate(2048)
+        return _host_key
+
+
+class Reply(NamedTuple):
+    stdout: bytes = b""
+    stderr: bytes = b""
+    exit_status: int = 0
+    latency: float = 0.0
+
+
+def scripted_reply(command: str) -> Reply:
+    """
+    Reply to commands made of key=value words, in any order:
+
+            * latency=0.05: seconds before the command prints and exits
+            * output=4096: bytes of stdout, shaped like command output
+            * stderr=100: bytes of stderr
+            * exit=1: exit status
+
+    e.g. "run latency=0.2 output=10240".  Other words are ignored, so any
+    other command succeeds right away without output.
+    """
+    options = {}
+    for word in shlex.split(command):
+        name, _, value = word.partition("=")
+        if name in ("latency", "output", "stderr", "exit") and value:
+            options[name] = value
+    return Reply(
+        stdout=command_output(int(options.get("output", 0))).encode(),
+        stderr=command_output(int(options.get("stderr", 0)), seed=1).encode(),
+        exit_status=int(options.get("exit", 0)),
+        latency=float(options.get("latency", 0)),
+    )
+
+
+class _SessionServer(paramiko.ServerInterface):
+    def __init__(self, server: "SshServer"):
+        self.server = server
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if self.server.accepts(password):
+            with self.server.lock:
+                self.server.logins += 1
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(
+            target=self.server.run_command,
+            args=(channel, command.decode("utf-8", "replace")),
+            daemon=True,
+        ).start()
+        return True
+
+
+class _SshHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        transport = paramiko.Transport(self.request)
+        transport.add_server_key(host_key())
+        with self.server.lock:
+            self.server.transports.add(transport)
+        # The transport only keeps weak references to its channels
+        channels = set()
+        try:
+            transport.start_server(server=_SessionServer(self.server))
+            while transport.is_active():
+                # Commands are served from check_channel_exec_request
+                channel = transport.accept(0.5)
+                if channel is not None:
+                    channels.add(channel)
+                channels = {c for c in channels if not c.closed}
+        except (paramiko.SSHException, EOFError, OSError):
+            pass
+        finally:
+            transport.close()
+            with self.server.lock:
+                self.server.transports.discard(transport)
+
+
+class SshServer(socketserver.ThreadingTCPServer):
+    """
+    Usage:
+            * with SshServer() as server:
+            *     ssh_pool._open_socket = server.open_socket
+
+    passwords are the tokens accepted, any non-empty one when None.
+    reply maps each command to the Reply sent back, scripted_reply by
+    default.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        passwords: Optional[Set[str]] = None,
+        reply: Callable[[str], Reply] = scripted_reply,
+    ):
+        super().__init__((host, port), _SshHandler)
+        self.passwords = passwords
+        self.reply = reply
+        self.lock = threading.Lock()
+        self.transports: Set[paramiko.Transport] = set()
+        self.logins = 0
+        self.commands = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        host_key()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+        with self.lock:
+            transports = list(self.transports)
+        for transport in transports:
+            transport.close()
+
+    def open_socket(self, server: str, port: int, timeout: float) -> socket.socket:
+        """
+        Replacement for SshConnectionPool._open_socket connecting every
+        server name and port to this server
+        """
+        return socket.create_connection(self.server_address[:2], timeout=timeout)
+
+    def accepts(self, password: str) -> bool:
+        if self.passwords is None:
+            return bool(password)
+        return password in self.passwords
+
+    def run_command(self, channel: paramiko.Channel, command: str):
+        with self.lock:
+            self.commands += 1
+        try:
+            reply = self.reply(command)
+            deadline = time.monotonic() + reply.latency
+            while time.monotonic() < deadline:
+                if channel.closed:
+                    # Stopped by the client, e.g. cancelled or timed out
+                    return
+                time.sleep(min(0.01, max(deadline - time.monotonic(), 0)))
+            if reply.stdout:
+                channel.sendall(reply.stdout)
+            if reply.stderr:
+                channel.sendall_stderr(reply.stderr)
+            channel.send_exit_status(reply.exit_status)
+            # The client closes the channel once it has the exit status;
+            # closing it here could overtake the reply to the exec request
+            channel.shutdown_write()
+        except (OSError, EOFError, paramiko.SSHException):
+            pass
@@ -0,0 +1,212 @@
+"""
+Where the time of storing actions goes: LocalStore put/get/delete of
+encoded rows, the same through ActionDatabase with the codec round trip,
+and the space each row takes on disk, for command outputs of 0 to 100 KB
+
+    poetry run python -m benchmarks.storage --json storage.json
+    poetry run python -m benchmarks.storage --codec dill --workers 1 --workers 8
+
+With several workers every process runs the same operations on its own
+actions in one shared database file.  Results written with --json carry
+the git commit they were measured at, to compare runs between commits.
+"""
+import json
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import typer
+
+from benchmarks import codec as codec_benchmark
+from benchmarks.payloads import OUTPUT_SIZES, make_action
+from provider.config import SshConfig
+from provider.local_db import ActionDatabase, LocalStore
+
+app = typer.Typer(add_completion=False)
+
+OPERATIONS = ("put", "get", "delete")
+TABLE = "bench_storage"
+
+
+def _store_ops(store: LocalStore, value: bytes, rows: int) -> Dict[str, float]:
+    keys = [f"{os.getpid()}-store-{i}" for i in range(rows)]
+    seconds = {}
+    began = time.perf_counter()
+    for key in keys:
+        store.put(key, value)
+    seconds["put"] = time.perf_counter() - began
+    began = time.perf_counter()
+    for key in keys:
+        store.get(key)
+    seconds["get"] = time.perf_counter() - began
+    began = time.perf_counter()
+    for key in keys:
+        store.delete(key)
+    seconds["delete"] = time.perf_counter() - began
+    return seconds
+
+
+def _database_ops(action_db: ActionDatabase, output_size: int, rows: int) -> Dict[str, float]:
+    status, request = make_action(output_size)
+    action_ids = [f"{os.getpid()}-action-{i}" for i in range(rows)]
+    seconds = {}
+    began = time.perf_counter()
+    for action_id in action_ids:
+        status.action_id = action_id
+        action_db.store_action_request(status, request=request, action_id=action_id)
+    seconds["put"] = time.perf_counter() - began
+    began = time.perf_counter()
+    for action_id in action_ids:
+        action_db.get_action_request(action_id)
+    seconds["get"] = time.perf_counter() - began
+    began = time.perf_counter()
+    for action_id in action_ids:
+        action_db.delete_action_request(action_id)
+    seconds["delete"] = time.perf_counter() - began
+    return seconds
+
+
+def _worker(directory, codec_name, output_size, rows, start, results):
+    os.chdir(directory)
+    store = LocalStore(TABLE)
+    action_db = ActionDatabase(store=store, codec=codec_name)
+    status, request = make_action(output_size)
+    value = action_db.codec.encode(status, request)
+    start.wait()
+    results.put(
+        {
+            "store": _store_ops(store, value, rows),
+            "database": _database_ops(action_db, output_size, rows),
+        }
+    )
+
+
+def disk_bytes_per_row(codec_name: str, output_size: int, rows: int) -> float:
+    """
+    Size of the database file divided by its rows, once the WAL is
+    checkpointed into it
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            store = LocalStore(TABLE)
+            action_db = ActionDatabase(store=store, codec=codec_name)
+            status, request = make_action(output_size)
+            action_db.store_action_requests(
+                (status.copy(update={"action_id": f"action-{i}"}), request)
+                for i in range(rows)
+            )
+            store._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            size = os.path.getsize(store._file_name())
+            store.delete_database()
+        finally:
+            os.chdir(cwd)
+    return round(size / rows, 1)
+
+
+def measure(codec_name: str, output_size: int, workers: int, rows: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(
+                target=_worker,
+                args=(directory, codec_name, output_size, rows, start, results),
+            )
+            for _ in range(workers)
+        ]
+        for p in procs:
+            p.start()
+        start.set()
+        seconds: Dict[str, Dict[str, float]] = {"store": {}, "database": {}}
+        for _ in procs:
+            for layer, by_op in results.get().items():
+                for op, elapsed in by_op.items():
+                    # The workers run side by side, the slowest sets the pace
+                    seconds[layer][op] = max(seconds[layer].get(op, 0.0), elapsed)
+        for p in procs:
+            p.join()
+
+    result = {
+        "codec": codec_name,
+        "output_bytes": output_size,
+        "workers": workers,
+    }
+    for layer, by_op in seconds.items():
+        for op in OPERATIONS:
+            result[f"{layer}_{op}_per_second"] = round(rows * workers / by_op[op], 1)
+    return result
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@app.command()
+def main(
+    codecs: List[str] = typer.Option(
+        [SshConfig.ACTION_CODEC, "dill"], "--codec", help="Codecs to compare"
+    ),
+    workers: List[int] = typer.Option([1, 4], help="Process counts"),
+    rows: int = typer.Option(500, help="Rows put, read and deleted per process"),
+    rounds: int = typer.Option(500, help="Encode/decode calls per measurement"),
+    json_path: Optional[str] = typer.Option(
+        None, "--json", help="Also write the results to this file as JSON"
+    ),
+):
+    results = []
+    for name in codecs:
+        for size in OUTPUT_SIZES:
+            codec_result = codec_benchmark.measure(name, size, rounds)
+            disk_bytes = disk_bytes_per_row(name, size, rows)
+            for w in workers:
+                result = measure(name, size, w, rows)
+                result.update(
+                    row_bytes=codec_result["row_bytes"],
+                    disk_bytes_per_row=disk_bytes,
+                    encode_us=codec_result["encode_us"],
+                    decode_us=codec_result["decode_us"],
+                )
+                results.append(result)
+
+    typer.echo(
+        f"{'codec':<10} {'output':>7} {'workers':>7} {'row B':>7} {'disk B':>8} "
+        f"{'enc us':>7} {'dec us':>7} "
+        + " ".join(f"{'store ' + op + '/s':>16}" for op in OPERATIONS)
+        + " "
+        + " ".join(f"{'db ' + op + '/s':>13}" for op in OPERATIONS)
+    )
+    for r in results:
+        typer.echo(
+            f"{r['codec']:<10} {r['output_bytes']:>7} {r['workers']:>7} "
+            f"{r['row_bytes']:>7} {r['disk_bytes_per_row']:>8} "
+            f"{r['encode_us']:>7} {r['decode_us']:>7} "
+            + " ".join(f"{r['store_' + op + '_per_second']:>16}" for op in OPERATIONS)
+            + " "
+            + " ".join(f"{r['database_' + op + '_per_second']:>13}" for op in OPERATIONS)
+        )
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(
+                {
+                    "benchmark": "storage",
+                    "commit": _commit(),
+                    "rows": rows,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from globus_action_provider_tools.data_types import ActionRequest, ActionStatus
+
+from provider.config import SshConfig
+
+logger = logging.getLogger(__name__)
+
+StatusAndRequest = Tuple[ActionStatus, Optional[ActionRequest]]
+
+
+class ActionCache:
+    """
+    Bounded, per-process LRU cache of decoded (ActionStatus, ActionRequest)
+    pairs in front of the ActionDatabase, so polling a finished action
+    doesn't read and decode its row again.
+
+    Entries expire after ttl_seconds, or active_ttl_seconds while the
+    action is still running, since another worker may update it in the
+    database without this process seeing the write.  Copies go in and
+    out so callers may modify what they get.  The cache is emptied after
+    a fork.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SshConfig.ACTION_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = SshConfig.ACTION_CACHE_TTL_SECONDS,
+        active_ttl_seconds: float = SshConfig.ACTION_CACHE_ACTIVE_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.active_ttl_seconds = active_ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, StatusAndRequest]]" = OrderedDict()
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _copy(status: ActionStatus, request: Optional[ActionRequest]) -> StatusAndRequest:
+        return (
+            status.copy(deep=True),
+            request.copy(deep=True) if request is not None else None,
+        )
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._entries = OrderedDict()
+            self._pid = os.getpid()
+
+    def get(self, action_id: str) -> Optional[StatusAndRequest]:
+        with self._lock:
+            self._check_fork()
+            entry = self._entries.get(action_id)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[action_id]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(action_id)
+            self.hits += 1
+            cached = entry[1]
+        return self._copy(*cached)
+
+    def put(
+        self,
+        action_id: str,
+        status: ActionStatus,
+        request: Optional[ActionRequest] = None,
+    ):
+        if self.max_entries <= 0:
+            return
+        ttl = self.ttl_seconds if status.is_complete() else self.active_ttl_seconds
+        if ttl <= 0:
+            self.invalidate(action_id)
+            return
+        entry = (time.monotonic() + ttl, self._copy(status, request))
+        with self._lock:
+            self._check_fork()
+            self._entries[action_id] = entry
+            self._entries.move_to_end(action_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def is_complete(self, action_id: str) -> bool:
+        """
+        True if action_id is cached as finished, i.e. the stored row is
+        final and needn't be written again
+        """
+        with self._lock:
+            self._check_fork()
+            entry = self._entries.get(action_id)
+            return (
+                entry is not None
+                and entry[0] > time.monotonic()
+                and entry[1][0].is_complete()
+            )
+
+    def invalidate(self, action_id: str):
+        with self._lock:
+            self._entries.pop(action_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+action_cache = ActionCache()
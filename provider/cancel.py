@@ -0,0 +1,149 @@
+import contextlib
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+from paramiko.channel import Channel
+
+from provider.capture import send_signal
+from provider.config import SshConfig
+
+logger = logging.getLogger(__name__)
+
+StoredCheck = Callable[[str], bool]
+
+
+def root_action_id(output_id: str) -> str:
+    """
+    The action a server or step of it belongs to.  Those run under ids
+    like "<action_id>_0" or "<action_id>_s1", and action ids themselves
+    are alphanumeric.
+    """
+    return output_id.split("_", 1)[0]
+
+
+class CancelRegistry:
+    """
+    Keeps track of what each running action holds in this process, its
+    open session channels and queued executor futures, so that
+    cancelling the action can stop its remote commands and give back
+    its slots right away.
+
+    Actions cancelled through another worker process are noticed by
+    running commands through a watcher, which looks at the stored status
+    of the action every poll_interval seconds.
+    """
+
+    def __init__(self, poll_interval: float = SshConfig.CANCEL_POLL_SECONDS):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._channels: Dict[str, List[Channel]] = {}
+        self._futures: Dict[str, Future] = {}
+        self._cancelled: Set[str] = set()
+        self._last_checked: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def track(self, output_id: str, channel: Channel) -> Iterator[None]:
+        """
+        Register the channel a command of an action runs on while it runs
+        """
+        action_id = root_action_id(output_id)
+        with self._lock:
+            self._channels.setdefault(action_id, []).append(channel)
+            cancelled = action_id in self._cancelled
+        if cancelled:
+            self._stop(channel)
+        try:
+            yield
+        finally:
+            with self._lock:
+                channels = self._channels.get(action_id, [])
+                if channel in channels:
+                    channels.remove(channel)
+                if not channels:
+                    self._channels.pop(action_id, None)
+
+    def track_future(self, action_id: str, future: Future):
+        """
+        Register the executor future of an action until it is done
+        """
+        with self._lock:
+            self._futures[action_id] = future
+
+        def forget(_):
+            with self._lock:
+                if self._futures.get(action_id) is future:
+                    del self._futures[action_id]
+
+        future.add_done_callback(forget)
+
+    def cancel(self, action_id: str) -> bool:
+        """
+        Stop everything the action is running in this process.  Returns
+        whether anything was running.
+        """
+        with self._lock:
+            self._cancelled.add(action_id)
+            channels = list(self._channels.get(action_id, []))
+            future = self._futures.pop(action_id, None)
+        stopped = bool(channels)
+        if future is not None:
+            # Only succeeds while it is still queued in the executor
+            stopped = future.cancel() or stopped
+        for channel in channels:
+            self._stop(channel)
+        if stopped:
+            logger.info(f"Cancelled running action {action_id}")
+        return stopped
+
+    def is_cancelled(self, output_id: str) -> bool:
+        with self._lock:
+            return root_action_id(output_id) in self._cancelled
+
+    def forget(self, action_id: str):
+        """
+        Drop the record of a cancellation once the action is gone
+        """
+        with self._lock:
+            self._cancelled.discard(action_id)
+            self._last_checked.pop(action_id, None)
+
+    def watcher(
+        self, output_id: str, check_stored: Optional[StoredCheck] = None
+    ) -> Callable[[], bool]:
+        """
+        Return a function telling a running command whether its action
+        was cancelled, here or, via check_stored(action_id), elsewhere
+        """
+        action_id = root_action_id(output_id)
+
+        def cancelled() -> bool:
+            if self.is_cancelled(action_id):
+                return True
+            if check_stored is None:
+                return False
+            now = time.monotonic()
+            with self._lock:
+                if now - self._last_checked.get(action_id, 0.0) < self.poll_interval:
+                    return False
+                self._last_checked[action_id] = now
+            if check_stored(action_id):
+                with self._lock:
+                    self._cancelled.add(action_id)
+                return True
+            return False
+
+        return cancelled
+
+    @staticmethod
+    def _stop(channel: Channel):
+        try:
+            send_signal(channel)
+        except Exception as e:
+            logger.info(f"Could not signal cancelled command: {e}")
+        channel.close()
+
+
+cancel_registry = CancelRegistry()
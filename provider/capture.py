@@ -0,0 +1,177 @@
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+from paramiko.channel import Channel
+from paramiko.common import cMSG_CHANNEL_REQUEST
+from paramiko.message import Message
+
+from provider.config import SshConfig
+from provider.output_store import OutputStore, output_store
+
+logger = logging.getLogger(__name__)
+
+
+def send_signal(channel: Channel, signal: str = "TERM"):
+    """
+    Ask the server to send a signal (without the SIG prefix) to the
+    remote command, see RFC 4254 section 6.9.  Paramiko only implements
+    the server side of this request; servers that don't support it
+    ignore it.
+    """
+    m = Message()
+    m.add_byte(cMSG_CHANNEL_REQUEST)
+    m.add_int(channel.remote_chanid)
+    m.add_string("signal")
+    m.add_boolean(False)
+    m.add_string(signal)
+    channel.transport._send_user_message(m)
+
+
+class OutputCapture:
+    """
+    Streams stdout and stderr of a running command into the output store
+
+    Both streams are drained in the same loop using recv_ready() and
+    recv_stderr_ready(), so a remote filling one stream's window can never
+    stall us while we wait on the other.  Chunks go straight to the output
+    store; once a stream reaches its byte limit the rest is still read
+    (so the remote does not block) but discarded.
+    """
+
+    def __init__(
+        self,
+        action_id: str,
+        store: OutputStore = output_store,
+        max_stdout: int = SshConfig.OUTPUT_READ_BYTES,
+        max_stderr: int = SshConfig.ERROR_READ_BYTES,
+        chunk_size: int = SshConfig.CAPTURE_CHUNK_BYTES,
+        poll_interval: float = SshConfig.CAPTURE_POLL_SECONDS,
+    ):
+        self.action_id = action_id
+        self.store = store
+        self.limits = {"stdout": max_stdout, "stderr": max_stderr}
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.stored: Dict[str, int] = {"stdout": 0, "stderr": 0}
+        self.received: Dict[str, int] = {"stdout": 0, "stderr": 0}
+        # Exit status of the remote command, None if it didn't report one
+        self.exit_status: Optional[int] = None
+        self.timed_out = False
+        self.cancelled = False
+
+    def truncated(self, stream: str) -> bool:
+        return self.received[stream] > self.stored[stream]
+
+    def _write(self, writer, stream: str, data: bytes):
+        self.received[stream] += len(data)
+        room = self.limits[stream] - self.stored[stream]
+        if room > 0:
+            data = data[:room]
+            writer.write(data)
+            self.stored[stream] += len(data)
+            self.store.notify_written()
+
+    @staticmethod
+    def _finished(channel: Channel) -> bool:
+        return (
+            channel.exit_status_ready() or channel.eof_received or channel.closed
+        ) and not (channel.recv_ready() or channel.recv_stderr_ready())
+
+    def run(
+        self,
+        channel: Channel,
+        deadline: Optional[float] = None,
+        cancelled: Optional[Callable[[], bool]] = None,
+    ):
+        """
+        Capture until the remote command exits and both streams are drained.
+
+        If it is still running at deadline (a time.monotonic() value), or
+        once cancelled() returns True, the command is sent SIGTERM and the
+        channel is closed, which frees this thread even if the server
+        ignores the signal.  Output captured so far is kept.
+        """
+        self.store.delete(self.action_id)
+        stdout = self.store.writer(self.action_id, "stdout")
+        stderr = self.store.writer(self.action_id, "stderr")
+        idle_sleep = 0.001
+        try:
+            while True:
+                progressed = False
+                if channel.recv_ready():
+                    self._write(stdout, "stdout", channel.recv(self.chunk_size))
+                    progressed = True
+                if channel.recv_stderr_ready():
+                    self._write(
+                        stderr, "stderr", channel.recv_stderr(self.chunk_size)
+                    )
+                    progressed = True
+                if cancelled is not None and cancelled():
+                    # Keep what was just read, then stop
+                    self.cancelled = True
+                    self._stop(channel, "was cancelled")
+                    break
+                if progressed:
+                    idle_sleep = 0.001
+                    continue
+                if self._finished(channel):
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    self.timed_out = True
+                    self._stop(channel, "timed out")
+                    break
+                time.sleep(idle_sleep)
+                idle_sleep = min(idle_sleep * 2, self.poll_interval)
+        finally:
+            stdout.close()
+            stderr.close()
+            # Let readers tailing the output see that it ended
+            self.store.notify_written()
+        if not self.cancelled and cancelled is not None and cancelled():
+            # Cancelled by closing the channel from another thread
+            self.cancelled = True
+        if not (self.timed_out or self.cancelled):
+            self._wait_for_exit(channel, deadline, cancelled)
+        for stream in ("stdout", "stderr"):
+            if self.truncated(stream):
+                logger.info(
+                    f"Truncated {stream} of {self.action_id} to "
+                    f"{self.stored[stream]} of {self.received[stream]} bytes"
+                )
+
+    def _wait_for_exit(
+        self,
+        channel: Channel,
+        deadline: Optional[float],
+        cancelled: Optional[Callable[[], bool]],
+    ):
+        """
+        Wait for the exit status, which OpenSSH sends after the end of the
+        output, still stopping the command at deadline or once cancelled
+        """
+        while not channel.exit_status_ready():
+            if cancelled is not None and cancelled():
+                self.cancelled = True
+                self._stop(channel, "was cancelled")
+                return
+            wait = self.poll_interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    self.timed_out = True
+                    self._stop(channel, "timed out")
+                    return
+            channel.status_event.wait(wait)
+        self.exit_status = channel.recv_exit_status()
+
+    def _stop(self, channel: Channel, reason: str):
+        logger.info(f"Command of {self.action_id} {reason}, closing its channel")
+        try:
+            send_signal(channel)
+        except Exception as e:
+            logger.info(f"Could not signal command of {self.action_id}: {e}")
+        channel.close()
+
+    def text(self, stream: str) -> str:
+        return self.store.read(self.action_id, stream).decode("utf-8", "replace")
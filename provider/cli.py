@@ -0,0 +1,70 @@
+"""
+Maintenance commands for the SSH Action Provider's local storage
+
+    poetry run python -m provider.cli --help
+"""
+import typer
+
+from provider.config import SshConfig
+from provider.expiry import ExpirySweeper
+from provider.local_db import ActionDatabase, LocalStore, get_action_database
+
+app = typer.Typer(add_completion=False)
+
+
+@app.callback()
+def main():
+    """
+    Maintenance commands for the SSH Action Provider's local storage
+    """
+
+
+@app.command("rebalance-shards")
+def rebalance_shards(
+    to_count: int = typer.Option(
+        SshConfig.DB_SHARD_COUNT, "--to", help="New number of shards"
+    ),
+    from_count: int = typer.Option(
+        1, "--from", help="Number of shards the rows are stored in now"
+    ),
+    table: str = typer.Option(
+        ActionDatabase._DEFAULT_ACTION_NAME, help="Table (and file prefix) to move"
+    ),
+    batch_size: int = typer.Option(1000, help="Rows written per transaction"),
+):
+    """
+    Move a table's rows to a different number of shard files.  Stop the
+    service first, then set SshConfig.DB_SHARD_COUNT to the new count.
+    """
+    moved = LocalStore.rebalance(table, from_count, to_count, batch_size=batch_size)
+    typer.echo(f"Moved {moved} rows of {table} from {from_count} to {to_count} shards")
+
+
+@app.command("sweep-expired")
+def sweep_expired(
+    batch_size: int = typer.Option(
+        SshConfig.EXPIRY_SWEEP_BATCH_SIZE, help="Rows deleted per transaction"
+    ),
+    full_vacuum: bool = typer.Option(
+        False,
+        "--full-vacuum",
+        help="Rewrite the files with VACUUM afterwards, also enabling "
+        "incremental vacuum on files created before it was configured",
+    ),
+):
+    """
+    Remove expired actions and their output now, rather than waiting for
+    the service's background sweeper
+    """
+    sweeper = ExpirySweeper(batch_size=batch_size)
+    reaped = sweeper.sweep()
+    if full_vacuum:
+        get_action_database().vacuum()
+    typer.echo(
+        f"Reaped {reaped['actions_reaped']} actions and "
+        f"{reaped['output_files_reaped']} output files"
+    )
+
+
+if __name__ == "__main__":
+    app()
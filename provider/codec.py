@@ -0,0 +1,183 @@
+import abc
+import json
+import logging
+import zlib
+from typing import Dict, Optional, Tuple
+
+import dill
+from globus_action_provider_tools.data_types import (
+    ActionRequest,
+    ActionStatus,
+    ActionStatusValue,
+    ExtensibleCodeDescription,
+)
+from pydantic.datetime_parse import parse_datetime, parse_duration
+from pydantic.json import pydantic_encoder
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of encoded rows changes; decode() keeps reading
+# every older version it knows about
+CODEC_FORMAT_VERSION = 1
+_HEADER_SEPARATOR = b":"
+
+StatusAndRequest = Tuple[Optional[ActionStatus], Optional[ActionRequest]]
+
+
+class ActionCodec(abc.ABC):
+    """
+    Serializes the (ActionStatus, ActionRequest) pair stored per action.
+
+    Encoded rows start with a header naming the format version and the
+    codec, e.g. b"v1:json:{...}", so rows written by any registered codec
+    can be read back regardless of which codec is configured for writing.
+    """
+
+    name = ""
+
+    def header(self) -> bytes:
+        return b"v%d:%s:" % (CODEC_FORMAT_VERSION, self.name.encode("ascii"))
+
+    def encode(self, status: ActionStatus, request: Optional[ActionRequest]) -> bytes:
+        return self.header() + self.dumps(status, request)
+
+    @abc.abstractmethod
+    def dumps(self, status: ActionStatus, request: Optional[ActionRequest]) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def loads(self, payload: bytes) -> StatusAndRequest:
+        pass
+
+
+def _parse_optional(parse, value):
+    return parse(value) if value is not None else None
+
+
+def _status_from_json(fields: dict) -> ActionStatus:
+    """
+    Rebuild an ActionStatus that JsonCodec wrote without validating it
+    again: only the fields whose type JSON doesn't keep are converted
+    """
+    details = fields.get("details")
+    if isinstance(details, dict) and "code" in details and "description" in details:
+        # What validation makes of failed and inactive details
+        fields["details"] = ExtensibleCodeDescription.construct(**details)
+    fields["status"] = ActionStatusValue(fields["status"])
+    fields["completion_time"] = _parse_optional(
+        parse_datetime, fields.get("completion_time")
+    )
+    fields["release_after"] = _parse_optional(
+        parse_duration, fields.get("release_after")
+    )
+    for name in ("monitor_by", "manage_by"):
+        if fields.get(name) is not None:
+            fields[name] = set(fields[name])
+    return ActionStatus.construct(**fields)
+
+
+def _request_from_json(fields: dict) -> ActionRequest:
+    fields["deadline"] = _parse_optional(parse_datetime, fields.get("deadline"))
+    fields["release_after"] = _parse_optional(
+        parse_duration, fields.get("release_after")
+    )
+    for name in ("monitor_by", "manage_by"):
+        if fields.get(name) is not None:
+            fields[name] = set(fields[name])
+    return ActionRequest.construct(**fields)
+
+
+class JsonCodec(ActionCodec):
+    """
+    Plain JSON of the pydantic models.  Rows are only ever written from
+    validated models, so they are rebuilt without validating them again,
+    which would make reading several times slower.
+    """
+
+    name = "json"
+
+    def dumps(self, status, request):
+        return json.dumps(
+            {
+                "status": status.dict(),
+                "request": request.dict() if request is not None else None,
+            },
+            default=pydantic_encoder,
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+    def loads(self, payload):
+        action_object = json.loads(payload)
+        request = action_object.get("request")
+        return (
+            _status_from_json(action_object["status"]),
+            _request_from_json(request) if request is not None else None,
+        )
+
+
+class CompressedJsonCodec(JsonCodec):
+    """
+    JSON codec with zlib compression, for rows carrying large details
+    """
+
+    name = "json+zlib"
+    level = 1
+
+    def dumps(self, status, request):
+        return zlib.compress(JsonCodec.dumps(self, status, request), self.level)
+
+    def loads(self, payload):
+        return JsonCodec.loads(self, zlib.decompress(payload))
+
+
+class DillCodec(ActionCodec):
+    """
+    The original storage format.  Rows written before codecs existed are
+    bare dill pickles without a header and are read with this codec.
+    """
+
+    name = "dill"
+
+    def dumps(self, status, request):
+        return dill.dumps({"status": status, "request": request})
+
+    def loads(self, payload):
+        action_object = dill.loads(payload)
+        assert "status" in action_object
+        assert "request" in action_object
+        return action_object.get("status", None), action_object.get("request", None)
+
+
+_CODECS: Dict[str, ActionCodec] = {}
+
+
+def register_codec(codec: ActionCodec):
+    _CODECS[codec.name] = codec
+
+
+def get_codec(name: str) -> ActionCodec:
+    try:
+        return _CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown action codec {name}")
+
+
+for _codec in (JsonCodec(), CompressedJsonCodec(), DillCodec()):
+    register_codec(_codec)
+
+
+def decode(data) -> Tuple[Optional[ActionStatus], Optional[ActionRequest], ActionCodec]:
+    """
+    Decode a stored row, returning the codec that wrote it alongside
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if data.startswith(b"v"):
+        version, name, payload = data[1:].split(_HEADER_SEPARATOR, 2)
+        if int(version) > CODEC_FORMAT_VERSION:
+            raise ValueError(f"Action stored with newer format version {int(version)}")
+        codec = get_codec(name.decode("ascii"))
+    else:
+        codec, payload = get_codec(DillCodec.name), data
+    status, request = codec.loads(payload)
+    return status, request, codec
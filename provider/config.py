@@ -3,6 +3,169 @@ class SshConfig:
     ERROR_READ_BYTES = 10000
     OUTPUT_READ_BYTES = 100000
 
+    # Port of the SSH servers, unless their KNOWN_SERVER_SCOPES entry sets
+    # a "port" of its own
+    SSH_PORT = 22
+
+    # Pooled, reusable SSH transports (see provider/ssh_pool.py).  Those
+    # idle for SSH_POOL_IDLE_TIMEOUT_SECONDS are closed by a thread that
+    # looks for them every SSH_POOL_EVICT_INTERVAL_SECONDS (0 disables it)
+    SSH_POOL_MAX_PER_SERVER = 8
+    SSH_POOL_IDLE_TIMEOUT_SECONDS = 300
+    SSH_POOL_EVICT_INTERVAL_SECONDS = 60
+    SSH_POOL_KEEPALIVE_SECONDS = 30
+    # OpenSSH allows MaxSessions (default 10) channels per connection
+    SSH_POOL_MAX_CHANNELS_PER_TRANSPORT = 8
+
+    # Asynchronous execution: /run stores the action as ACTIVE and the
+    # command runs on a bounded pool of background threads
+    # (see provider/executor.py).  Off by default, so that /run and status
+    # polls run the command within the request as before.
+    ASYNC_EXECUTION = False
+    EXECUTOR_MAX_WORKERS = 32
+    EXECUTOR_MAX_PENDING = 1000
+    # Actions finding the executor saturated try again this much later,
+    # keeping their session slot on the server meanwhile
+    EXECUTOR_SATURATED_RETRY_SECONDS = 0.5
+
+    # Simultaneous SSH sessions per server (see provider/scheduler.py);
+    # keep it below the server's sshd MaxStartups/MaxSessions.  A server's
+    # KNOWN_SERVER_SCOPES entry can set its own "max_sessions".  Up to
+    # SERVER_MAX_QUEUED more actions per server wait their turn, taken
+    # round-robin by identity, before new ones fail as ServerBusy.
+    # Synchronous mode waits at most SERVER_QUEUE_TIMEOUT_SECONDS.
+    SERVER_MAX_SESSIONS = 8
+    SERVER_MAX_QUEUED = 200
+    SERVER_QUEUE_TIMEOUT_SECONDS = 60
+
+    # Per-server circuit breaker (see provider/health.py).  After
+    # CIRCUIT_FAILURE_THRESHOLD consecutive failures to get a session, or
+    # a failure rate of CIRCUIT_FAILURE_RATE over the last
+    # HEALTH_WINDOW_SIZE attempts (once there are CIRCUIT_MIN_SAMPLES),
+    # actions stop connecting to the server for CIRCUIT_OPEN_SECONDS and
+    # then a single action probes it.  While the circuit is open actions
+    # fail with code ServerUnavailable, or with CIRCUIT_OPEN_INACTIVE wait
+    # INACTIVE and restart on /resume or when their creator polls them.
+    HEALTH_WINDOW_SIZE = 50
+    CIRCUIT_FAILURE_THRESHOLD = 5
+    CIRCUIT_FAILURE_RATE = 0.5
+    CIRCUIT_MIN_SAMPLES = 10
+    CIRCUIT_OPEN_SECONDS = 60
+    CIRCUIT_OPEN_INACTIVE = False
+
+    # Retries of transient connection failures (see provider/retry.py);
+    # a command that may have started is never retried.  Up to
+    # RETRY_MAX_ATTEMPTS attempts, waiting a random time of up to
+    # RETRY_BASE_DELAY_SECONDS * 2**n (at most RETRY_MAX_DELAY_SECONDS)
+    # between them, while within RETRY_DEADLINE_SECONDS of the first failure.
+    # Meanwhile the action is ACTIVE with details["next_attempt_in_ms"]; in
+    # synchronous mode the next attempt is made by the first status poll
+    # after it is due.
+    RETRY_MAX_ATTEMPTS = 5
+    RETRY_BASE_DELAY_SECONDS = 1.0
+    RETRY_MAX_DELAY_SECONDS = 30.0
+    RETRY_DEADLINE_SECONDS = 120
+
+    # Fan-out actions run one command on several servers at once (see
+    # provider/fanout.py).  ssh_server may be a list of servers and/or
+    # names of SERVER_GROUPS.  At most max_parallel of them (default
+    # FANOUT_DEFAULT_PARALLEL, capped at FANOUT_MAX_PARALLEL) are run at a
+    # time, each still within its server's session limit.
+    SERVER_GROUPS = {
+        # Example group of the servers below
+        "example-login-nodes": ["ssh.my.server.edu", "ssh.globustest.org"],
+    }
+    FANOUT_DEFAULT_PARALLEL = 8
+    FANOUT_MAX_PARALLEL = 16
+    FANOUT_MAX_SERVERS = 64
+
+    # Wall-clock limit on running an action's commands, which a request
+    # can lower or raise up to COMMAND_MAX_TIMEOUT_SECONDS with
+    # timeout_seconds.  Commands still running then are sent SIGTERM and
+    # their channel is closed; the action fails with code Timeout.
+    COMMAND_TIMEOUT_SECONDS = 3600
+    COMMAND_MAX_TIMEOUT_SECONDS = 24 * 60 * 60
+
+    # Running commands notice that their action was cancelled through
+    # another worker process within this many seconds (see provider/cancel.py)
+    CANCEL_POLL_SECONDS = 2
+
+    # Streaming output capture (see provider/capture.py); output is
+    # spooled per action under OUTPUT_STORE_DIR, or kept on the Redis
+    # server with the "redis" STORAGE_BACKEND
+    OUTPUT_STORE_DIR = "ssh_action_output"
+    CAPTURE_CHUNK_BYTES = 32768
+    CAPTURE_POLL_SECONDS = 0.05
+    # All stdout up to this size is kept and served in pages of at most
+    # OUTPUT_PAGE_MAX_BYTES through the limit/offset input fields
+    OUTPUT_STORE_MAX_BYTES = 64 * 1024 * 1024
+    OUTPUT_PAGE_MAX_BYTES = 1024 * 1024
+    # The log endpoint tails the output of running actions; a request can
+    # wait up to LOG_WAIT_MAX_SECONDS for more, which holds a web worker
+    # thread meanwhile.  Output of other processes is looked for every
+    # LOG_WAIT_POLL_SECONDS.
+    LOG_WAIT_MAX_SECONDS = 30
+    LOG_WAIT_POLL_SECONDS = 0.5
+    # Status responses carry an ETag, the stored version of the action.
+    # Polls sending it back as If-None-Match get 304 Not Modified while it
+    # is unchanged, after waiting up to ?wait=N seconds (at most
+    # STATUS_WAIT_MAX_SECONDS) for it to change.  Changes made by other
+    # processes are looked for every STATUS_WAIT_POLL_SECONDS.
+    STATUS_WAIT_MAX_SECONDS = 30
+    STATUS_WAIT_POLL_SECONDS = 0.5
+    # Most action ids one POST to /actions/status or /actions/release may
+    # list
+    BATCH_MAX_ACTIONS = 1000
+
+    # Settings for the cached sqlite3 connections of LocalStore
+    SQLITE_JOURNAL_MODE = "WAL"
+    SQLITE_SYNCHRONOUS = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS = 5000
+    SQLITE_AUTO_VACUUM = "INCREMENTAL"
+    # Where actions are stored: "sqlite" (LocalStore files in the working
+    # directory) or "redis" (any server speaking the Redis protocol, so
+    # that several pods behind a load balancer share their actions and
+    # their output, see provider/redis_store.py)
+    STORAGE_BACKEND = "sqlite"
+    REDIS_URL = "redis://localhost:6379/0"
+    REDIS_TIMEOUT_SECONDS = 5
+    # Split LocalStore keys over this many sqlite files so writers from
+    # several workers don't serialize on one lock.  Move existing rows with
+    # `python -m provider.cli rebalance-shards` after changing it.
+    DB_SHARD_COUNT = 1
+
+    # Serialization of stored actions, see provider/codec.py for the
+    # available codecs ("json", "json+zlib" or the legacy "dill")
+    ACTION_CODEC = "json"
+
+    # Decoded actions kept in memory by each worker (see provider/cache.py).
+    # Updates made by other workers show up once an entry's TTL runs out,
+    # so unfinished actions are kept for much less time than finished ones.
+    ACTION_CACHE_MAX_ENTRIES = 10000
+    ACTION_CACHE_TTL_SECONDS = 60
+    ACTION_CACHE_ACTIVE_TTL_SECONDS = 1
+
+    # Completed actions, and their spooled output, are removed this long
+    # after they finish unless released earlier; 0 keeps them forever.
+    # The sweeper (see provider/expiry.py) deletes expired rows in batches
+    # of EXPIRY_SWEEP_BATCH_SIZE every EXPIRY_SWEEP_INTERVAL_SECONDS (0
+    # disables the background thread) and then releases up to
+    # EXPIRY_VACUUM_PAGES free pages of the sqlite files.
+    ACTION_RETENTION_SECONDS = 30 * 24 * 60 * 60
+    EXPIRY_SWEEP_INTERVAL_SECONDS = 600
+    EXPIRY_SWEEP_BATCH_SIZE = 500
+    EXPIRY_VACUUM_PAGES = 1000
+
+    # Globus Auth responses cached per bearer token (see
+    # provider/token_cache.py).  Introspections are reused for up to
+    # TOKEN_INTROSPECT_TTL_SECONDS; dependent tokens until
+    # TOKEN_MIN_LIFETIME_SECONDS before they expire, and refreshed in the
+    # background TOKEN_REFRESH_AHEAD_SECONDS before that if possible
+    TOKEN_CACHE_MAX_ENTRIES = 1000
+    TOKEN_INTROSPECT_TTL_SECONDS = 60
+    TOKEN_MIN_LIFETIME_SECONDS = 60
+    TOKEN_REFRESH_AHEAD_SECONDS = 600
+
     # Environment vars that need to be set for the AP Confidential Client
     CLIENT_ID_ENV = 'SSH_AP_CLIENT_ID'
     CLIENT_SECRET_ENV = 'SSH_AP_CLIENT_SECRET'
@@ -54,3 +217,12 @@ class SshConfig:
     ERROR_INVALID_SERVER = "Unknown OAuth SSH Server ({server})"
     ERROR_MISSING_INPUT = "Missing command or server name input"
     ERROR_DEPENDENT_TOKEN = "Could not obtain dependent tokens for ssh server"
+    ERROR_SERVER_BUSY = "{server} is busy with {queued} queued actions, try again later"
+    ERROR_SERVER_TIMEOUT = "Timed out after {timeout}s waiting for a session on {server}"
+    ERROR_CONNECT = "Could not connect to {server}: {error}"
+    ERROR_SERVER_UNAVAILABLE = "{server} is unavailable, retry after {retry_after}s"
+    ERROR_TIMEOUT = "Command timed out after {timeout}s on {server}"
+    ERROR_EXIT_STATUS = "Command exited with status {exit_code} on {server}"
+    ERROR_CANCELLED = "Command was cancelled on {server}"
+    ERROR_TOO_MANY_SERVERS = "At most {limit} servers can be used in one action"
+    ERROR_INTERRUPTED = "The worker running the command stopped before it finished"
@@ -0,0 +1,69 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from provider.config import SshConfig
+
+logger = logging.getLogger(__name__)
+
+
+class ActionExecutor:
+    """
+    Bounded pool of background threads that run SSH actions so that the
+    web worker handling /run can return as soon as the action is stored.
+
+    At most max_workers actions execute at once and at most max_pending
+    more wait in the queue; submit() returns None rather than queueing
+    beyond that.  The thread pool is created lazily, per process, so it
+    is safe to import before gunicorn forks its workers.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = SshConfig.EXECUTOR_MAX_WORKERS,
+        max_pending: int = SshConfig.EXECUTOR_MAX_PENDING,
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="ssh-action",
+                )
+                self._slots = threading.BoundedSemaphore(
+                    self.max_workers + self.max_pending
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Optional[Future]:
+        executor = self._get_executor()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            logger.warning("Action executor is saturated, not queueing action")
+            return None
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+action_executor = ActionExecutor()
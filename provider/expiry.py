@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from provider.config import SshConfig
+from provider.local_db import get_action_database
+from provider.output_store import output_store
+
+logger = logging.getLogger(__name__)
+
+
+class ExpirySweeper:
+    """
+    Removes completed actions once their retention has passed, since
+    most clients never call /release.
+
+    Each sweep deletes expired rows in bounded batches, releases freed
+    sqlite pages through incremental vacuum and removes spooled output
+    older than the retention.  start() runs sweeps every interval seconds
+    on a daemon thread; like the action executor it is started lazily,
+    per process, so it survives gunicorn forking its workers.  Counts of
+    what was reaped are logged and available from stats().
+    """
+
+    def __init__(
+        self,
+        interval: float = SshConfig.EXPIRY_SWEEP_INTERVAL_SECONDS,
+        batch_size: int = SshConfig.EXPIRY_SWEEP_BATCH_SIZE,
+        vacuum_pages: int = SshConfig.EXPIRY_VACUUM_PAGES,
+        retention_seconds: float = SshConfig.ACTION_RETENTION_SECONDS,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stats = {
+            "sweeps": 0,
+            "actions_reaped": 0,
+            "output_files_reaped": 0,
+            "last_sweep_time": None,
+            "last_sweep_ms": None,
+            "last_actions_reaped": 0,
+        }
+
+    def sweep(self, database=None, store=None, now: Optional[float] = None) -> Dict:
+        """
+        Run one sweep, returns what it removed
+        """
+        database = database or get_action_database()
+        store = store or output_store
+        began = time.perf_counter()
+        actions = database.sweep_expired(now=now, batch_size=self.batch_size)
+        if actions and self.vacuum_pages:
+            database.vacuum(pages=self.vacuum_pages)
+        files = 0
+        if self.retention_seconds:
+            files = store.sweep(self.retention_seconds, now=now)
+        elapsed_ms = round((time.perf_counter() - began) * 1000, 3)
+
+        with self._lock:
+            self._stats["sweeps"] += 1
+            self._stats["actions_reaped"] += actions
+            self._stats["output_files_reaped"] += files
+            self._stats["last_sweep_time"] = time.time()
+            self._stats["last_sweep_ms"] = elapsed_ms
+            self._stats["last_actions_reaped"] = actions
+        if actions or files:
+            logger.info(
+                f"Expiry sweep reaped {actions} actions and {files} output files "
+                f"in {elapsed_ms}ms"
+            )
+        return {"actions_reaped": actions, "output_files_reaped": files}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def _run(self, stop: threading.Event):
+        while not stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Expiry sweep failed")
+
+    def start(self):
+        """
+        Start the background thread for this process if it isn't running
+        """
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(self._stop,),
+                name="expiry-sweeper",
+                daemon=True,
+            )
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stop.set()
+            self._thread = None
+
+
+expiry_sweeper = ExpirySweeper()
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from provider.config import SshConfig
+from provider.schema import FailureMode
+
+logger = logging.getLogger(__name__)
+
+ServerResult = Dict[str, Any]
+
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+SKIPPED = "SKIPPED"
+# Waiting to retry a failed connection, see provider._fanout_worker
+ACTIVE = "ACTIVE"
+
+
+def expand_servers(ssh_server: Union[str, List[str], None]) -> List[str]:
+    """
+    The servers named by an ssh_server input, with SERVER_GROUPS expanded
+    in place and duplicates dropped
+    """
+    if not ssh_server:
+        return []
+    names = [ssh_server] if isinstance(ssh_server, str) else list(ssh_server)
+    servers: List[str] = []
+    for name in names:
+        for server in SshConfig.SERVER_GROUPS.get(name, [name]):
+            if server not in servers:
+                servers.append(server)
+    return servers
+
+
+def is_fanout(body: Dict[str, Any]) -> bool:
+    """
+    Whether an action body runs its command on several servers
+    """
+    ssh_server = body.get("ssh_server")
+    return isinstance(ssh_server, list) or ssh_server in SshConfig.SERVER_GROUPS
+
+
+def parallelism(max_parallel: Optional[int]) -> int:
+    if not max_parallel:
+        max_parallel = SshConfig.FANOUT_DEFAULT_PARALLEL
+    return min(max(max_parallel, 1), SshConfig.FANOUT_MAX_PARALLEL)
+
+
+def fan_out(
+    servers: List[str],
+    run_one: Callable[[int, str], ServerResult],
+    max_parallel: int,
+    failure_mode: str = FailureMode.ANY,
+) -> Dict[str, ServerResult]:
+    """
+    Call run_one(index, server) for every server, at most max_parallel at
+    a time, and return their results by server in input order.  Each
+    result has a "status" and gets the "elapsed_ms" of its call.  With
+    fail_fast, servers not started by the time one fails are SKIPPED.
+    """
+    stop = threading.Event()
+
+    def run(index: int, server: str) -> ServerResult:
+        if stop.is_set():
+            return {"status": SKIPPED}
+        start = time.perf_counter_ns()
+        try:
+            result = run_one(index, server)
+        except Exception as e:
+            logger.exception(f"Unexpected error running on {server}")
+            result = {"status": FAILED, "error": f"Unexpected {e}"}
+        result["elapsed_ms"] = (time.perf_counter_ns() - start) // 1_000_000
+        failed = result["status"] in (FAILED, SKIPPED)
+        if failed and failure_mode == FailureMode.FAIL_FAST:
+            stop.set()
+        return result
+
+    workers = min(max_parallel, len(servers)) or 1
+    with ThreadPoolExecutor(workers, thread_name_prefix="ssh-fanout") as pool:
+        futures = [pool.submit(run, i, server) for i, server in enumerate(servers)]
+        return {server: f.result() for server, f in zip(servers, futures)}
+
+
+def summarize(
+    results: Dict[str, ServerResult], failure_mode: str = FailureMode.ANY
+) -> Tuple[Dict[str, int], Optional[str], Optional[str]]:
+    """
+    Count the results by status and decide whether the action failed.
+    Returns the counts, and the failure code and description or None.
+    """
+    counts = {"succeeded": 0, "failed": 0, "skipped": 0}
+    for result in results.values():
+        counts[result["status"].lower()] += 1
+    if failure_mode == FailureMode.ALL:
+        failed = counts["succeeded"] == 0
+    else:
+        failed = counts["failed"] > 0
+    if not failed:
+        return counts, None, None
+
+    errors = [
+        f"{server} ({result.get('error', 'failed')})"
+        for server, result in results.items()
+        if result["status"] == FAILED
+    ]
+    code = "PartialFailure" if counts["succeeded"] else "Failed"
+    description = (
+        f"Command failed on {counts['failed']} of {len(results)} servers: "
+        + ", ".join(errors)
+    )
+    return counts, code, description
@@ -0,0 +1,190 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from provider.config import SshConfig
+from provider.util import SshUtil
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of connecting to a server whose circuit is open
+    """
+
+    def __init__(self, server: str, retry_after: float):
+        self.server = server
+        self.retry_after = retry_after
+        super().__init__(
+            SshConfig.ERROR_SERVER_UNAVAILABLE.format(
+                server=server, retry_after=int(retry_after + 0.999)
+            )
+        )
+
+
+class _ServerState:
+    def __init__(self, window: int):
+        self.state = CLOSED
+        # (succeeded, seconds to get a channel) of the latest attempts
+        self.attempts: Deque[Tuple[bool, float]] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probe_started: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.trips = 0
+
+    def failure_rate(self) -> Optional[float]:
+        if not self.attempts:
+            return None
+        return sum(1 for ok, _ in self.attempts if not ok) / len(self.attempts)
+
+
+class HealthTracker:
+    """
+    Tracks how connecting to each SSH server goes, and keeps actions from
+    waiting out the connect timeout against a server that is down.
+
+    After failure_threshold consecutive failures, or a failure rate of at
+    least failure_rate over the last window attempts, a server's circuit
+    opens: check() raises CircuitOpen for open_seconds.  Then the circuit
+    is half open and check() lets one action through as a probe; its
+    outcome closes the circuit or opens it again.  A probe that never
+    reports back is replaced after open_seconds.
+    """
+
+    def __init__(
+        self,
+        window: int = SshConfig.HEALTH_WINDOW_SIZE,
+        failure_threshold: int = SshConfig.CIRCUIT_FAILURE_THRESHOLD,
+        failure_rate: float = SshConfig.CIRCUIT_FAILURE_RATE,
+        min_samples: int = SshConfig.CIRCUIT_MIN_SAMPLES,
+        open_seconds: float = SshConfig.CIRCUIT_OPEN_SECONDS,
+    ):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.min_samples = min_samples
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._servers: Dict[str, _ServerState] = {}
+
+    def _state(self, server: str) -> _ServerState:
+        state = self._servers.get(server)
+        if state is None:
+            state = self._servers[server] = _ServerState(self.window)
+        return state
+
+    def retry_after(self, server: str) -> float:
+        """
+        Seconds until actions may connect to server again, 0 if they may
+        """
+        with self._lock:
+            state = self._state(server)
+            return self._retry_after_locked(state, time.monotonic())
+
+    def _retry_after_locked(self, state: _ServerState, now: float) -> float:
+        if state.state == CLOSED:
+            return 0.0
+        if state.state == OPEN:
+            return max(state.open_until - now, 0.0)
+        # Half open: wait for the probe unless it has gone missing
+        if state.probe_started is not None and now - state.probe_started < self.open_seconds:
+            return state.probe_started + self.open_seconds - now
+        return 0.0
+
+    def check(self, server: str, probe: bool = True):
+        """
+        Raise CircuitOpen if actions shouldn't connect to server now.
+        With probe, a caller let through a half open circuit becomes its
+        probe and must report back with record().
+        """
+        with self._lock:
+            state = self._state(server)
+            now = time.monotonic()
+            retry_after = self._retry_after_locked(state, now)
+            if retry_after > 0:
+                raise CircuitOpen(server, retry_after)
+            if probe and state.state != CLOSED:
+                state.state = HALF_OPEN
+                state.probe_started = now
+                logger.info(f"Probing {server} after its circuit opened")
+
+    def record(self, server: str, latency: float, error: Optional[Exception] = None):
+        """
+        Report an attempt to get a session on server, error is None if it
+        succeeded
+        """
+        with self._lock:
+            state = self._state(server)
+            state.attempts.append((error is None, latency))
+            if error is None:
+                state.consecutive_failures = 0
+                if state.state != CLOSED:
+                    logger.info(f"Circuit for {server} closed")
+                    state.state = CLOSED
+                    state.probe_started = None
+                    # Failures from before the outage don't count anymore
+                    state.attempts.clear()
+                    state.attempts.append((True, latency))
+                return
+            state.consecutive_failures += 1
+            state.last_error = SshUtil.get_start(
+                f"{type(error).__name__}: {error}", max_length=200, replace_line_breaks=True
+            )
+            rate = state.failure_rate()
+            if (
+                state.state == HALF_OPEN
+                or state.consecutive_failures >= self.failure_threshold
+                or (len(state.attempts) >= self.min_samples and rate >= self.failure_rate)
+            ):
+                if state.state != OPEN:
+                    state.trips += 1
+                    logger.warning(
+                        f"Circuit for {server} opened for {self.open_seconds}s "
+                        f"after {state.consecutive_failures} failures: {state.last_error}"
+                    )
+                state.state = OPEN
+                state.open_until = time.monotonic() + self.open_seconds
+                state.probe_started = None
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Health of every known server, as shown on the introspection endpoint
+        """
+        with self._lock:
+            now = time.monotonic()
+            servers = set(SshConfig.KNOWN_SERVER_SCOPES) | set(self._servers)
+            health = {}
+            for server in sorted(servers):
+                state = self._state(server)
+                latencies = sorted(latency for ok, latency in state.attempts if ok)
+                rate = state.failure_rate()
+                health[server] = {
+                    "state": state.state,
+                    "attempts": len(state.attempts),
+                    "failure_rate": round(rate, 3) if rate is not None else None,
+                    "consecutive_failures": state.consecutive_failures,
+                    "connect_p50_ms": _percentile_ms(latencies, 0.5),
+                    "connect_p95_ms": _percentile_ms(latencies, 0.95),
+                    "retry_after_seconds": round(self._retry_after_locked(state, now), 1),
+                    "times_opened": state.trips,
+                    "last_error": state.last_error,
+                }
+            return health
+
+
+def _percentile_ms(latencies, fraction: float) -> Optional[float]:
+    if not latencies:
+        return None
+    index = min(len(latencies) - 1, int(fraction * len(latencies)))
+    return round(latencies[index] * 1000, 1)
+
+
+server_health = HealthTracker()
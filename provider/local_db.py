@@ -1,24 +1,242 @@
-import dill
+import abc
+import hashlib
 import json
 import logging
 import sqlite3
 import os
-from provider.util import SshUtil
+import threading
+import time
+import zlib
+import arrow
+from globus_action_provider_tools.data_types import ActionStatusValue
+from provider import codec as action_codec
+from provider.config import SshConfig
 
 
 logger = logging.getLogger(__name__)
 
+_COMPLETED_STATES = (ActionStatusValue.SUCCEEDED, ActionStatusValue.FAILED)
 
-class LocalStore:
+
+class SqliteConnectionManager:
+    """
+    Caches one sqlite3 connection per thread and database file, so that
+    reads and writes don't pay for a connect (and schema check) each time.
+    Connections of threads that have exited are closed once another
+    connection is opened.
+
+    Every new connection is switched to WAL journaling, which lets readers
+    in other gunicorn workers proceed while one worker writes, and waits
+    up to busy_timeout for a lock instead of failing with
+    'database is locked'.  Connections are dropped after a fork.
+
+    auto_vacuum only takes effect on files created by this connection
+    (or after a full VACUUM), so it is set before anything else.
+    """
+
+    def __init__(self,
+                 journal_mode=SshConfig.SQLITE_JOURNAL_MODE,
+                 synchronous=SshConfig.SQLITE_SYNCHRONOUS,
+                 busy_timeout_ms=SshConfig.SQLITE_BUSY_TIMEOUT_MS,
+                 auto_vacuum=SshConfig.SQLITE_AUTO_VACUUM):
+        self.auto_vacuum = auto_vacuum
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout_ms = busy_timeout_ms
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._all = {}
+        self._pid = os.getpid()
+
+    def _thread_connections(self):
+        if self._pid != os.getpid():
+            # Forked: the parent's connections must not be used here
+            with self._lock:
+                self._local = threading.local()
+                self._all = {}
+                self._pid = os.getpid()
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        return connections
+
+    def connect(self, file_name, on_connect=None):
+        """
+        Return this thread's connection to file_name, opening it (and
+        calling on_connect(conn) to set up the schema) if needed
+        """
+        path = os.path.abspath(file_name)
+        connections = self._thread_connections()
+        conn = connections.get(path)
+        if conn is None:
+            conn = sqlite3.connect(path,
+                                   timeout=self.busy_timeout_ms / 1000.0,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA auto_vacuum=%s' % self.auto_vacuum)
+            conn.execute('PRAGMA journal_mode=%s' % self.journal_mode)
+            conn.execute('PRAGMA synchronous=%s' % self.synchronous)
+            conn.execute('PRAGMA busy_timeout=%d' % self.busy_timeout_ms)
+            if on_connect:
+                on_connect(conn)
+            connections[path] = conn
+            self._register(path, conn)
+        return conn
+
+    def _register(self, path, conn):
+        # Threads don't close their connections when they exit; close those
+        # of threads gone since, e.g. one thread per request, here
+        alive = set(t.ident for t in threading.enumerate())
+        key = (threading.get_ident(), path)
+        with self._lock:
+            stale = [k for k in self._all if k[0] not in alive or k == key]
+            closing = [self._all.pop(k) for k in stale]
+            self._all[key] = conn
+        self._close_connections(closing)
+
+    def close(self, file_name=None):
+        """
+        Close cached connections to file_name (all files if None) in every
+        thread, e.g. before the database file is removed
+        """
+        path = os.path.abspath(file_name) if file_name else None
+        with self._lock:
+            keys = [k for k in self._all if path is None or k[1] == path]
+            closing = [self._all.pop(k) for k in keys]
+        connections = self._thread_connections()
+        for key in keys:
+            if key[0] == threading.get_ident():
+                connections.pop(key[1], None)
+        self._close_connections(closing)
+
+    @staticmethod
+    def _close_connections(connections):
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.debug('Error closing connection: %s' % str(e))
+
+
+_connections = SqliteConnectionManager()
+
+
+class KeyValueStore(abc.ABC):
+    """
+    Interface of the key/value backends an ActionDatabase can keep its
+    actions in.  Values are bytes (or str); keys may not contain ; or :
+
+    Entries may carry an expires_at (seconds since the epoch) after which
+    get() no longer returns them and sweep_expired() may remove them.
+    """
+
+    @staticmethod
+    def is_valid_key(key):
+        # Disallow colon and semicolon in key
+        return ';' not in key and ':' not in key
+
+    @abc.abstractmethod
+    def get(self, key):
+        pass
+
+    def get_many(self, keys):
+        """
+        Values of those of keys that are stored, by key
+        """
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def tag(self, key):
+        """
+        Short string that changes whenever the value of key does, None if
+        there is no such key.  Backends keeping a version per key answer
+        without reading the value; this default hashes it.
+        """
+        value = self.get(key)
+        if value is None:
+            return None
+        return self._value_tag(value)
+
+    @staticmethod
+    def _value_tag(value):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        return hashlib.blake2b(value, digest_size=8).hexdigest()
+
+    def put(self, key, value, expires_at=None):
+        """
+        Insert or update key, returns True if the stored value changed
+        """
+        return self.put_many([(key, value, expires_at)]) > 0
+
+    def put_if_tag(self, key, value, tag, expires_at=None):
+        """
+        Update key only if tag(key) is still tag, returns whether it was
+        written.  This default checks and writes one after the other;
+        backends that can do both atomically override it.
+        """
+        if tag is None or self.tag(key) != tag:
+            return False
+        self.put(key, value, expires_at=expires_at)
+        return True
+
+    @abc.abstractmethod
+    def put_many(self, items):
+        """
+        items are (key, value) or (key, value, expires_at) tuples
+        """
+
+    @staticmethod
+    def _with_expiry(items):
+        for item in items:
+            if len(item) == 2:
+                yield item[0], item[1], None
+            else:
+                yield item
+
+    @abc.abstractmethod
+    def delete(self, key):
+        pass
+
+    @abc.abstractmethod
+    def items(self, batch_size=1000):
+        pass
+
+    @abc.abstractmethod
+    def delete_database(self):
+        pass
+
+    def sweep_expired(self, now=None, batch_size=SshConfig.EXPIRY_SWEEP_BATCH_SIZE):
+        """
+        Remove expired entries, returns how many were removed.  Backends
+        that expire entries by themselves have nothing to do here.
+        """
+        return 0
+
+    def vacuum(self, pages=None):
+        """
+        Give space freed by deletes back to the file system, where that
+        applies; all of it when pages is None
+        """
+
+
+class LocalStore(KeyValueStore):
     """
     This a database implementation using local file storage
     File based cache implemented using sqlite3
-    Only 2 columns - id (str primary key) and value (str)
+    Columns - id (str primary key), value (str), expires_at (real,
+    indexed, NULL for entries that never expire) and version (integer,
+    incremented by every write that changes the row, see tag())
     The db is stored at the root of the service with suffix .sqlitedb
 
-    TODO as this is a key/value pair, it can be distributed to several segments
-     based on key hash to avoid I/O conflicts, for multi-node access, not necessary
-     at this time
+    As this is a key/value store, keys can be distributed to several
+    segments (shards) based on key hash to avoid I/O conflicts between
+    writers.  With shard_count > 1 each shard is its own sqlite file,
+    <db_name>_<shard>of<shard_count>.sqlitedb, with its own write lock.
+    Use rebalance() to move existing rows when changing shard_count.
     Usage:
             * mydata = LocalStore("NBA_players")
             * mydata.put("best_player", "Lebron Bryant")
@@ -30,11 +248,15 @@ class LocalStore:
     """
     _DEFAULT_DATABASE_NAME = 'ssh_local_db'
     _DB_FILE_SUFFIX = '.sqlitedb'
+    # Keys per IN (...) query, below the 999 variables older sqlite allow
+    _MAX_QUERY_KEYS = 500
 
-    def __init__(self, db_name=_DEFAULT_DATABASE_NAME):
+    def __init__(self, db_name=_DEFAULT_DATABASE_NAME, shard_count=None):
         """
         db_name is used as the prefix of the local db file name as well
         as the name of the table in the .sqlite3 database
+
+        shard_count defaults to SshConfig.DB_SHARD_COUNT
         """
         db_name = db_name.strip()
         if not db_name:
@@ -42,85 +264,247 @@ class LocalStore:
         if ';' in db_name or '.' in db_name or "'" in db_name:
             raise ValueError("db_name can not contain [;.']")
         self.db_table = db_name
+        self.shard_count = shard_count or SshConfig.DB_SHARD_COUNT
+        if self.shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+
+    def _file_name(self, shard=0):
+        if self.shard_count == 1:
+            return self.db_table + self._DB_FILE_SUFFIX
+        return '%s_%dof%d%s' % (self.db_table, shard, self.shard_count, self._DB_FILE_SUFFIX)
+
+    def shard_for(self, key):
+        """
+        Stable (across processes and restarts) shard index of key
+        """
+        if self.shard_count == 1:
+            return 0
+        return zlib.crc32(key.encode('utf-8')) % self.shard_count
 
-        conn = None
+    def _create_table(self, conn):
         try:
-            conn = sqlite3.connect(self._file_name())
-            conn.execute("CREATE TABLE IF NOT EXISTS %s(id primary key, value text)" % self.db_table)
+            conn.execute("CREATE TABLE IF NOT EXISTS %s(id primary key, value text, expires_at real, "
+                         "version integer not null default 1)" % self.db_table)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(%s)" % self.db_table)]
+            if 'expires_at' not in columns:
+                # Tables created before expiry existed
+                conn.execute("ALTER TABLE %s ADD COLUMN expires_at real" % self.db_table)
+            if 'version' not in columns:
+                conn.execute("ALTER TABLE %s ADD COLUMN version integer not null default 1" % self.db_table)
+            conn.execute("CREATE INDEX IF NOT EXISTS %s_expires_at ON %s(expires_at)"
+                         % (self.db_table, self.db_table))
             conn.commit()
         except Exception as e:
+            conn.rollback()
             logger.error('Exception when creating table %s: %s' % (self.db_table, str(e)))
-        finally:
-            if conn:
-                conn.close()
 
-    def _file_name(self):
-        return self.db_table + self._DB_FILE_SUFFIX
+    def _connection(self, key=None, shard=None):
+        if shard is None:
+            shard = self.shard_for(key) if key is not None else 0
+        return _connections.connect(self._file_name(shard), on_connect=self._create_table)
 
     def delete_database(self):
-        if os.path.exists(self._file_name()):
-            os.remove(self._file_name())
+        for shard in range(self.shard_count):
+            file_name = self._file_name(shard)
+            _connections.close(file_name)
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(file_name + suffix):
+                    os.remove(file_name + suffix)
 
     def clear_table(self):
-        conn = None
-        try:
-            conn = sqlite3.connect(self._file_name())
-            conn.execute("DROP TABLE IF EXISTS %s" % self.db_table)
-            conn.commit()
-            conn.execute("CREATE TABLE %s(id primary key, value text)" % self.db_table)
-            conn.commit()
-        except Exception as e:
-            logger.error('Exception when dropping table %s: %s' % (self.db_table, str(e)))
-        finally:
-            if conn:
-                conn.close()
+        for shard in range(self.shard_count):
+            conn = self._connection(shard=shard)
+            try:
+                conn.execute("DROP TABLE IF EXISTS %s" % self.db_table)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error('Exception when dropping table %s: %s' % (self.db_table, str(e)))
+            self._create_table(conn)
 
-    @staticmethod
-    def is_valid_key(key):
-        # Disallow colon and semicolon in key
-        return ';' not in key and ':' not in key
+    def items(self, batch_size=1000, with_expiry=False):
+        """
+        Iterate over every unexpired (key, value) pair, shard by shard,
+        or (key, value, expires_at) with with_expiry
+        """
+        for shard in range(self.shard_count):
+            if not os.path.exists(self._file_name(shard)):
+                continue
+            conn = self._connection(shard=shard)
+            last_key = ''
+            while True:
+                rows = conn.execute('select id, value, expires_at from %s '
+                                    'where id > ? and (expires_at is null or expires_at > ?) '
+                                    'order by id limit ?' % self.db_table,
+                                    [last_key, time.time(), batch_size]).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row) if with_expiry else (row[0], row[1])
+                last_key = rows[-1][0]
+
+    def sweep_expired(self, now=None, batch_size=SshConfig.EXPIRY_SWEEP_BATCH_SIZE):
+        """
+        Delete expired rows batch_size at a time, committing after each
+        batch so that writers are never locked out for long
+        """
+        now = time.time() if now is None else now
+        removed = 0
+        for shard in range(self.shard_count):
+            if not os.path.exists(self._file_name(shard)):
+                continue
+            conn = self._connection(shard=shard)
+            while True:
+                try:
+                    cursor = conn.execute('DELETE FROM %s WHERE id IN '
+                                          '(SELECT id FROM %s WHERE expires_at <= ? LIMIT ?)'
+                                          % (self.db_table, self.db_table), [now, batch_size])
+                    conn.commit()
+                except sqlite3.DatabaseError as e:
+                    conn.rollback()
+                    logger.error("Database error exception: %s" % str(e))
+                    break
+                removed += cursor.rowcount
+                if cursor.rowcount < batch_size:
+                    break
+        return removed
+
+    def vacuum(self, pages=None):
+        """
+        With pages, release up to that many free pages per shard through
+        incremental vacuum.  Without, run a full VACUUM, which also
+        converts files created before auto_vacuum was enabled.
+        """
+        for shard in range(self.shard_count):
+            if not os.path.exists(self._file_name(shard)):
+                continue
+            conn = self._connection(shard=shard)
+            try:
+                if pages is None:
+                    conn.execute('VACUUM')
+                else:
+                    # executescript steps the pragma to completion, execute
+                    # would only free the first page
+                    conn.executescript('PRAGMA incremental_vacuum(%d);' % int(pages))
+            except sqlite3.DatabaseError as e:
+                logger.error("Could not vacuum %s: %s" % (self._file_name(shard), str(e)))
+
+    @classmethod
+    def rebalance(cls, db_name, from_shard_count, to_shard_count, batch_size=1000):
+        """
+        Move every row of db_name from a from_shard_count layout into a
+        to_shard_count layout, then remove the old shard files.
+        Run while the service is stopped; returns the number of rows moved.
+        """
+        source = cls(db_name, shard_count=from_shard_count)
+        target = cls(db_name, shard_count=to_shard_count)
+        if source._file_name(0) == target._file_name(0):
+            return 0
+        moved = 0
+        batch = []
+        for item in source.items(batch_size, with_expiry=True):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                target.put_many(batch)
+                moved += len(batch)
+                batch = []
+        if batch:
+            target.put_many(batch)
+            moved += len(batch)
+        source.delete_database()
+        logger.info('Moved %d rows of %s from %d to %d shards' % (moved, db_name, from_shard_count, to_shard_count))
+        return moved
 
     def delete(self, key):
         if not self.is_valid_key(key):
             logger.error("Invalid key:  %s" % str(key))
             return
-        conn = sqlite3.connect(self._file_name())
+        conn = self._connection(key)
         try:
             conn.execute('DELETE from %s where id = ?' % self.db_table, [key])
             conn.commit()
         except sqlite3.OperationalError as e:
+            conn.rollback()
             if 'no such table' in str(e):
                 logger.error("Shouldn't encounter this error, table should be created already in delete_value")
         except sqlite3.DatabaseError as e:
+            conn.rollback()
             logger.error("Database error exception: %s" % str(e))
-        finally:
-            conn.close()
 
-    def put(self, key, value):
+    def put_if_tag(self, key, value, tag, expires_at=None):
+        """
+        Update the row of key only if its version is still tag, in a
+        single statement so that no other writer can come in between
+        """
         if not self.is_valid_key(key):
             raise ValueError('Key can not contain (;) or (")')
-        conn = sqlite3.connect(self._file_name())
+        if tag is None:
+            return False
+        conn = self._connection(key)
         try:
-            conn.execute("INSERT OR IGNORE INTO %s(id, value) values (?, ?)" % self.db_table, [key, value])
-            conn.execute('UPDATE %s SET value=? where id=?' % self.db_table, [value, key])
+            cursor = conn.execute('UPDATE %s SET value = ?, expires_at = ?, version = version + 1 '
+                                  'where id = ? and version = ? '
+                                  'and (expires_at is null or expires_at > ?)' % self.db_table,
+                                  [value, expires_at, key, int(tag), time.time()])
             conn.commit()
+            return cursor.rowcount == 1
+        except sqlite3.DatabaseError as e:
+            conn.rollback()
+            logger.error("Database error exception: %s" % str(e))
+        return False
+
+    def _upsert_sql(self):
+        # Rows whose value is unchanged are left alone, so re-saving an
+        # unchanged value doesn't dirty any pages nor bump its version
+        return ("INSERT INTO %s(id, value, expires_at) values (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET value=excluded.value, expires_at=excluded.expires_at, "
+                "version=version + 1 "
+                "WHERE value IS NOT excluded.value OR expires_at IS NOT excluded.expires_at" % self.db_table)
+
+    def put_many(self, items):
+        """
+        Insert or update several (key, value[, expires_at]) tuples with
+        one transaction per shard, returns the number of rows that changed
+        """
+        by_shard = {}
+        for key, value, expires_at in self._with_expiry(items):
+            if not self.is_valid_key(key):
+                raise ValueError('Key can not contain (;) or (")')
+            by_shard.setdefault(self.shard_for(key), []).append((key, value, expires_at))
+        return sum(self._put_shard(shard, shard_items) for shard, shard_items in by_shard.items())
+
+    def _put_shard(self, shard, items):
+        conn = self._connection(shard=shard)
+        try:
+            changes = conn.total_changes
+            conn.executemany(self._upsert_sql(), items)
+            changes = conn.total_changes - changes
+            if changes:
+                conn.commit()
+            else:
+                conn.rollback()
+            return changes
         except sqlite3.OperationalError as e:
+            conn.rollback()
             if 'no such table' in str(e):
                 logger.error("Shouldn't encounter this error, table should be created already in put_value")
         except sqlite3.DatabaseError as e:
+            conn.rollback()
             logger.error("Database error exception: %s" % str(e))
         except Exception as e:
+            conn.rollback()
             logger.error("Unknown put exception: %s" % str(e))
-        finally:
-            conn.close()
+        return 0
 
     def get(self, key):
         if not self.is_valid_key(key):
             return None
-        conn = sqlite3.connect(self._file_name())
+        conn = self._connection(key)
         try:
             # logger.debug("getting %s from table %s" % (key, self.db_table))
-            value_cursor = conn.execute('select value from %s where id = ?' % self.db_table, [key])
+            value_cursor = conn.execute('select value from %s where id = ? '
+                                        'and (expires_at is null or expires_at > ?)' % self.db_table,
+                                        [key, time.time()])
             result = value_cursor.fetchone()
             if result:
                 return result[0]
@@ -129,21 +513,133 @@ class LocalStore:
                 logger.error("Shouldn't encounter this error, table should be created already in get_value")
         except sqlite3.DatabaseError as e:
             logger.error("Database error exception: %s" % str(e))
-        finally:
-            conn.close()
         return None
 
+    def get_many(self, keys):
+        """
+        Read keys with one 'where id in (...)' query per shard
+        """
+        by_shard = {}
+        for key in sorted(set(keys)):
+            if self.is_valid_key(key):
+                by_shard.setdefault(self.shard_for(key), []).append(key)
+        values = {}
+        now = time.time()
+        for shard, shard_keys in by_shard.items():
+            conn = self._connection(shard=shard)
+            for start in range(0, len(shard_keys), self._MAX_QUERY_KEYS):
+                chunk = shard_keys[start:start + self._MAX_QUERY_KEYS]
+                try:
+                    rows = conn.execute('select id, value from %s where id in (%s) '
+                                        'and (expires_at is null or expires_at > ?)'
+                                        % (self.db_table, ', '.join('?' * len(chunk))),
+                                        chunk + [now]).fetchall()
+                except sqlite3.DatabaseError as e:
+                    logger.error("Database error exception: %s" % str(e))
+                    continue
+                values.update((row[0], row[1]) for row in rows)
+        return values
+
+    def tag(self, key):
+        """
+        The version of key, read from its row without the value
+        """
+        if not self.is_valid_key(key):
+            return None
+        conn = self._connection(key)
+        try:
+            result = conn.execute('select version from %s where id = ? '
+                                  'and (expires_at is null or expires_at > ?)' % self.db_table,
+                                  [key, time.time()]).fetchone()
+            if result:
+                return str(result[0])
+        except sqlite3.DatabaseError as e:
+            logger.error("Database error exception: %s" % str(e))
+        return None
+
+
+def make_store(name, backend=None, shard_count=None):
+    """
+    Create the KeyValueStore selected by backend (SshConfig.STORAGE_BACKEND
+    by default): "sqlite" for LocalStore files in the working directory,
+    or "redis" for a server speaking the Redis protocol at
+    SshConfig.REDIS_URL, which lets several pods share their actions
+    """
+    backend = backend or SshConfig.STORAGE_BACKEND
+    if backend == 'sqlite':
+        return LocalStore(name, shard_count=shard_count)
+    elif backend == 'redis':
+        from provider.redis_store import RedisStore
+        return RedisStore(SshConfig.REDIS_URL, namespace=name)
+    raise ValueError("Unknown storage backend %s" % backend)
 
-class ActionDatabase(LocalStore):
+
+class ActionDatabase:
     _DEFAULT_ACTION_NAME = "globus_actions"
 
-    def __init__(self, request_id=None, table_name=_DEFAULT_ACTION_NAME):
+    def __init__(self, request_id=None, table_name=_DEFAULT_ACTION_NAME, codec=None, shard_count=None,
+                 store=None, retention_seconds=None):
         """
         If request_id is provided, it will be the default value
         for action_id for this ActionDatabase instance for methods
+
+        Actions are kept in store, by default the backend configured by
+        SshConfig.STORAGE_BACKEND using table_name as table/namespace
+
+        Actions are written with codec (SshConfig.ACTION_CODEC by default);
+        rows written by any other codec, including legacy dill rows, are
+        still readable and get rewritten with codec when next read
+
+        Completed actions expire retention_seconds after they are stored
+        (SshConfig.ACTION_RETENTION_SECONDS by default, 0 to keep them)
         """
-        LocalStore.__init__(self, db_name=table_name)
+        self.store = store or make_store(table_name, shard_count=shard_count)
         self.action_id = request_id
+        self.codec = action_codec.get_codec(codec or SshConfig.ACTION_CODEC)
+        self.retention_seconds = retention_seconds
+        if retention_seconds is None:
+            self.retention_seconds = SshConfig.ACTION_RETENTION_SECONDS
+
+    def expires_at(self, action):
+        # Counted from when the action finished, so that saving it again
+        # leaves the stored row as it is
+        if not self.retention_seconds or action.status not in _COMPLETED_STATES:
+            return None
+        try:
+            finished_at = arrow.get(action.completion_time or action.start_time).timestamp()
+        except (arrow.parser.ParserError, TypeError, ValueError):
+            finished_at = time.time()
+        return finished_at + self.retention_seconds
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def put(self, key, value, expires_at=None):
+        return self.store.put(key, value, expires_at=expires_at)
+
+    def put_many(self, items):
+        return self.store.put_many(items)
+
+    def delete(self, key):
+        return self.store.delete(key)
+
+    def delete_database(self):
+        return self.store.delete_database()
+
+    def sweep_expired(self, now=None, batch_size=SshConfig.EXPIRY_SWEEP_BATCH_SIZE):
+        return self.store.sweep_expired(now=now, batch_size=batch_size)
+
+    def vacuum(self, pages=None):
+        return self.store.vacuum(pages=pages)
+
+    def action_tag(self, action_id=None):
+        """
+        Changes whenever the stored action does, without decoding it
+        """
+        if action_id is None:
+            action_id = self.action_id
+        assert action_id, "action_id must be provided"
+        return self.store.tag(action_id)
 
     def get_info_dict(self, action_id=None):
         if action_id is None:
@@ -159,15 +655,33 @@ class ActionDatabase(LocalStore):
 
     def store_action_request(self, action, request=None, action_id=None):
         assert action.action_id
-        action_object = {
-            'status': action,
-            'request': request,
-        }
         if not action_id:
             assert request and request.request_id
             action_id = request.request_id
-        action_encoded = dill.dumps(action_object)
-        self.put(action_id, action_encoded)
+        action_encoded = self.codec.encode(action, request)
+        return self.put(action_id, action_encoded, expires_at=self.expires_at(action))
+
+    def store_action_request_if_tag(self, action, tag, request=None, action_id=None):
+        """
+        Store action only if the stored one is still at tag (see
+        action_tag()), returns whether it was stored
+        """
+        assert action.action_id
+        if not action_id:
+            assert request and request.request_id
+            action_id = request.request_id
+        action_encoded = self.codec.encode(action, request)
+        return self.store.put_if_tag(action_id, action_encoded, tag, expires_at=self.expires_at(action))
+
+    def store_action_requests(self, actions):
+        """
+        Store several (action, request) pairs, keyed by action_id, in a
+        single transaction
+        """
+        return self.put_many(
+            (action.action_id, self.codec.encode(action, request), self.expires_at(action))
+            for action, request in actions
+        )
 
     def get_action_request(self, action_id=None):
         if action_id is None:
@@ -175,14 +689,41 @@ class ActionDatabase(LocalStore):
         assert action_id, "action_id must be provided"
         action_encoded = self.get(action_id)
         if action_encoded:
-            action_object = dill.loads(action_encoded)
-            assert 'status' in action_object
-            assert 'request' in action_object
-            return (action_object.get('status', None),
-                    action_object.get('request', None))
+            status, request, codec = action_codec.decode(action_encoded)
+            if codec is not self.codec:
+                # Lazily migrate rows written in another format
+                logger.info("Rewriting action %s from %s to %s" % (action_id, codec.name, self.codec.name))
+                self.put(action_id, self.codec.encode(status, request), expires_at=self.expires_at(status))
+            return status, request
         else:
             return None, None
 
+    def get_action_requests(self, action_ids):
+        """
+        The (status, request) pairs of those of action_ids that are
+        stored, by action_id, read from the store in one go
+        """
+        actions = {}
+        migrated = []
+        for action_id, action_encoded in self.store.get_many(action_ids).items():
+            status, request, codec = action_codec.decode(action_encoded)
+            if codec is not self.codec:
+                migrated.append((status, request))
+            actions[action_id] = status, request
+        if migrated:
+            # Lazily migrate rows written in another format
+            logger.info("Rewriting %d actions to %s" % (len(migrated), self.codec.name))
+            self.store_action_requests(migrated)
+        return actions
+
+    def action_requests(self, batch_size=1000):
+        """
+        Every stored (status, request) pair, read batch_size rows at a time
+        """
+        for _, action_encoded in self.store.items(batch_size=batch_size):
+            status, request, _ = action_codec.decode(action_encoded)
+            yield status, request
+
     def update_action_request(self, action_status, action_id=None, request=None):
         if action_id is None:
             action_id = self.action_id
@@ -205,3 +746,17 @@ class ActionDatabase(LocalStore):
             logger.info(f"Action {action_id} was deleted from table")
         else:
             raise KeyError(f"Action {action_id} was not found")
+
+
+_action_database = None
+
+
+def get_action_database():
+    """
+    Process wide ActionDatabase, so connections and the table check are
+    shared by every request instead of being redone per call
+    """
+    global _action_database
+    if _action_database is None:
+        _action_database = ActionDatabase()
+    return _action_database
@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+from typing import BinaryIO, Callable, Optional
+
+from provider.config import SshConfig
+
+logger = logging.getLogger(__name__)
+
+
+class OutputStore:
+    """
+    Append-only spool of remote command output, kept on local disk
+    next to the action database.  Each action gets one file per stream:
+
+            * <directory>/<action_id>.stdout
+            * <directory>/<action_id>.stderr
+
+    Chunks are appended as they arrive so output never has to be held
+    in memory, and other workers can read it while the command runs.
+    Readers tailing the output can wait_for() more of it.
+    """
+
+    STREAMS = ("stdout", "stderr")
+
+    def __init__(self, directory: str = SshConfig.OUTPUT_STORE_DIR):
+        self.directory = directory
+        self._written = threading.Condition()
+
+    @staticmethod
+    def is_valid_key(action_id: str) -> bool:
+        return (
+            bool(action_id)
+            and os.path.basename(action_id) == action_id
+            and not action_id.startswith(".")
+        )
+
+    def _name(self, action_id: str, stream: str) -> str:
+        if not self.is_valid_key(action_id):
+            raise ValueError(f"Invalid action id for output store: {action_id}")
+        if stream not in self.STREAMS:
+            raise ValueError(f"Unknown output stream {stream}")
+        return f"{action_id}.{stream}"
+
+    def _path(self, action_id: str, stream: str) -> str:
+        return os.path.join(self.directory, self._name(action_id, stream))
+
+    def writer(self, action_id: str, stream: str) -> BinaryIO:
+        """
+        Open an unbuffered append handle so every chunk written is
+        immediately visible to readers
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        return open(self._path(action_id, stream), "ab", buffering=0)
+
+    def append(self, action_id: str, stream: str, data: bytes):
+        with self.writer(action_id, stream) as f:
+            f.write(data)
+
+    def notify_written(self):
+        """
+        Wake up readers waiting in this process after output was appended
+        """
+        with self._written:
+            self._written.notify_all()
+
+    def wait_for(
+        self,
+        action_id: str,
+        stream: str,
+        offset: int,
+        timeout: float,
+        done: Optional[Callable[[], bool]] = None,
+        poll_interval: float = SshConfig.LOG_WAIT_POLL_SECONDS,
+    ) -> int:
+        """
+        Block until the stream holds more than offset bytes, done()
+        returns True or timeout seconds passed, and return its size.
+        Writers in this process wake us up right away; the file is looked
+        at every poll_interval for those in other processes.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            size = self.size(action_id, stream)
+            remaining = deadline - time.monotonic()
+            if size > offset or remaining <= 0 or (done is not None and done()):
+                return size
+            with self._written:
+                self._written.wait(min(remaining, poll_interval))
+
+    def size(self, action_id: str, stream: str) -> int:
+        try:
+            return os.path.getsize(self._path(action_id, stream))
+        except OSError:
+            return 0
+
+    def read(
+        self,
+        action_id: str,
+        stream: str,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> bytes:
+        try:
+            with open(self._path(action_id, stream), "rb") as f:
+                f.seek(max(offset, 0))
+                return f.read(-1 if limit is None else max(limit, 0))
+        except FileNotFoundError:
+            return b""
+
+    def delete(self, action_id: str):
+        for stream in self.STREAMS:
+            try:
+                os.remove(self._path(action_id, stream))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Could not delete {stream} of {action_id}: {e}")
+
+    def sweep(self, max_age_seconds: float, now: Optional[float] = None) -> int:
+        """
+        Delete spool files not written to for max_age_seconds, i.e. the
+        output of actions that expired without being released.  Returns
+        the number of files removed.
+        """
+        cutoff = (time.time() if now is None else now) - max_age_seconds
+        removed = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Could not delete {entry.path}: {e}")
+        return removed
+
+
+def make_output_store(backend: Optional[str] = None) -> OutputStore:
+    """
+    Create the OutputStore for the storage backend of the actions
+    (SshConfig.STORAGE_BACKEND by default): files in OUTPUT_STORE_DIR for
+    "sqlite", or the Redis server at SshConfig.REDIS_URL for "redis" so
+    that every pod can serve the output of actions run by the others
+    """
+    backend = backend or SshConfig.STORAGE_BACKEND
+    if backend == "redis":
+        from provider.redis_store import RedisOutputStore
+
+        return RedisOutputStore(SshConfig.REDIS_URL)
+    return OutputStore()
+
+
+output_store = make_output_store()
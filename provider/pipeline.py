@@ -0,0 +1,114 @@
+import logging
+import shlex
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from paramiko.channel import Channel
+
+from provider.capture import OutputCapture
+from provider.retry import describe_error
+
+logger = logging.getLogger(__name__)
+
+StepResult = Dict[str, Any]
+RunCommand = Callable[[Channel, str, str], OutputCapture]
+
+
+def with_environment(command: str, environment: Optional[Dict[str, str]]) -> str:
+    """
+    Prefix a command with exports of the given environment variables.
+    Values are quoted; names are checked by the input schema.
+    """
+    if not environment:
+        return command
+    exports = " ".join(
+        f"{name}={shlex.quote(value)}" for name, value in environment.items()
+    )
+    return f"export {exports}; {command}"
+
+
+def step_output_id(action_id: str, index: int) -> str:
+    return f"{action_id}_s{index}"
+
+
+def run_pipeline(
+    action_id: str,
+    commands: List[str],
+    first_channel: Channel,
+    open_channel: Callable[[], Channel],
+    run_command: RunCommand,
+    stop_on_failure: bool = True,
+    environment: Optional[Dict[str, str]] = None,
+) -> List[StepResult]:
+    """
+    Run commands one after the other, each on its own session channel of
+    the same transport, with run_command(channel, output_id, command).
+    Each command is given the same environment variables.
+
+    Every step reports its status, exit code, timing and where its output
+    was stored.  A step fails if it exits with anything but 0; after that
+    the remaining steps are SKIPPED unless stop_on_failure is False.  They
+    always are after a step timed out, as the deadline is for all of them,
+    or was cancelled.
+    """
+    steps: List[StepResult] = []
+    failed = False
+    stopped = False
+    for index, command in enumerate(commands):
+        step: StepResult = {"command": command}
+        steps.append(step)
+        if stopped or (failed and stop_on_failure):
+            step["status"] = "SKIPPED"
+            continue
+
+        output_id = step_output_id(action_id, index)
+        start = time.perf_counter_ns()
+        try:
+            channel = first_channel if index == 0 else open_channel()
+            capture = run_command(
+                channel, output_id, with_environment(command, environment)
+            )
+        except Exception as e:
+            logger.info(f"Step {index} of {action_id} failed: {e}")
+            step["status"] = "FAILED"
+            step["error"] = describe_error(e)
+            failed = True
+            continue
+        finally:
+            step["execution_time_ms"] = (time.perf_counter_ns() - start) // 1_000_000
+
+        step["exit_code"] = capture.exit_status
+        step["output_id"] = output_id
+        step["output_size"] = capture.stored["stdout"]
+        step["output_truncated"] = capture.truncated("stdout")
+        stderr = capture.text("stderr")
+        if stderr:
+            step["stderr"] = stderr
+        if capture.timed_out or capture.cancelled:
+            step["status"] = "FAILED"
+            step["timed_out" if capture.timed_out else "cancelled"] = True
+            failed = stopped = True
+        elif capture.exit_status == 0:
+            step["status"] = "SUCCEEDED"
+        else:
+            step["status"] = "FAILED"
+            failed = True
+    return steps
+
+
+def failed_step(steps: List[StepResult]) -> Optional[str]:
+    """
+    Describe the first step that failed, None if none did
+    """
+    for index, step in enumerate(steps):
+        if step["status"] == "FAILED":
+            reason = step.get("error")
+            if step.get("timed_out"):
+                reason = "a timeout"
+            elif step.get("cancelled"):
+                reason = "cancellation"
+            elif reason is None:
+                exit_code = step.get("exit_code")
+                reason = "no exit status" if exit_code is None else f"exit code {exit_code}"
+            return f"Step {index + 1} of {len(steps)} ({step['command']}) failed with {reason}"
+    return None
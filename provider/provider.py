@@ -1,11 +1,17 @@
-import datetime
+import json
 import logging
 import os
-from typing import Dict, Optional, Tuple
-from provider.local_db import ActionDatabase
+import socket
+import time
+from functools import partial
+from itertools import chain
+from typing import Any, Dict, List, Optional, Tuple
+from provider.local_db import get_action_database
 from provider.util import SshUtil #, SshActionProviderJsonEncoder, SshHttpException
 
-from flask import Flask
+from flask import Flask, g, has_request_context, jsonify, make_response
+from paramiko.channel import Channel
+from flask import request as flask_request
 
 from globus_action_provider_tools import AuthState
 from globus_action_provider_tools.authorization import (
@@ -20,22 +26,62 @@ from globus_action_provider_tools.data_types import (
     ActionStatus,
     ActionStatusValue,
 )
+from globus_action_provider_tools.errors import AuthenticationError
 from globus_action_provider_tools.flask.apt_blueprint import ActionProviderBlueprint
-from globus_action_provider_tools.flask.exceptions import ActionConflict, ActionNotFound
-from paramiko import AutoAddPolicy
-from paramiko.client import SSHClient
+from globus_action_provider_tools.flask.exceptions import (
+    ActionConflict,
+    ActionNotFound,
+    BadActionRequest,
+)
 
+from provider import timing
+from provider.cache import action_cache
+from provider.cancel import cancel_registry, root_action_id
+from provider.capture import OutputCapture
 from provider.config import SshConfig
-from .schema import GlobusSshDirectorySchema
+from provider.executor import action_executor
+from provider.expiry import expiry_sweeper
+from provider.fanout import (
+    ACTIVE,
+    FAILED,
+    SKIPPED,
+    expand_servers,
+    fan_out,
+    is_fanout,
+    parallelism,
+    summarize,
+)
+from provider.health import CircuitOpen, server_health
+from provider.output_store import output_store
+from provider.pipeline import failed_step, run_pipeline, with_environment
+from provider.retry import describe_error, retry_policy, retry_timer
+from provider.scheduler import ServerBusy, server_scheduler
+from provider.ssh_pool import ssh_pool
+from provider.status_versions import status_versions
+from provider.token_cache import token_cache
+from .schema import FailureMode, GlobusSshDirectorySchema
+
+
+class SshActionProviderDescription(ActionProviderDescription):
+    """
+    Introspection document, with the health of each SSH server, the
+    hit rate of this worker's action cache and what its expiry sweeper
+    has reaped
+    """
+
+    server_health: Dict[str, Dict[str, Any]] = {}
+    action_cache_stats: Dict[str, int] = {}
+    expiry_sweeper_stats: Dict[str, Any] = {}
+
 
-ap_description = ActionProviderDescription(
+ap_description = SshActionProviderDescription(
     globus_auth_scope="",
     admin_contact="",
     title="Execute remote ssh command",
     subtitle="Run a shell command on the remote OAuth enabled server",
-    synchronous=True,
+    synchronous=not SshConfig.ASYNC_EXECUTION,
     input_schema=GlobusSshDirectorySchema,
-    log_supported=False,
+    log_supported=True,
 )
 
 provider_bp = ActionProviderBlueprint(
@@ -49,6 +95,69 @@ provider_bp = ActionProviderBlueprint(
 logger = logging.getLogger(__name__)
 
 
+@provider_bp.before_request
+def _start_background_threads():
+    # Started on first use rather than in load_ssh_provider so that every
+    # forked gunicorn worker gets its own sweeper and pool eviction threads
+    expiry_sweeper.start()
+    ssh_pool.start()
+
+
+@provider_bp.before_request
+def _refresh_introspection():
+    if flask_request.endpoint == f"{provider_bp.name}.action_introspect":
+        ap_description.server_health = server_health.snapshot()
+        ap_description.action_cache_stats = action_cache.stats()
+        ap_description.expiry_sweeper_stats = expiry_sweeper.stats()
+
+
+_STATUS_ENDPOINTS = (
+    f"{provider_bp.name}.action_status",
+    f"{provider_bp.name}._action_status",
+)
+
+
+@provider_bp.before_request
+def _status_not_modified():
+    """
+    Answer a status poll whose If-None-Match is still the stored version
+    of a settled action it may view with 304, once that version stayed
+    unchanged for the ?wait=N seconds asked for
+    """
+    if_none_match = flask_request.if_none_match
+    if flask_request.endpoint not in _STATUS_ENDPOINTS or not if_none_match:
+        return None
+    action_id = flask_request.view_args["action_id"]
+    tag = status_versions.current(action_id)
+    if tag is None or not if_none_match.contains(tag):
+        return None
+    viewers = status_versions.viewers(action_id, tag)
+    if viewers is None or not g.auth_state.check_authorization(
+        viewers, allow_all_authenticated_users=True
+    ):
+        return None
+    wait = min(
+        max(flask_request.args.get("wait", 0.0, type=float), 0.0),
+        SshConfig.STATUS_WAIT_MAX_SECONDS,
+    )
+    if wait:
+        tag = status_versions.wait_for_change(action_id, tag, wait)
+        if tag is None or not if_none_match.contains(tag):
+            # Changed meanwhile, serve the new status
+            return None
+    response = make_response("", 304)
+    response.set_etag(tag)
+    return response
+
+
+@provider_bp.after_request
+def _add_status_etag(response):
+    tag = g.pop("status_etag", None)
+    if tag is not None and response.status_code == 200:
+        response.set_etag(tag)
+    return response
+
+
 def _check_dependent_scope_present(
     request: ActionRequest, auth: AuthState
 ) -> Optional[str]:
@@ -58,41 +167,188 @@ def _check_dependent_scope_present(
     """
     required_scope = request.body.get("required_dependent_scope")
     if required_scope is not None:
-        authorizer = auth.get_authorizer_for_scope(required_scope)
+        authorizer = token_cache.authorizer_for_scope(auth, required_scope)
         if authorizer is None:
             # Missing the required scope, so return the required scope string
             return f"{ap_description.globus_auth_scope}[{required_scope}]"
     return None
 
 
-def fail_action(action: ActionStatus, err: str) -> ActionStatus:
+def fail_action(action: ActionStatus, err: str, code: str = "Failed") -> ActionStatus:
     error_msg = f"Error: {err}"
     action.status = ActionStatusValue.FAILED
-    action.details = ActionFailedDetails(code="Failed", description=error_msg)
+    action.details = ActionFailedDetails(code=code, description=error_msg)
+    return action
+
+
+def _server_unavailable(action: ActionStatus, error: CircuitOpen) -> ActionStatus:
+    if SshConfig.CIRCUIT_OPEN_INACTIVE:
+        action.status = ActionStatusValue.INACTIVE
+        action.details = ActionInactiveDetails(
+            code="ServerUnavailable", description=str(error)
+        )
+        return action
+    return fail_action(action, str(error), code="ServerUnavailable")
+
+
+def _waiting_for_server(action: ActionStatus) -> bool:
+    return (
+        action.status == ActionStatusValue.INACTIVE
+        and getattr(action.details, "code", None) == "ServerUnavailable"
+    )
+
+
+def _set_detail(action: ActionStatus, name: str, value):
+    if isinstance(action.details, dict):
+        action.details[name] = value
+    else:
+        setattr(action.details, name, value)
+
+
+def _get_detail(details, name: str):
+    if isinstance(details, dict):
+        return details.get(name)
+    return getattr(details, name, None)
+
+
+def _scheduled_server(request: ActionRequest) -> Optional[str]:
+    """
+    The server whose session slots the action needs, None if it will
+    fail before connecting anyway
+    """
+    server = request.body.get("ssh_server")
+    if (
+        request.body.get("command")
+        and isinstance(server, str)
+        and server in SshConfig.KNOWN_SERVER_SCOPES
+    ):
+        return server
+    return None
+
+
+def _retry_delay(action: ActionStatus) -> Optional[float]:
+    """
+    Seconds until the next connection attempt of an action whose last
+    one failed, None if it isn't waiting to retry
+    """
+    if action.status == ActionStatusValue.ACTIVE and isinstance(action.details, dict):
+        next_attempt_ms = action.details.get("next_attempt_in_ms")
+        if next_attempt_ms is not None:
+            return next_attempt_ms / 1000
+    return None
+
+
+def _next_attempt_at(details) -> Optional[float]:
+    """
+    When the next connection attempt of an action, or of a server of a
+    fan-out action, is due, None if it isn't waiting to retry
+    """
+    attempts = _get_detail(details, "attempts")
+    next_attempt_ms = _get_detail(details, "next_attempt_in_ms")
+    if attempts and next_attempt_ms is not None:
+        return attempts[-1]["at"] + next_attempt_ms / 1000
+    due = [
+        _next_attempt_at(result)
+        for result in (_get_detail(details, "servers") or {}).values()
+        if result["status"] == ACTIVE
+    ]
+    due = [at for at in due if at is not None]
+    return min(due) if due else None
+
+
+def _retry_due(action: ActionStatus) -> bool:
+    """
+    Whether an action may be run again: true unless it is waiting to
+    retry a failed connection and its next attempt isn't due yet
+    """
+    if _retry_delay(action) is None:
+        return True
+    due = _next_attempt_at(action.details)
+    return due is None or due <= time.time()
+
+
+def _run_scheduled(
+    action: ActionStatus, request: ActionRequest, auth: AuthState
+) -> ActionStatus:
+    """
+    Run the action in this thread once its server has a free session slot.
+    A failed connection attempt leaves the action ACTIVE with its retry
+    details rather than waiting here, see _retry_due.
+    """
+    server = _scheduled_server(request)
+    if server is None:
+        return _ssh_worker(action, request, auth)
+    try:
+        with server_scheduler.slot(server, action.creator_id) as waited:
+            with timing.activate(_action_timer(waited)):
+                action = _ssh_worker(action, request, auth)
+    except ServerBusy as e:
+        return fail_action(action, str(e), code="ServerBusy")
+    _set_detail(action, "queue_wait_ms", int(waited * 1000))
     return action
 
 
+def _action_timer(queue_wait: float) -> timing.PhaseTimer:
+    timer = timing.PhaseTimer()
+    timer.add("queue_wait", int(queue_wait * 1_000_000_000))
+    return timer
+
+
 def _ssh_worker(
     action: ActionStatus, request: ActionRequest, auth: AuthState
+) -> ActionStatus:
+    """
+    Run the command(s) of an action, timing each phase of it (see
+    provider/timing.py) into details["timing_ms"] and the logs.  Callers
+    that queued the action activate a timer with its queue wait first.
+    """
+    timer = timing.current() or timing.PhaseTimer()
+    with timing.activate(timer):
+        action = _run_ssh_action(action, request, auth)
+    if action.is_complete():
+        _set_detail(action, "timing_ms", timer.breakdown_ms())
+        timer.log(
+            action.action_id,
+            server=request.body.get("ssh_server"),
+            status=action.status.value,
+        )
+    return action
+
+
+def _run_ssh_action(
+    action: ActionStatus, request: ActionRequest, auth: AuthState
 ) -> ActionStatus:
     cmd = request.body.get("command")
+    commands = request.body.get("commands")
+    environment = request.body.get("environment")
     server = request.body.get("ssh_server")
 
+    # Failed connection attempts so far, when this is a retry
+    attempts = []
+    if isinstance(action.details, dict):
+        attempts = list(action.details.get("attempts", []))
+
     action.status = ActionStatusValue.SUCCEEDED
-    start_time = datetime.datetime.now()
+    timer = timing.current()
+    exit_code = None
+    capture = None
+    steps = None
+    timed_out = False
+    cancelled = False
+    timeout = _command_timeout(request)
 
-    if cmd and server:
+    if (cmd or commands) and server:
         if server in SshConfig.KNOWN_SERVER_SCOPES:
-            ssh_client = SSHClient()
-            ssh_client.set_missing_host_key_policy(AutoAddPolicy())
-            tokens = auth.get_dependent_tokens().by_scopes
+            with timing.phase("token"):
+                tokens = token_cache.dependent_tokens(auth)
             username_or_email = "N/A"
             ssh_server_scope = SshConfig.KNOWN_SERVER_SCOPES[server]["scope"]
             if ssh_server_scope not in tokens:
                 fail_action(action, SshConfig.ERROR_DEPENDENT_TOKEN)
                 return action
 
-            token_info = auth.introspect_token()
+            with timing.phase("token"):
+                token_info = token_cache.introspect(auth)
             if "username" in token_info:
                 username_or_email = token_info["username"]
             elif "email" in token_info:
@@ -105,24 +361,95 @@ def _ssh_worker(
             if at_index > 0:
                 username_or_email = username_or_email[:at_index]
 
-            ssh_output = "N/A"
             try:
-                ssh_client.connect(
+                server_health.check(server)
+            except CircuitOpen as e:
+                action = _server_unavailable(action, e)
+                if attempts:
+                    _set_detail(action, "attempts", attempts)
+                return action
+
+            connected = False
+            try:
+                with ssh_pool.sessions(
                     server,
-                    username=username_or_email,
-                    password=tokens[ssh_server_scope]["access_token"],
-                    port=22,
+                    username_or_email,
+                    tokens[ssh_server_scope]["access_token"],
                     timeout=SshConfig.CONNECT_TIMEOUT_SECONDS,
-                )
-                stdin, stdout, stderr = ssh_client.exec_command(cmd)
-                err = stderr.read(SshConfig.ERROR_READ_BYTES).decode("utf-8")
-                ssh_output = stdout.read(SshConfig.OUTPUT_READ_BYTES).decode("utf-8")
-                ssh_client.close()
+                ) as open_channel:
+                    channel = open_channel()
+                    connected = True
+                    deadline = time.monotonic() + timeout
+                    if commands:
+                        steps = run_pipeline(
+                            action.action_id,
+                            commands,
+                            channel,
+                            open_channel,
+                            partial(_run_command, deadline=deadline),
+                            stop_on_failure=request.body.get("stop_on_failure", True),
+                            environment=environment,
+                        )
+                    else:
+                        capture = _run_command(
+                            channel,
+                            action.action_id,
+                            with_environment(cmd, environment),
+                            deadline,
+                        )
+                if steps is not None:
+                    err = failed_step(steps)
+                    timed_out = any(s.get("timed_out") for s in steps)
+                    cancelled = any(s.get("cancelled") for s in steps)
+                    executed = [s for s in steps if s.get("exit_code") is not None]
+                    if executed:
+                        exit_code = executed[-1]["exit_code"]
+                    if not err:
+                        action.details = {"steps": steps}
+                else:
+                    exit_code = capture.exit_status
+                    timed_out = capture.timed_out
+                    cancelled = capture.cancelled
+                    stderr = capture.text("stderr")
+                    if cancelled:
+                        err = SshConfig.ERROR_CANCELLED.format(server=server)
+                    elif timed_out:
+                        err = SshConfig.ERROR_TIMEOUT.format(timeout=timeout, server=server)
+                    elif exit_code is None:
+                        # No exit status was reported, all we have is stderr
+                        err = stderr
+                    elif exit_code != 0:
+                        err = SshConfig.ERROR_EXIT_STATUS.format(
+                            exit_code=exit_code, server=server
+                        )
+                        if stderr:
+                            err = f"{err}: {stderr}"
+                    else:
+                        err = ""
             except Exception as e:
-                err = f"Encountered {SshUtil.get_start(str(e))} connecting to {server}"
+                if connected:
+                    # The command may have run, so it is never retried
+                    err = f"Encountered {describe_error(e)} running command on {server}"
+                else:
+                    delay = retry_policy.record_failure(attempts, e)
+                    if delay is not None:
+                        action.status = ActionStatusValue.ACTIVE
+                        action.details = {
+                            "attempts": attempts,
+                            "next_attempt_in_ms": int(delay * 1000),
+                        }
+                        return action
+                    err = SshConfig.ERROR_CONNECT.format(
+                        server=server, error=attempts[-1]["error"]
+                    )
 
-            if not err:
-                action.details = {"ssh_output": ssh_output}
+            if not err and steps is None:
+                action.details = {
+                    "output_size": capture.stored["stdout"],
+                    "output_truncated": capture.truncated("stdout"),
+                }
+                if stderr:
+                    action.details["stderr"] = stderr
         else:
             err = SshConfig.ERROR_INVALID_SERVER.format(server=server)
     else:
@@ -130,11 +457,279 @@ def _ssh_worker(
 
     if not err and action.status == ActionStatusValue.SUCCEEDED:
         action.completion_time = SshUtil.iso_tz_now()
-        duration = datetime.datetime.now() - start_time
-        action.details["execution_time_ms"] = duration.microseconds // 1000
+        action.details["execution_time_ms"] = timer.elapsed_ms()
     else:
-        fail_action(action, err)
+        code = "Cancelled" if cancelled else "Timeout" if timed_out else "Failed"
+        fail_action(action, err, code=code)
+        if capture is not None:
+            # Whatever the command printed up to the failure can be paged
+            _set_detail(action, "output_size", capture.stored["stdout"])
+            _set_detail(action, "output_truncated", capture.truncated("stdout"))
+    if timed_out:
+        _set_detail(action, "timed_out", True)
+        _set_detail(action, "timeout_seconds", timeout)
+    if attempts:
+        _set_detail(action, "attempts", attempts)
+    if exit_code is not None:
+        _set_detail(action, "exit_code", exit_code)
+    if steps is not None and action.status == ActionStatusValue.FAILED:
+        _set_detail(action, "steps", steps)
+
+    return action
+
+
+def _command_timeout(request: ActionRequest) -> int:
+    """
+    Seconds the commands of an action may run, as requested but at most
+    COMMAND_MAX_TIMEOUT_SECONDS
+    """
+    timeout = request.body.get("timeout_seconds") or SshConfig.COMMAND_TIMEOUT_SECONDS
+    return min(max(timeout, 1), SshConfig.COMMAND_MAX_TIMEOUT_SECONDS)
+
+
+def _run_command(
+    channel: Channel, output_id: str, cmd: str, deadline: Optional[float] = None
+) -> OutputCapture:
+    """
+    Execute a command on a session channel, spooling its output under
+    output_id until it exits or deadline passes
+    """
+    with timing.phase("exec"):
+        channel.exec_command(cmd)
+    capture = OutputCapture(output_id, max_stdout=SshConfig.OUTPUT_STORE_MAX_BYTES)
+    with cancel_registry.track(output_id, channel), timing.phase("output_read"):
+        capture.run(
+            channel, deadline, cancel_registry.watcher(output_id, _cancelled_elsewhere)
+        )
+    return capture
+
+
+def _cancelled_elsewhere(action_id: str) -> bool:
+    # Cancelling stores the action as FAILED; a missing row is an action
+    # that isn't stored yet, e.g. while /run executes it synchronously
+    current, _ = get_action_database().get_action_request(action_id)
+    return current is not None and current.is_complete()
+
+
+# Details of a server's own action kept in its entry of a fan-out action
+_SERVER_DETAILS = (
+    "output_size",
+    "output_truncated",
+    "execution_time_ms",
+    "exit_code",
+    "attempts",
+    "queue_wait_ms",
+    "steps",
+    "stderr",
+    "timed_out",
+    "timing_ms",
+)
+# Details of an action's result kept when it was cancelled while running
+_RESULT_DETAILS = _SERVER_DETAILS + ("servers", "succeeded", "failed", "skipped")
 
+
+def _fanout_worker(
+    action: ActionStatus, request: ActionRequest, auth: AuthState
+) -> ActionStatus:
+    """
+    Run the command on every server of the request in parallel, each as
+    its own action "<action_id>_<n>" waiting for a session slot on its
+    server, and aggregate their outcomes into details["servers"].  Servers
+    whose connection failed are left ACTIVE with their retry details, and
+    so is the action until they are retried: when run again only those
+    servers whose next attempt is due are.
+    """
+    cmd = request.body.get("command")
+    commands = request.body.get("commands")
+    servers = expand_servers(request.body.get("ssh_server"))
+    if not (cmd or commands) or not servers:
+        return fail_action(action, SshConfig.ERROR_MISSING_INPUT)
+    if len(servers) > SshConfig.FANOUT_MAX_SERVERS:
+        return fail_action(
+            action,
+            SshConfig.ERROR_TOO_MANY_SERVERS.format(limit=SshConfig.FANOUT_MAX_SERVERS),
+        )
+    failure_mode = request.body.get("failure_mode") or "any"
+
+    # Results of an earlier run, when some servers are waiting to retry
+    results = {}
+    if action.status == ActionStatusValue.ACTIVE:
+        results = dict(_get_detail(action.details, "servers") or {})
+    now = time.time()
+    skip_retries = failure_mode == FailureMode.FAIL_FAST and any(
+        result["status"] == FAILED for result in results.values()
+    )
+    to_run = []
+    for server in servers:
+        result = results.get(server)
+        if result is None:
+            to_run.append(server)
+        elif result["status"] != ACTIVE:
+            continue
+        elif skip_retries:
+            results[server] = {"status": SKIPPED}
+        elif _next_attempt_at(result) <= now:
+            to_run.append(server)
+
+    def run_one(_: int, server: str) -> Dict[str, Any]:
+        if cancel_registry.is_cancelled(action.action_id):
+            return {"status": SKIPPED}
+        output_id = f"{action.action_id}_{servers.index(server)}"
+        attempts = results.get(server, {}).get("attempts", [])
+        server_action = action.copy(
+            deep=True,
+            update={
+                "action_id": output_id,
+                "status": ActionStatusValue.ACTIVE,
+                "details": {"attempts": attempts} if attempts else {},
+            },
+        )
+        server_request = request.copy(deep=True)
+        server_request.body["ssh_server"] = server
+        server_action = _run_scheduled(server_action, server_request, auth)
+
+        details = server_action.details
+        if not isinstance(details, dict):
+            details = details.dict()
+        if _retry_delay(server_action) is not None:
+            return {
+                "status": ACTIVE,
+                "attempts": details["attempts"],
+                "next_attempt_in_ms": details["next_attempt_in_ms"],
+            }
+        result = {"status": "SUCCEEDED"}
+        if server_action.status != ActionStatusValue.SUCCEEDED:
+            result["status"] = "FAILED"
+            result["error"] = details.get("description")
+        result.update(
+            (name, details[name]) for name in _SERVER_DETAILS if name in details
+        )
+        if "steps" not in result:
+            result["output_id"] = output_id
+            result.setdefault("output_size", output_store.size(output_id, "stdout"))
+        return result
+
+    timer = timing.PhaseTimer()
+    if to_run:
+        results.update(
+            fan_out(
+                to_run,
+                run_one,
+                parallelism(request.body.get("max_parallel")),
+                failure_mode,
+            )
+        )
+    results = {server: results[server] for server in servers}
+
+    next_attempt_at = _next_attempt_at({"servers": results})
+    if next_attempt_at is not None:
+        action.status = ActionStatusValue.ACTIVE
+        action.details = {
+            "servers": results,
+            "next_attempt_in_ms": max(int((next_attempt_at - time.time()) * 1000), 0),
+        }
+        return action
+
+    counts, code, description = summarize(results, failure_mode)
+
+    if code is None:
+        action.status = ActionStatusValue.SUCCEEDED
+        action.completion_time = SshUtil.iso_tz_now()
+        action.details = {}
+    else:
+        fail_action(action, description, code=code)
+    _set_detail(action, "servers", results)
+    for name, count in counts.items():
+        _set_detail(action, name, count)
+    _set_detail(action, "execution_time_ms", timer.elapsed_ms())
+    return action
+
+
+def _utf8_prefix_length(data: bytes) -> int:
+    """
+    Length of the longest prefix of data that doesn't end part way
+    through a multi-byte UTF-8 character
+    """
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if byte & 0xC0 != 0x80:
+            # Lead byte: keep it only if its character is complete
+            if byte >= 0xC0:
+                needed = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+                if needed > back:
+                    return len(data) - back
+            break
+    return len(data)
+
+
+def _page_window(request: ActionRequest) -> Tuple[int, int]:
+    """
+    The offset and limit of the output page to return, from the request
+    body or the ?offset=&limit= query arguments when paging through a status
+    """
+    offset = request.body.get("offset") or 0
+    limit = request.body.get("limit") or SshConfig.OUTPUT_READ_BYTES
+    if has_request_context():
+        offset = flask_request.args.get("offset", offset, type=int)
+        limit = flask_request.args.get("limit", limit, type=int)
+    return max(offset, 0), min(max(limit, 1), SshConfig.OUTPUT_PAGE_MAX_BYTES)
+
+
+def _add_output_page(
+    details: Dict[str, Any], output_id: str, offset: int, limit: int
+):
+    total = details["output_size"]
+    page = output_store.read(output_id, "stdout", offset, limit)
+    if offset + len(page) < total:
+        page = page[:_utf8_prefix_length(page)]
+    next_offset = offset + len(page)
+
+    details["ssh_output"] = page.decode("utf-8", "replace")
+    details["output_offset"] = offset
+    details["output_next_offset"] = next_offset if next_offset < total else None
+
+
+def _output_entries(details) -> List[Dict[str, Any]]:
+    """
+    The per-server and per-step entries of action details that have
+    their own stored output, including the steps of each server
+    """
+    servers, steps = _get_detail(details, "servers"), _get_detail(details, "steps")
+    entries = []
+    for entry in list((servers or {}).values()) + list(steps or []):
+        if "output_id" in entry:
+            entries.append(entry)
+        entries.extend(_output_entries(entry))
+    return entries
+
+
+def _with_output_page(action: ActionStatus, request: ActionRequest) -> ActionStatus:
+    """
+    Return a copy of a completed action with one page of its stored
+    output in details["ssh_output"], or in that of each server or step
+    of the action.  The page is chosen by the offset and limit of the
+    request body, see _page_window.
+    """
+    if _output_entries(action.details):
+        offset, limit = _page_window(request)
+        action = action.copy(deep=True)
+        for entry in _output_entries(action.details):
+            _add_output_page(entry, entry["output_id"], offset, limit)
+        return action
+
+    output_size = _get_detail(action.details, "output_size")
+    if output_size is None:
+        return action
+
+    offset, limit = _page_window(request)
+    action = action.copy(deep=True)
+    if isinstance(action.details, dict):
+        _add_output_page(action.details, action.action_id, offset, limit)
+    else:
+        page = {"output_size": output_size}
+        _add_output_page(page, action.action_id, offset, limit)
+        for name, value in page.items():
+            _set_detail(action, name, value)
     return action
 
 
@@ -152,30 +747,223 @@ def _update_action_state(
             description=f"Consent is required for scope {required_scope}",
             required_scope=required_scope,
         )
+    elif SshConfig.ASYNC_EXECUTION and is_fanout(request.body):
+        # Each server is checked when its turn comes
+        action.status = ActionStatusValue.ACTIVE
+        action.details = {}
+    elif SshConfig.ASYNC_EXECUTION:
+        try:
+            # Don't queue actions for a server that is known to be down
+            server_health.check(request.body.get("ssh_server", ""), probe=False)
+        except CircuitOpen as e:
+            action = _server_unavailable(action, e)
+        else:
+            # The command is run by _dispatch_action once the action is stored
+            action.status = ActionStatusValue.ACTIVE
+            action.details = {}
+    elif is_fanout(request.body):
+        action = _fanout_worker(action, request, auth)
+        cancel_registry.forget(action.action_id)
     else:
-        action = _ssh_worker(action, request, auth)
+        action = _run_scheduled(action, request, auth)
+        cancel_registry.forget(action.action_id)
 
     action.display_status = action.status
     return action
 
 
-def save_action(action: ActionStatus, request=None, request_id=None):
-    assert action
-    if request_id:
-        assert request.request_id == request_id
+def _is_finished(action_id: str) -> bool:
+    # Read past the cache: another worker may have cancelled the action
+    current, _ = get_action_database().get_action_request(action_id)
+    return current is None or current.is_complete()
+
+
+def _run_in_background(
+    action: ActionStatus,
+    request: ActionRequest,
+    auth: AuthState,
+    queue_wait: float = 0.0,
+    server: Optional[str] = None,
+) -> ActionStatus:
+    # The stored version the result may replace, see the end
+    tag = get_action_database().action_tag(action.action_id)
+    try:
+        if _is_finished(action.action_id):
+            logger.info(f"Not running finished action {action.action_id}")
+            return action
+        try:
+            if is_fanout(request.body):
+                action = _fanout_worker(action, request, auth)
+            else:
+                with timing.activate(_action_timer(queue_wait)):
+                    action = _ssh_worker(action, request, auth)
+        except Exception as e:
+            logger.exception(f"Unexpected error running action {action.action_id}")
+            fail_action(action, f"Unexpected {SshUtil.get_start(str(e))}")
+    finally:
+        if server is not None:
+            server_scheduler.release(server)
+        cancel_registry.forget(action.action_id)
+    action.display_status = action.status
+    _set_detail(action, "queue_wait_ms", int(queue_wait * 1000))
+    if action.status == ActionStatusValue.ACTIVE:
+        # Waiting to retry in this process
+        _set_detail(action, "worker", _worker_id())
+
+    if not save_action(action, request=request, if_tag=tag):
+        # Released or cancelled while the command was running
+        logger.info(f"Discarding result of finished action {action.action_id}")
+        _keep_partial_result(action, request)
+        return action
+
+    delay = _retry_delay(action)
+    if delay is not None:
+        logger.info(f"Retrying action {action.action_id} in {delay:.1f}s")
+        retry_timer.call_later(delay, _dispatch_action, action, request, auth)
+    return action
+
+
+def _keep_partial_result(action: ActionStatus, request: ActionRequest):
+    """
+    Add what a cancelled action got done, e.g. the size of the output it
+    printed before being stopped, to its stored status
+    """
+    stored, _ = get_action_database().get_action_request(action.action_id)
+    if stored is None or not stored.is_complete():
+        return
+    kept = False
+    for name in _RESULT_DETAILS:
+        value = _get_detail(action.details, name)
+        if value is not None and _get_detail(stored.details, name) is None:
+            _set_detail(stored, name, value)
+            kept = True
+    if kept:
+        save_action(stored, request=request, force=True)
+
+
+def _dispatch_action(
+    action: ActionStatus, request: ActionRequest, auth: AuthState
+) -> ActionStatus:
+    """
+    Queue a stored ACTIVE action for a session slot on its server, then
+    hand it to the background executor.  If the executor is saturated the
+    action keeps its slot and is handed to it again a little later: the
+    thread that got it the slot may be the retry timer's, or one releasing
+    another action's slot, which must not run the command themselves.
+    """
+    server = _scheduled_server(request)
+    queued = action.copy(deep=True)
+
+    def start(queue_wait: float):
+        future = action_executor.submit(
+            _run_in_background, queued, request, auth, queue_wait, server
+        )
+        if future is None:
+            delay = SshConfig.EXECUTOR_SATURATED_RETRY_SECONDS
+            retry_timer.call_later(delay, start, queue_wait + delay)
+            return
+        cancel_registry.track_future(action.action_id, future)
+        if server is not None:
+            future.add_done_callback(release_if_cancelled)
+
+    def release_if_cancelled(future):
+        # A cancelled future never ran _run_in_background to free its slot
+        if future.cancelled():
+            server_scheduler.release(server)
+
+    if server is None:
+        start(0.0)
     else:
-        assert request
-        request_id = request.request_id
-    ActionDatabase().store_action_request(
-        action,
-        request=request,
-        action_id=request_id
-    )
+        try:
+            server_scheduler.schedule(server, action.creator_id, start)
+        except ServerBusy as e:
+            fail_action(action, str(e), code="ServerBusy")
+            action.display_status = action.status
+            save_action(action, request=request)
+    return action
+
 
+def _worker_id() -> str:
+    # Called each time: gunicorn forks its workers after import
+    return f"{socket.gethostname()}:{os.getpid()}"
 
-def delete_action(request_id):
+
+def _start_action(
+    action: ActionStatus, request: ActionRequest, auth: AuthState
+) -> ActionStatus:
+    action = _update_action_state(action, request, auth)
+    if SshConfig.ASYNC_EXECUTION and action.status == ActionStatusValue.ACTIVE:
+        # Lets fail_interrupted_actions() tell whether its worker died
+        _set_detail(action, "worker", _worker_id())
+    save_action(action, request=request)
+    if SshConfig.ASYNC_EXECUTION and action.status == ActionStatusValue.ACTIVE:
+        action = _dispatch_action(action, request, auth)
+    return action
+
+
+def _refresh_action_state(
+    action: ActionStatus, request: ActionRequest, auth: AuthState
+) -> ActionStatus:
+    """
+    In asynchronous mode the background worker owns the action state and
+    the stored status is current; synchronous mode runs the action here,
+    or its next connection attempt once that is due.  Actions waiting for their server to come back are restarted once it
+    may be connected to again, but only with their creator's token.
+    """
+    if SshConfig.ASYNC_EXECUTION:
+        if (
+            _waiting_for_server(action)
+            and auth.effective_identity == action.creator_id
+            and not server_health.retry_after(request.body.get("ssh_server", ""))
+        ):
+            return _start_action(action, request, auth)
+        return action
+    if not _retry_due(action):
+        # Polled again before its next connection attempt is due
+        return action
+    action = _update_action_state(action, request, auth)
+    save_action(action, request=request)
+    return action
+
+
+def save_action(
+    action: ActionStatus, request=None, force: bool = False, if_tag: Optional[str] = None
+) -> bool:
+    """
+    Store action, unless it is already stored as finished.  With if_tag
+    it is only stored if the stored version is still if_tag (see
+    ActionDatabase.action_tag()), so that nothing written meanwhile, like
+    a cancellation, is overwritten.  Returns whether it was stored.
+    """
+    assert action and action.action_id
+    if not force and action_cache.is_complete(action.action_id):
+        # Finished actions don't change, the stored row is already final
+        return False
+    if if_tag is None:
+        get_action_database().store_action_request(
+            action,
+            request=request,
+            action_id=action.action_id
+        )
+    elif not get_action_database().store_action_request_if_tag(
+        action, if_tag, request=request, action_id=action.action_id
+    ):
+        action_cache.invalidate(action.action_id)
+        return False
+    action_cache.put(action.action_id, action, request)
+    status_versions.notify_changed()
+    return True
+
+
+def delete_action(request_id, action: Optional[ActionStatus] = None):
     assert request_id
-    ActionDatabase().delete_action_request(action_id=request_id)
+    action_cache.invalidate(request_id)
+    status_versions.forget(request_id)
+    get_action_database().delete_action_request(action_id=request_id)
+    output_store.delete(request_id)
+    if action is not None:
+        for entry in _output_entries(action.details):
+            output_store.delete(entry["output_id"])
 
 
 def get_status(request_id):
@@ -185,7 +973,34 @@ def get_status(request_id):
 
 def get_status_and_request(request_id):
     assert request_id
-    return ActionDatabase().get_action_request(action_id=request_id)
+    cached = action_cache.get(request_id)
+    if cached is not None:
+        return cached
+    status, request = get_action_database().get_action_request(action_id=request_id)
+    if status is not None:
+        action_cache.put(request_id, status, request)
+    return status, request
+
+
+def get_statuses_and_requests(request_ids) -> Dict[str, Tuple[ActionStatus, Any]]:
+    """
+    (status, request) of those of request_ids that exist, by id; the ones
+    not cached are read from the database together
+    """
+    found = {}
+    missing = []
+    for request_id in request_ids:
+        cached = action_cache.get(request_id)
+        if cached is not None:
+            found[request_id] = cached
+        else:
+            missing.append(request_id)
+    if missing:
+        stored = get_action_database().get_action_requests(missing)
+        for request_id, (status, request) in stored.items():
+            action_cache.put(request_id, status, request)
+            found[request_id] = status, request
+    return found
 
 
 @provider_bp.action_run
@@ -201,9 +1016,8 @@ def run_action(request: ActionRequest, auth: AuthState) -> Tuple[ActionStatus, i
         details={},
     )
 
-    status = _update_action_state(status, request, auth)
-    save_action(status, request)
-    return status, 202
+    status = _start_action(status, request, auth)
+    return _with_output_page(status, request), 202
 
 
 @provider_bp.action_resume
@@ -213,20 +1027,39 @@ def action_resume(action_id: str, auth: AuthState):
         raise ActionNotFound(f"No Action with id {action_id} found")
     authorize_action_management_or_404(action, auth)
 
-    action = _update_action_state(action, request, auth)
-    save_action(action, request=request)
-    return action
+    if SshConfig.ASYNC_EXECUTION and action.status == ActionStatusValue.ACTIVE:
+        # Already running on the background executor
+        return action
+    action = _start_action(action, request, auth)
+    return _with_output_page(action, request)
+
+
+def _is_settled(action: ActionStatus) -> bool:
+    # Whether _refresh_action_state leaves action as it is
+    if action.is_complete():
+        return True
+    return SshConfig.ASYNC_EXECUTION and not _waiting_for_server(action)
 
 
 @provider_bp.action_status
 def action_status(action_id: str, auth: AuthState):
+    # Read the version first: the status served is at least as recent
+    tag = status_versions.current(action_id)
+    if not status_versions.is_served(action_id, tag):
+        # Changed since it was last served, a cached copy may be older
+        action_cache.invalidate(action_id)
     action, request = get_status_and_request(action_id)
     if action:
         authorize_action_access_or_404(action, auth)
-
-        action = _update_action_state(action, request, auth)
-        save_action(action, request=request)
-        return action
+        viewers = None
+        if _is_settled(action):
+            viewers = frozenset(chain([action.creator_id], action.monitor_by or []))
+        action = _refresh_action_state(action, request, auth)
+        if tag is not None:
+            status_versions.remember(action_id, tag, viewers)
+            if has_request_context():
+                g.status_etag = tag
+        return _with_output_page(action, request)
     else:
         raise ActionNotFound(f"No Action with id {action_id} found")
 
@@ -243,24 +1076,216 @@ def action_cancel(action_id: str, auth: AuthState):
         status.status = ActionStatusValue.FAILED
         status.completion_time = SshUtil.iso_tz_now()
         status.display_status = f"Cancelled by {auth.effective_identity}"[:64]
+        status.details = ActionFailedDetails(
+            code="Cancelled", description=f"Cancelled by {auth.effective_identity}"
+        )
+        action_cache.invalidate(action_id)
         save_action(status, request)
+        # Stop its command if it runs in this process; others notice the
+        # stored status within CANCEL_POLL_SECONDS
+        if not cancel_registry.cancel(action_id):
+            cancel_registry.forget(action_id)
+        return status
 
 
 @provider_bp.action_release
 def action_release(action_id: str, auth: AuthState):
-    action, request = get_status(action_id)
+    action, request = get_status_and_request(action_id)
     if action is None:
         raise ActionNotFound(f"No Action with id {action_id} found")
+    return _release_action(action, request, auth)
+
+
+def _release_action(
+    action: ActionStatus, request: ActionRequest, auth: AuthState
+) -> ActionStatus:
     authorize_action_management_or_404(action, auth)
 
-    action = _update_action_state(action, request, auth)
+    action = _refresh_action_state(action, request, auth)
     if not action.is_complete():
         raise ActionConflict("Action is not complete")
 
-    delete_action(action_id)
+    action = _with_output_page(action, request)
+    delete_action(action.action_id, action)
     return action
 
 
+def _status_json(action: ActionStatus) -> Dict[str, Any]:
+    """
+    action as plain JSON types, for responses that hold several actions
+    """
+    return json.loads(action.json())
+
+
+def _batch_action_ids() -> List[str]:
+    body = flask_request.get_json(silent=True)
+    action_ids = body.get("action_ids") if isinstance(body, dict) else None
+    if not isinstance(action_ids, list) or not all(
+        isinstance(action_id, str) for action_id in action_ids
+    ):
+        raise BadActionRequest('Expected a body of {"action_ids": [...]}')
+    if len(action_ids) > SshConfig.BATCH_MAX_ACTIONS:
+        raise BadActionRequest(
+            f"At most {SshConfig.BATCH_MAX_ACTIONS} action ids per request"
+        )
+    return list(dict.fromkeys(action_ids))
+
+
+@provider_bp.route("/actions/status", methods=["POST"])
+def action_status_many():
+    """
+    Statuses of the actions listed in a {"action_ids": [...]} body, read
+    from the database in one go.  Ids of actions that don't exist or the
+    caller may not view, which the status endpoint answers 404 for, are
+    listed under not_found.
+    """
+    action_ids = _batch_action_ids()
+    auth = g.auth_state
+    found = get_statuses_and_requests(action_ids)
+    statuses = []
+    not_found = []
+    for action_id in action_ids:
+        action, request = found.get(action_id, (None, None))
+        if action is None:
+            not_found.append(action_id)
+            continue
+        try:
+            authorize_action_access_or_404(action, auth)
+        except AuthenticationError:
+            not_found.append(action_id)
+            continue
+        action = _refresh_action_state(action, request, auth)
+        statuses.append(_status_json(_with_output_page(action, request)))
+    return jsonify({"actions": statuses, "not_found": not_found}), 200
+
+
+@provider_bp.route("/actions/release", methods=["POST"])
+def action_release_many():
+    """
+    Release the actions listed in a {"action_ids": [...]} body, like the
+    release endpoint does one at a time.  Ids of actions that aren't
+    complete yet are listed under not_complete, the ones release answers
+    404 for under not_found.
+    """
+    action_ids = _batch_action_ids()
+    auth = g.auth_state
+    found = get_statuses_and_requests(action_ids)
+    released = []
+    not_found = []
+    not_complete = []
+    for action_id in action_ids:
+        action, request = found.get(action_id, (None, None))
+        if action is None:
+            not_found.append(action_id)
+            continue
+        try:
+            released.append(_status_json(_release_action(action, request, auth)))
+        except AuthenticationError:
+            not_found.append(action_id)
+        except ActionConflict:
+            not_complete.append(action_id)
+    return jsonify(
+        {"actions": released, "not_found": not_found, "not_complete": not_complete}
+    ), 200
+
+
+@provider_bp.action_log
+def action_log(action_id: str, auth: AuthState):
+    """
+    Tail the output of an action while it runs.  Query arguments:
+
+            * offset: byte offset to read from, the next_offset of the
+              previous response
+            * limit: most bytes to return
+            * wait: seconds to wait for output past offset, if there is
+              none yet and the action is still running
+            * stream: stdout (default) or stderr
+            * output_id: the output_id of one server or step of the
+              action, instead of the action's own output
+    """
+    action = get_status(action_id)
+    if action is None:
+        raise ActionNotFound(f"No Action with id {action_id} found")
+    authorize_action_access_or_404(action, auth)
+
+    args = flask_request.args
+    output_id = args.get("output_id", action_id)
+    if root_action_id(output_id) != action_id or not output_store.is_valid_key(output_id):
+        raise ActionNotFound(f"No output {output_id} for Action {action_id}")
+    stream = args.get("stream", "stdout")
+    if stream not in output_store.STREAMS:
+        raise BadActionRequest(f"Unknown output stream {stream}")
+    offset = max(args.get("offset", 0, type=int), 0)
+    limit = min(
+        max(args.get("limit", SshConfig.OUTPUT_READ_BYTES, type=int), 1),
+        SshConfig.OUTPUT_PAGE_MAX_BYTES,
+    )
+    wait = min(max(args.get("wait", 0.0, type=float), 0.0), SshConfig.LOG_WAIT_MAX_SECONDS)
+
+    def finished() -> bool:
+        current = get_status(action_id)
+        return current is None or current.is_complete()
+
+    if wait and not action.is_complete():
+        output_store.wait_for(output_id, stream, offset, wait, done=finished)
+        action = get_status(action_id) or action
+
+    size = output_store.size(output_id, stream)
+    data = output_store.read(output_id, stream, offset, limit)
+    if offset + len(data) < size or not action.is_complete():
+        # The rest of a character split here comes with the next read
+        data = data[:_utf8_prefix_length(data)]
+    next_offset = offset + len(data)
+    return {
+        "action_id": action_id,
+        "output_id": output_id,
+        "stream": stream,
+        "status": action.status,
+        "offset": offset,
+        "next_offset": next_offset,
+        "data": data.decode("utf-8", "replace"),
+        "more": next_offset < size or not action.is_complete(),
+    }
+
+
+def _process_is_running(pid: int) -> bool:
+    if pid == os.getpid():
+        # Starting up, this process isn't running anything yet
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def fail_interrupted_actions() -> int:
+    """
+    Fail the ACTIVE actions whose worker process on this host is gone,
+    which would otherwise stay ACTIVE forever.  Actions run on other
+    hosts sharing the store are left to those.  Returns how many failed.
+    """
+    host = socket.gethostname()
+    failed = 0
+    for action, request in get_action_database().action_requests():
+        if action.status != ActionStatusValue.ACTIVE:
+            continue
+        worker = _get_detail(action.details, "worker") or ""
+        worker_host, _, pid = worker.rpartition(":")
+        if worker_host != host or not pid.isdigit() or _process_is_running(int(pid)):
+            continue
+        fail_action(action, SshConfig.ERROR_INTERRUPTED, code="Interrupted")
+        action.completion_time = SshUtil.iso_tz_now()
+        action.display_status = action.status
+        save_action(action, request=request)
+        failed += 1
+    if failed:
+        logger.info(f"Failed {failed} actions interrupted by the end of their worker")
+    return failed
+
+
 def load_ssh_provider(app: Flask, config: dict = None) -> Flask:
     """
     This is the entry point for the Flask blueprint
@@ -299,6 +1324,7 @@ def load_ssh_provider(app: Flask, config: dict = None) -> Flask:
     ap_description.administered_by = config["administered_by"]
 
     app.register_blueprint(provider_bp)
+    fail_interrupted_actions()
 
     logger.info("SSH Provider loaded successfully")
 
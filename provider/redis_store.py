@@ -0,0 +1,393 @@
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from typing import Any, Iterable, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from provider.config import SshConfig
+from provider.local_db import KeyValueStore
+from provider.output_store import OutputStore
+
+logger = logging.getLogger(__name__)
+
+
+class RedisError(Exception):
+    """
+    An error reply from the server
+    """
+
+
+class RespConnection:
+    """
+    Minimal client for the Redis serialization protocol (RESP2), enough
+    for the handful of commands RedisStore needs without another dependency
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 6379,
+        db: int = 0,
+        password: Optional[str] = None,
+        username: Optional[str] = None,
+        timeout: float = SshConfig.REDIS_TIMEOUT_SECONDS,
+    ):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        if password:
+            if username:
+                self.execute("AUTH", username, password)
+            else:
+                self.execute("AUTH", password)
+        if db:
+            self.execute("SELECT", db)
+
+    @staticmethod
+    def _encode(args: Iterable[Any]) -> bytes:
+        parts = []
+        args = list(args)
+        parts.append(b"*%d\r\n" % len(args))
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            elif isinstance(arg, int):
+                arg = str(arg).encode("ascii")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply {line!r}")
+
+    def execute(self, *args):
+        self.sock.sendall(self._encode(args))
+        return self._read_reply()
+
+    def is_closed(self) -> bool:
+        """
+        Whether the server closed the connection while it was idle, e.g.
+        after its timeout; nothing else is sent to us between replies
+        """
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            return bool(readable)
+        except (OSError, ValueError):
+            return True
+
+    def pipeline(self, commands: List[Tuple]) -> List[Any]:
+        """
+        Send several commands in one write, then read all their replies
+        """
+        self.send(commands)
+        return self.read_replies(len(commands))
+
+    def send(self, commands: List[Tuple]):
+        self.sock.sendall(b"".join(self._encode(c) for c in commands))
+
+    def read_replies(self, count: int) -> List[Any]:
+        replies = []
+        error = None
+        for _ in range(count):
+            try:
+                replies.append(self._read_reply())
+            except RedisError as e:
+                error = error or e
+                replies.append(e)
+        if error:
+            raise error
+        return replies
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisStore(KeyValueStore):
+    """
+    KeyValueStore kept on a server speaking the Redis protocol, so that
+    every pod behind a load balancer sees the same actions.
+
+    Keys are stored as <namespace>:<key>; ':' is not allowed in keys so
+    namespaces can't collide.  Each thread keeps its own connection.
+    Expiring entries are set with a TTL and removed by the server itself.
+    Needs Redis 6.2 or later, for SET ... GET.
+
+    Usage:
+            * store = RedisStore("redis://:password@redis.internal:6379/0", "globus_actions")
+            * store.put("action_id", b"...")
+    """
+
+    def __init__(self, url: str = SshConfig.REDIS_URL, namespace: str = "ssh_local_db"):
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"Unsupported redis url {url}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.namespace = namespace
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _connection(self) -> RespConnection:
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = RespConnection(
+                self.host, self.port, self.db, self.password, self.username
+            )
+            self._local.conn = conn
+        return conn
+
+    def _execute(self, *args):
+        return self._pipeline([args])[0]
+
+    def _pipeline(self, commands):
+        conn = self._connection()
+        if conn.is_closed():
+            self.close()
+            conn = self._connection()
+        try:
+            conn.send(commands)
+        except OSError:
+            # Closed by the server before it read anything, send them again
+            # over a new connection
+            self.close()
+            conn = self._connection()
+            conn.send(commands)
+        try:
+            return conn.read_replies(len(commands))
+        except OSError:
+            # The commands may have run, e.g. when the replies timed out, so
+            # they aren't sent again; the connection is out of step
+            self.close()
+            raise
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def get(self, key):
+        if not self.is_valid_key(key):
+            return None
+        return self._execute("GET", self._key(key))
+
+    def get_many(self, keys):
+        keys = [key for key in dict.fromkeys(keys) if self.is_valid_key(key)]
+        values = {}
+        for start in range(0, len(keys), 1000):
+            chunk = keys[start:start + 1000]
+            replies = self._execute("MGET", *(self._key(key) for key in chunk))
+            values.update(
+                (key, value) for key, value in zip(chunk, replies) if value is not None
+            )
+        return values
+
+    def _set_command(self, key, value, expires_at, now) -> Tuple:
+        # SET ... GET replies with the value it replaced, see put_many()
+        if not self.is_valid_key(key):
+            raise ValueError('Key can not contain (;) or (")')
+        if expires_at is None:
+            return ("SET", self._key(key), value, "GET")
+        if expires_at > now:
+            ttl_ms = max(int((expires_at - now) * 1000), 1)
+            return ("SET", self._key(key), value, "PX", ttl_ms, "GET")
+        return ("DEL", self._key(key))
+
+    def put_many(self, items):
+        """
+        Set several (key, value[, expires_at]) tuples in one round trip,
+        returns the number of values that changed: those SET replaced a
+        different value of, and the keys deleted because they had
+        already expired.  Setting the same value with a new expiry
+        doesn't count as a change.
+        """
+        now = time.time()
+        commands = []
+        values = []
+        for key, value, expires_at in self._with_expiry(items):
+            commands.append(self._set_command(key, value, expires_at, now))
+            values.append(value.encode("utf-8") if isinstance(value, str) else value)
+        if not commands:
+            return 0
+        replies = self._pipeline(commands)
+        changed = 0
+        for command, value, reply in zip(commands, values, replies):
+            if command[0] == "DEL":
+                changed += reply
+            elif reply != value:
+                changed += 1
+        return changed
+
+    def put_if_tag(self, key, value, tag, expires_at=None):
+        """
+        Update key only if tag(key) is still tag: the key is WATCHed while
+        its value is compared, and the server drops the write if another
+        client changes the key before EXEC
+        """
+        command = self._set_command(key, value, expires_at, time.time())
+        if tag is None:
+            return False
+        conn = self._connection()
+        try:
+            conn.execute("WATCH", self._key(key))
+            current = conn.execute("GET", self._key(key))
+            if current is None or self._value_tag(current) != tag:
+                conn.execute("UNWATCH")
+                return False
+            replies = conn.pipeline([("MULTI",), command, ("EXEC",)])
+        except OSError:
+            # Not retried: the transaction may have been applied
+            self.close()
+            raise
+        return replies[-1] is not None
+
+    def delete(self, key):
+        if not self.is_valid_key(key):
+            logger.error(f"Invalid key: {key}")
+            return
+        self._execute("DEL", self._key(key))
+
+    def items(self, batch_size=1000):
+        prefix = self._key("")
+        cursor = b"0"
+        while True:
+            cursor, keys = self._execute(
+                "SCAN", cursor, "MATCH", prefix + "*", "COUNT", batch_size
+            )
+            if keys:
+                values = self._execute("MGET", *keys)
+                for key, value in zip(keys, values):
+                    if value is not None:
+                        yield key.decode("utf-8")[len(prefix):], value
+            if cursor in (b"0", 0):
+                break
+
+    def delete_database(self):
+        keys = [self._key(key) for key, _ in self.items()]
+        for start in range(0, len(keys), 1000):
+            self._execute("DEL", *keys[start:start + 1000])
+
+
+class _RedisOutputWriter:
+    """
+    Append handle of one output stream, see RedisOutputStore.writer()
+    """
+
+    def __init__(self, store: "RedisOutputStore", key: str):
+        self.store = store
+        self.key = key
+
+    def write(self, data: bytes) -> int:
+        self.store._append(self.key, data)
+        return len(data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RedisOutputStore(OutputStore):
+    """
+    OutputStore kept on the Redis server next to the actions, so that a
+    status, page, log tail or release of an action works on any pod, not
+    only on the one that ran it.
+
+    Each stream is one string, <namespace>:<action_id>.<stream>, that
+    chunks are APPENDed to as they arrive and pages are read from with
+    GETRANGE.  Like the spool files ExpirySweeper removes, a stream
+    expires retention_seconds after it was last written to; sweep() has
+    nothing left to do.
+    """
+
+    def __init__(
+        self,
+        url: str = SshConfig.REDIS_URL,
+        namespace: str = "ssh_output",
+        retention_seconds: float = SshConfig.ACTION_RETENTION_SECONDS,
+    ):
+        super().__init__()
+        self.redis = RedisStore(url, namespace=namespace)
+        self.retention_seconds = retention_seconds
+
+    def _key(self, action_id: str, stream: str) -> str:
+        return self.redis._key(self._name(action_id, stream))
+
+    def _append(self, key: str, data: bytes):
+        commands = [("APPEND", key, data)]
+        if self.retention_seconds:
+            commands.append(("PEXPIRE", key, int(self.retention_seconds * 1000)))
+        self.redis._pipeline(commands)
+
+    def writer(self, action_id: str, stream: str) -> _RedisOutputWriter:
+        return _RedisOutputWriter(self, self._key(action_id, stream))
+
+    def append(self, action_id: str, stream: str, data: bytes):
+        self._append(self._key(action_id, stream), data)
+
+    def size(self, action_id: str, stream: str) -> int:
+        return self.redis._execute("STRLEN", self._key(action_id, stream))
+
+    def read(
+        self,
+        action_id: str,
+        stream: str,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> bytes:
+        offset = max(offset, 0)
+        if limit is not None and limit <= 0:
+            return b""
+        end = -1 if limit is None else offset + limit - 1
+        return self.redis._execute(
+            "GETRANGE", self._key(action_id, stream), offset, end
+        )
+
+    def delete(self, action_id: str):
+        self.redis._execute(
+            "DEL", *(self._key(action_id, stream) for stream in self.STREAMS)
+        )
+
+    def sweep(self, max_age_seconds: float, now: Optional[float] = None) -> int:
+        # Streams expire on the server
+        return 0
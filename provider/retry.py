@@ -0,0 +1,155 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from paramiko.ssh_exception import (
+    AuthenticationException,
+    BadHostKeyException,
+    ChannelException,
+    SSHException,
+)
+
+from provider.config import SshConfig
+from provider.util import SshUtil
+
+logger = logging.getLogger(__name__)
+
+Attempt = Dict[str, Any]
+
+# SSHException carries no subclass for these, only its message
+_TRANSIENT_SSH_ERRORS = (
+    "error reading ssh protocol banner",
+    "no existing session",
+    "connection reset",
+    "unable to connect",
+    "timed out",
+    "eof during negotiation",
+)
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether a failure to get an SSH session may go away by itself, such as
+    a full MaxStartups queue, a reset connection or a banner timeout.
+    Rejected credentials, host key mismatches and unknown host names won't.
+    """
+    if isinstance(error, (AuthenticationException, BadHostKeyException, socket.gaierror)):
+        return False
+    if isinstance(error, ChannelException):
+        # Opening the channel was refused, e.g. MaxSessions was reached
+        return True
+    if isinstance(error, SSHException):
+        message = str(error).lower()
+        return any(transient in message for transient in _TRANSIENT_SSH_ERRORS)
+    # Timeouts, refused and reset connections, NoValidConnectionsError
+    return isinstance(error, (OSError, EOFError))
+
+
+def describe_error(error: Exception) -> str:
+    return SshUtil.get_start(
+        f"{type(error).__name__}: {error}", max_length=200, replace_line_breaks=True
+    )
+
+
+class RetryPolicy:
+    """
+    Capped exponential backoff with full jitter: before attempt n + 1 wait
+    a random time of up to min(max_delay, base_delay * 2 ** (n - 1)),
+    for at most max_attempts attempts, and only while the next attempt
+    starts within deadline seconds of the first failure.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = SshConfig.RETRY_MAX_ATTEMPTS,
+        base_delay: float = SshConfig.RETRY_BASE_DELAY_SECONDS,
+        max_delay: float = SshConfig.RETRY_MAX_DELAY_SECONDS,
+        deadline: float = SshConfig.RETRY_DEADLINE_SECONDS,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt: int) -> float:
+        cap = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, cap)
+
+    def record_failure(self, attempts: List[Attempt], error: Exception) -> Optional[float]:
+        """
+        Add a failed attempt to attempts, returns how long to wait before
+        the next one, or None if the action shouldn't be retried
+        """
+        retryable = is_retryable(error)
+        attempts.append(
+            {
+                "attempt": len(attempts) + 1,
+                "at": round(time.time(), 3),
+                "error": describe_error(error),
+                "retryable": retryable,
+            }
+        )
+        if not retryable or len(attempts) >= self.max_attempts:
+            return None
+        delay = self.backoff(len(attempts))
+        if attempts[-1]["at"] + delay - attempts[0]["at"] > self.deadline:
+            return None
+        return delay
+
+
+class RetryTimer:
+    """
+    Runs callbacks after a delay on one shared thread, so that actions
+    waiting to retry don't each hold a worker while they sleep.  Like the
+    action executor it is started lazily, per process.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap: List = []
+        self._counter = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def call_later(self, delay: float, fn: Callable, *args):
+        with self._cond:
+            if self._pid != os.getpid() or self._thread is None:
+                self._heap = []
+                self._thread = threading.Thread(
+                    target=self._run, name="retry-timer", daemon=True
+                )
+                self._pid = os.getpid()
+                self._thread.start()
+            heapq.heappush(
+                self._heap, (time.monotonic() + delay, next(self._counter), fn, args)
+            )
+            self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due = self._heap[0][0] - time.monotonic()
+                if due > 0:
+                    self._cond.wait(due)
+                    continue
+                _, _, fn, args = heapq.heappop(self._heap)
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("Delayed retry failed")
+
+
+retry_policy = RetryPolicy()
+retry_timer = RetryTimer()
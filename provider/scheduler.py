@@ -0,0 +1,190 @@
+import contextlib
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Iterator, Optional
+
+from provider.config import SshConfig
+
+logger = logging.getLogger(__name__)
+
+StartCallback = Callable[[float], None]
+
+
+class ServerBusy(Exception):
+    """
+    Raised when a server's queue of waiting actions is full
+    """
+
+
+class _Waiting:
+    __slots__ = ("start", "queued_at")
+
+    def __init__(self, start: StartCallback):
+        self.start = start
+        self.queued_at = time.monotonic()
+
+
+class _ServerQueue:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.queued = 0
+        # identity -> actions it has waiting, in round-robin order
+        self.by_identity: "OrderedDict[str, Deque[_Waiting]]" = OrderedDict()
+
+    def pop_next(self) -> Optional[_Waiting]:
+        if not self.by_identity:
+            return None
+        identity, waiting = next(iter(self.by_identity.items()))
+        entry = waiting.popleft()
+        if waiting:
+            self.by_identity.move_to_end(identity)
+        else:
+            del self.by_identity[identity]
+        self.queued -= 1
+        return entry
+
+
+class ServerScheduler:
+    """
+    Limits the number of SSH sessions running against each server at
+    once, so a burst of runs can't exceed a login node's MaxStartups or
+    MaxSessions.
+
+    An action that finds all of its server's slots taken waits in a queue
+    per identity; freed slots go to those queues round-robin, so one user
+    submitting hundreds of actions doesn't hold up everyone else.  Queued
+    actions don't occupy a thread: schedule() calls back once a slot is
+    theirs.  At most max_queued actions wait per server, past that
+    ServerBusy is raised.
+
+    The limit of a server is the "max_sessions" entry of its
+    SshConfig.KNOWN_SERVER_SCOPES entry, or default_limit.
+    Usage:
+            * with server_scheduler.slot(server, action.creator_id) as waited:
+            *     ...
+    """
+
+    def __init__(
+        self,
+        default_limit: int = SshConfig.SERVER_MAX_SESSIONS,
+        max_queued: int = SshConfig.SERVER_MAX_QUEUED,
+    ):
+        self.default_limit = default_limit
+        self.max_queued = max_queued
+        self._lock = threading.Lock()
+        self._servers: Dict[str, _ServerQueue] = {}
+
+    def limit_for(self, server: str) -> int:
+        config = SshConfig.KNOWN_SERVER_SCOPES.get(server, {})
+        return max(int(config.get("max_sessions", self.default_limit)), 1)
+
+    def _queue(self, server: str) -> _ServerQueue:
+        queue = self._servers.get(server)
+        if queue is None:
+            queue = self._servers[server] = _ServerQueue(self.limit_for(server))
+        return queue
+
+    def schedule(self, server: str, identity: str, start: StartCallback):
+        """
+        Call start(seconds_waited) as soon as a slot on server is free,
+        right away if one is.  The slot is held until release(server).
+        """
+        with self._lock:
+            queue = self._queue(server)
+            if queue.active < queue.limit and not queue.queued:
+                queue.active += 1
+                run_now = True
+            elif queue.queued >= self.max_queued:
+                raise ServerBusy(
+                    SshConfig.ERROR_SERVER_BUSY.format(server=server, queued=queue.queued)
+                )
+            else:
+                queue.by_identity.setdefault(identity, deque()).append(_Waiting(start))
+                queue.queued += 1
+                run_now = False
+        if run_now:
+            self._start(server, start, 0.0)
+
+    def _start(self, server: str, start: StartCallback, waited: float):
+        try:
+            start(waited)
+        except Exception:
+            logger.exception(f"Could not start queued action for {server}")
+            self.release(server)
+
+    def release(self, server: str):
+        """
+        Give a finished action's slot to the next waiting action, if any
+        """
+        with self._lock:
+            queue = self._queue(server)
+            entry = queue.pop_next()
+            if entry is None:
+                queue.active = max(queue.active - 1, 0)
+        if entry is not None:
+            self._start(server, entry.start, time.monotonic() - entry.queued_at)
+
+    @contextlib.contextmanager
+    def slot(
+        self,
+        server: str,
+        identity: str,
+        timeout: Optional[float] = SshConfig.SERVER_QUEUE_TIMEOUT_SECONDS,
+    ) -> Iterator[float]:
+        """
+        Block until a slot on server is free and hold it for the body of
+        the with statement, yields the seconds spent waiting
+        """
+        granted = threading.Event()
+        waited = []
+
+        def start(seconds: float):
+            waited.append(seconds)
+            granted.set()
+
+        self.schedule(server, identity, start)
+        if not granted.wait(timeout):
+            if not self._withdraw(server, identity, start):
+                raise ServerBusy(
+                    SshConfig.ERROR_SERVER_TIMEOUT.format(server=server, timeout=timeout)
+                )
+            # Granted just as the wait timed out
+        try:
+            yield waited[0]
+        finally:
+            self.release(server)
+
+    def _withdraw(self, server: str, identity: str, start: StartCallback) -> bool:
+        """
+        Remove a waiting action from the queue, returns True if it was
+        granted its slot in the meantime instead
+        """
+        with self._lock:
+            queue = self._queue(server)
+            waiting = queue.by_identity.get(identity, ())
+            for entry in waiting:
+                if entry.start is start:
+                    waiting.remove(entry)
+                    queue.queued -= 1
+                    if not waiting:
+                        del queue.by_identity[identity]
+                    return False
+        return True
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                server: {
+                    "limit": queue.limit,
+                    "active": queue.active,
+                    "queued": queue.queued,
+                    "identities_waiting": len(queue.by_identity),
+                }
+                for server, queue in self._servers.items()
+            }
+
+
+server_scheduler = ServerScheduler()
@@ -1,26 +1,99 @@
 import typing as t
+from enum import Enum
 
-from pydantic import BaseModel, Extra, Field
+from pydantic import BaseModel, Extra, Field, constr, root_validator
+
+
+class FailureMode(str, Enum):
+    """
+    When an action run on several servers fails
+    """
+
+    # Fails if the command failed on any server
+    ANY = "any"
+    # Fails only if the command failed on every server
+    ALL = "all"
+    # Like "any", but servers not yet started are skipped after a failure
+    FAIL_FAST = "fail_fast"
 
 
 class GlobusSshDirectorySchema(BaseModel):
-    ssh_server: str = Field(
+    ssh_server: t.Union[str, t.List[str]] = Field(
         ...,
         title="ssh_server",
-        description="The server to execute the remote ssh command on.",
+        description=(
+            "The server to execute the remote ssh command on, or a list of "
+            "servers and server groups to execute it on in parallel."
+        ),
     )
-    command: str = Field(
-        ...,
+    command: t.Optional[str] = Field(
+        None,
         title="command",
         description="A command to execute remotely.",
     )
-    limit: int = Field(100_000, title="limit", description="Set the page size.")
+    commands: t.Optional[t.List[str]] = Field(
+        None,
+        title="commands",
+        description=(
+            "Commands to execute remotely one after the other over the same "
+            "connection, instead of a single command."
+        ),
+        min_items=1,
+    )
+    stop_on_failure: bool = Field(
+        True,
+        title="stop_on_failure",
+        description="Skip the remaining commands once one exits with a non-zero status.",
+    )
+    environment: t.Optional[t.Dict[constr(regex=r"^[A-Za-z_][A-Za-z0-9_]*$"), str]] = Field(
+        None,
+        title="environment",
+        description="Environment variables set for every command.",
+    )
+    timeout_seconds: t.Optional[int] = Field(
+        None,
+        title="timeout_seconds",
+        description=(
+            "How long the commands may run before they are stopped and the "
+            "action fails, limited by the provider's maximum."
+        ),
+        gt=0,
+    )
+    limit: int = Field(
+        100_000,
+        title="limit",
+        description="Set the page size, in bytes of command output.",
+    )
     offset: t.Optional[int] = Field(
         None,
         title="offset",
-        description="If using a limit < 100,000, this can be used to page through the results.",
+        description=(
+            "If using a limit < 100,000, this can be used to page through the results. "
+            "Status responses report the next offset in details.output_next_offset."
+        ),
     )
 
+    max_parallel: t.Optional[int] = Field(
+        None,
+        title="max_parallel",
+        description="How many of several servers the command is run on at a time.",
+    )
+    failure_mode: FailureMode = Field(
+        FailureMode.ANY,
+        title="failure_mode",
+        description=(
+            "With several servers, whether the action fails when the command "
+            "fails on 'any' server, on 'all' of them, or on any server "
+            "skipping those not yet started ('fail_fast')."
+        ),
+    )
+
+    @root_validator(skip_on_failure=True)
+    def command_or_commands(cls, values):
+        if (values.get("command") is None) == (values.get("commands") is None):
+            raise ValueError("Exactly one of command or commands is required")
+        return values
+
     class Config:
         title = "Ssh Action Provider Schema"
         schema_extra = {
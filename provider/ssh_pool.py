@@ -0,0 +1,367 @@
+import contextlib
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from paramiko import AuthenticationException
+from paramiko.channel import Channel
+from paramiko.transport import Transport
+
+from provider.config import SshConfig
+from provider import timing
+from provider.health import HealthTracker, server_health
+
+logger = logging.getLogger(__name__)
+
+PoolKey = Tuple[str, str, str]
+
+
+def token_fingerprint(token: str) -> str:
+    """
+    Returns a short, non-reversible fingerprint of an access token so
+    that tokens never have to be kept around as pool keys
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+
+
+class PooledTransport:
+    """
+    An authenticated SSH connection held by the pool.  Several channels
+    (one per running command) can be multiplexed over its transport.
+    """
+
+    def __init__(self, key: PoolKey, transport: Transport):
+        self.key = key
+        self.transport = transport
+        self.channels = 0
+        self.retired = False
+        self.last_used = time.monotonic()
+        self.last_checked = self.last_used
+
+    @property
+    def server(self) -> str:
+        return self.key[0]
+
+    @property
+    def username(self) -> str:
+        return self.key[1]
+
+    def is_alive(self) -> bool:
+        return self.transport is not None and self.transport.is_active()
+
+    def is_idle_for(self, seconds: float, now: float) -> bool:
+        return self.channels == 0 and now - self.last_used > seconds
+
+    def ping(self) -> bool:
+        """
+        Health check an idle transport before handing it out again
+        """
+        if not self.is_alive():
+            return False
+        try:
+            self.transport.send_ignore()
+        except Exception as e:
+            logger.info(f"Keepalive to {self.server} failed: {e}")
+            return False
+        self.last_checked = time.monotonic()
+        return True
+
+    def close(self):
+        try:
+            self.transport.close()
+        except Exception as e:
+            logger.debug(f"Error closing transport to {self.server}: {e}")
+
+
+class SshConnectionPool:
+    """
+    Process wide pool of authenticated paramiko Transports
+
+    Transports are keyed by (server, username, token fingerprint) so a
+    connection is only ever reused by the identity/token that opened it.
+    Each action opens a fresh channel on a pooled transport instead of
+    doing a TCP connect, key exchange and token auth of its own.
+
+    How long each session took to get, and whether it failed, is reported
+    to health.  Rejected credentials don't count against the server.
+
+    Usage:
+            * with ssh_pool.session(server, username, token) as channel:
+            *     channel.exec_command("hostname")
+    """
+
+    def __init__(
+        self,
+        max_per_server: int = SshConfig.SSH_POOL_MAX_PER_SERVER,
+        idle_timeout: float = SshConfig.SSH_POOL_IDLE_TIMEOUT_SECONDS,
+        keepalive_interval: float = SshConfig.SSH_POOL_KEEPALIVE_SECONDS,
+        max_channels: int = SshConfig.SSH_POOL_MAX_CHANNELS_PER_TRANSPORT,
+        evict_interval: float = SshConfig.SSH_POOL_EVICT_INTERVAL_SECONDS,
+        health: Optional[HealthTracker] = None,
+    ):
+        self.health = health
+        self.max_per_server = max_per_server
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.max_channels = max_channels
+        self.evict_interval = evict_interval
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[PooledTransport]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def _connect(
+        self, key: PoolKey, token: str, timeout: float
+    ) -> PooledTransport:
+        server, username, _ = key
+        config = SshConfig.KNOWN_SERVER_SCOPES.get(server, {})
+        port = int(config.get("port", SshConfig.SSH_PORT))
+        with timing.phase("tcp_connect"):
+            sock = self._open_socket(server, port, timeout)
+        transport = Transport(sock)
+        transport.banner_timeout = timeout
+        transport.auth_timeout = timeout
+        try:
+            # The server's host key is accepted as is, there being no
+            # known_hosts to check it against
+            with timing.phase("key_exchange"):
+                transport.start_client(timeout=timeout)
+            # OAuth SSH servers take the access token as password
+            with timing.phase("ssh_auth"):
+                transport.auth_password(username, token)
+        except Exception:
+            transport.close()
+            sock.close()
+            raise
+        entry = PooledTransport(key, transport)
+        if self.keepalive_interval:
+            transport.set_keepalive(int(self.keepalive_interval))
+        logger.info(f"Opened pooled SSH transport to {server} for {username}")
+        return entry
+
+    @staticmethod
+    def _open_socket(server: str, port: int, timeout: float) -> socket.socket:
+        return socket.create_connection((server, port), timeout=timeout)
+
+    def _evict_locked(self, server: str, now: float, key: Optional[PoolKey] = None):
+        """
+        Remove dead, idle and token-rotated transports for a server.
+        Must be called with the lock held; returns the entries to close.
+        """
+        to_close = []
+        for entry in list(self._entries.get(server, [])):
+            rotated = (
+                key is not None
+                and entry.username == key[1]
+                and entry.key != key
+            )
+            if rotated:
+                entry.retired = True
+            if (
+                not entry.is_alive()
+                or entry.is_idle_for(self.idle_timeout, now)
+                or (entry.retired and entry.channels == 0)
+            ):
+                self._entries[server].remove(entry)
+                to_close.append(entry)
+        return to_close
+
+    def _checkout_locked(self, key: PoolKey, now: float) -> Optional[PooledTransport]:
+        for entry in self._entries.get(key[0], []):
+            if entry.key == key and not entry.retired and entry.channels < self.max_channels:
+                entry.channels += 1
+                entry.last_used = now
+                return entry
+        return None
+
+    def acquire(
+        self,
+        server: str,
+        username: str,
+        token: str,
+        timeout: float = SshConfig.CONNECT_TIMEOUT_SECONDS,
+    ) -> PooledTransport:
+        """
+        Return a live, authenticated transport with a channel slot reserved
+        for the caller, who must hand it back with release()
+        """
+        key = (server, username, token_fingerprint(token))
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                to_close = self._evict_locked(server, now, key)
+                entry = self._checkout_locked(key, now)
+            for stale in to_close:
+                stale.close()
+            if entry is None:
+                break
+            if now - entry.last_checked < self.keepalive_interval or entry.ping():
+                return entry
+            self.release(entry, discard=True)
+
+        entry = self._connect(key, token, timeout)
+        entry.channels = 1
+        to_close = []
+        with self._lock:
+            entries = self._entries.setdefault(server, [])
+            if len(entries) >= self.max_per_server:
+                idle = [e for e in entries if e.channels == 0]
+                if idle:
+                    lru = min(idle, key=lambda e: e.last_used)
+                    entries.remove(lru)
+                    to_close.append(lru)
+                else:
+                    # Every pooled transport is busy: serve this action but
+                    # don't keep the connection around afterwards
+                    entry.retired = True
+            if not entry.retired:
+                entries.append(entry)
+        for stale in to_close:
+            stale.close()
+        return entry
+
+    def release(self, entry: PooledTransport, discard: bool = False):
+        with self._lock:
+            entry.channels = max(entry.channels - 1, 0)
+            entry.last_used = time.monotonic()
+            if discard or not entry.is_alive():
+                entry.retired = True
+            close = entry.retired and entry.channels == 0
+            if close:
+                entries = self._entries.get(entry.server, [])
+                if entry in entries:
+                    entries.remove(entry)
+        if close:
+            entry.close()
+
+    @contextlib.contextmanager
+    def session(
+        self,
+        server: str,
+        username: str,
+        token: str,
+        timeout: float = SshConfig.CONNECT_TIMEOUT_SECONDS,
+    ) -> Iterator[Channel]:
+        """
+        Open a new session channel on a pooled transport, closing the
+        channel (but not the transport) when done
+        """
+        with self.sessions(server, username, token, timeout=timeout) as open_channel:
+            yield open_channel()
+
+    @contextlib.contextmanager
+    def sessions(
+        self,
+        server: str,
+        username: str,
+        token: str,
+        timeout: float = SshConfig.CONNECT_TIMEOUT_SECONDS,
+    ) -> Iterator[Callable[[], Channel]]:
+        """
+        Reserve a pooled transport and yield a function opening a new
+        session channel on it, so that several commands can be run one
+        after the other without reconnecting.  Every channel opened is
+        closed when done.
+        """
+        began = time.monotonic()
+        try:
+            entry = self.acquire(server, username, token, timeout=timeout)
+        except AuthenticationException:
+            self._record(server, began)
+            raise
+        except Exception as e:
+            self._record(server, began, e)
+            raise
+        channels: List[Channel] = []
+        failed = []
+
+        def open_channel() -> Channel:
+            try:
+                with timing.phase("session_open"):
+                    channel = entry.transport.open_session(timeout=timeout)
+            except Exception as e:
+                failed.append(e)
+                if not channels:
+                    self._record(server, began, e)
+                raise
+            if not channels:
+                self._record(server, began)
+            channels.append(channel)
+            return channel
+
+        try:
+            yield open_channel
+        finally:
+            for channel in channels:
+                channel.close()
+            self.release(entry, discard=bool(failed))
+
+    def _record(self, server: str, began: float, error: Optional[Exception] = None):
+        if self.health is not None:
+            self.health.record(server, time.monotonic() - began, error)
+
+    def evict_idle(self):
+        """
+        Close every transport that has been idle past the idle timeout
+        """
+        with self._lock:
+            now = time.monotonic()
+            to_close = []
+            for server in list(self._entries):
+                to_close.extend(self._evict_locked(server, now))
+        for entry in to_close:
+            entry.close()
+
+    def _run(self, stop: threading.Event):
+        while not stop.wait(self.evict_interval):
+            try:
+                self.evict_idle()
+            except Exception:
+                logger.exception("Evicting idle SSH transports failed")
+
+    def start(self):
+        """
+        Start the thread evicting idle transports for this process if it
+        isn't running.  Keepalives hold transports open, so nothing else
+        closes those that are no longer used.
+        """
+        if self.evict_interval <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(self._stop,),
+                name="ssh-pool-evict",
+                daemon=True,
+            )
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stop.set()
+            self._thread = None
+
+    def close_all(self):
+        with self._lock:
+            to_close = [e for entries in self._entries.values() for e in entries]
+            self._entries.clear()
+        for entry in to_close:
+            entry.close()
+
+    def size(self, server: Optional[str] = None) -> int:
+        with self._lock:
+            if server is not None:
+                return len(self._entries.get(server, []))
+            return sum(len(entries) for entries in self._entries.values())
+
+
+ssh_pool = SshConnectionPool(health=server_health)
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import FrozenSet, Optional, Tuple
+
+from provider.config import SshConfig
+from provider.local_db import get_action_database
+
+
+class StatusVersions:
+    """
+    What each action's status looked like the last time this process
+    served it in full: the stored version (tag) it was read at and, for
+    settled actions, who may view it.  While the stored tag is unchanged
+    a poll sending that tag as If-None-Match can be answered 304 Not
+    Modified from here, without reading, decoding or refreshing the
+    action.  Settled actions are those whose status request would not do
+    any work, so skipping it changes nothing.
+
+    The tag also tells whether a cached copy of the action may be older
+    than the stored one: not if it is the tag last served.  Savers in this
+    process wake up waiting requests right away; the stored tag is looked
+    at every poll_interval for changes made by other processes.
+    """
+
+    def __init__(self, max_entries: int = SshConfig.ACTION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, Optional[FrozenSet[str]]]]" = OrderedDict()
+        self._changed = threading.Condition()
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._entries = OrderedDict()
+            self._pid = os.getpid()
+
+    @staticmethod
+    def current(action_id: str) -> Optional[str]:
+        return get_action_database().action_tag(action_id)
+
+    def remember(self, action_id: str, tag: str, viewers: Optional[FrozenSet[str]] = None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._check_fork()
+            self._entries[action_id] = (tag, viewers)
+            self._entries.move_to_end(action_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, action_id: str):
+        with self._lock:
+            self._entries.pop(action_id, None)
+
+    def viewers(self, action_id: str, tag: str) -> Optional[FrozenSet[str]]:
+        """
+        Who may view action_id at tag, None if it wasn't served settled
+        at tag
+        """
+        with self._lock:
+            self._check_fork()
+            entry = self._entries.get(action_id)
+            if entry is None or entry[0] != tag:
+                return None
+            self._entries.move_to_end(action_id)
+            return entry[1]
+
+    def is_served(self, action_id: str, tag: Optional[str]) -> bool:
+        with self._lock:
+            self._check_fork()
+            entry = self._entries.get(action_id)
+            return tag is not None and entry is not None and entry[0] == tag
+
+    def notify_changed(self):
+        """
+        Wake up requests waiting in this process after an action was saved
+        """
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait_for_change(
+        self,
+        action_id: str,
+        tag: str,
+        timeout: float,
+        poll_interval: float = SshConfig.STATUS_WAIT_POLL_SECONDS,
+    ) -> Optional[str]:
+        """
+        Block until the stored tag of action_id is no longer tag or timeout
+        seconds passed, and return the stored tag
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self.current(action_id)
+            remaining = deadline - time.monotonic()
+            if current != tag or remaining <= 0:
+                return current
+            with self._changed:
+                self._changed.wait(min(remaining, poll_interval))
+
+
+status_versions = StatusVersions()
@@ -0,0 +1,95 @@
+import contextlib
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+import structlog
+
+logger = structlog.getLogger(__name__)
+
+_local = threading.local()
+
+
+class PhaseTimer:
+    """
+    Where the time of running one action goes, measured with
+    time.perf_counter_ns so that it is monotonic and keeps sub-millisecond
+    resolution.  The phases are:
+
+            * token: dependent token and introspection lookups
+            * queue_wait: waiting for a session slot on the server
+            * tcp_connect, key_exchange, ssh_auth: opening a new transport,
+              skipped when a pooled one is reused
+            * session_open: opening the session channel
+            * exec: starting the command
+            * output_read: running the command while reading its output
+
+    Code further down the stack, like the SSH pool, adds to the timer of
+    the action its thread is running through the module level phase().
+    """
+
+    def __init__(self):
+        self.started_ns = time.perf_counter_ns()
+        self.phases_ns: Dict[str, int] = {}
+
+    def add(self, name: str, elapsed_ns: int):
+        self.phases_ns[name] = self.phases_ns.get(name, 0) + elapsed_ns
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter_ns() - start)
+
+    def elapsed_ns(self) -> int:
+        return time.perf_counter_ns() - self.started_ns
+
+    def elapsed_ms(self) -> int:
+        return self.elapsed_ns() // 1_000_000
+
+    def breakdown_ms(self) -> Dict[str, float]:
+        return {
+            name: round(elapsed_ns / 1_000_000, 3)
+            for name, elapsed_ns in self.phases_ns.items()
+        }
+
+    def log(self, action_id: str, **fields):
+        logger.info(
+            "Action timing",
+            action_id=action_id,
+            total_ms=round(self.elapsed_ns() / 1_000_000, 3),
+            **{f"{name}_ms": ms for name, ms in self.breakdown_ms().items()},
+            **fields,
+        )
+
+
+def current() -> Optional[PhaseTimer]:
+    return getattr(_local, "timer", None)
+
+
+@contextlib.contextmanager
+def activate(timer: PhaseTimer) -> Iterator[PhaseTimer]:
+    """
+    Make timer the one phase() adds to in this thread
+    """
+    previous = current()
+    _local.timer = timer
+    try:
+        yield timer
+    finally:
+        _local.timer = previous
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Time a phase of the action running in this thread, if it is timed
+    """
+    timer = current()
+    if timer is None:
+        yield
+    else:
+        with timer.phase(name):
+            yield
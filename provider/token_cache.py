@@ -0,0 +1,289 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Union
+
+from globus_action_provider_tools import AuthState
+from globus_sdk.authorizers import AccessTokenAuthorizer, RefreshTokenAuthorizer
+
+from provider.config import SshConfig
+
+logger = logging.getLogger(__name__)
+
+TokensByScope = Dict[str, Dict[str, Any]]
+
+
+def token_key(token: str) -> str:
+    """
+    Cache key of a bearer token, so raw tokens are never kept as keys
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _expires_at(token_data: Dict[str, Any]) -> int:
+    try:
+        return int(float(token_data.get("expires_at_seconds", 0)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _tokens_by_scope(response) -> TokensByScope:
+    tokens: TokensByScope = {}
+    for token_data in response.by_resource_server.values():
+        for scope in token_data.get("scope", "").split():
+            tokens[scope] = dict(token_data)
+    return tokens
+
+
+class _CachedToken:
+    __slots__ = (
+        "introspection",
+        "introspection_expires",
+        "dependent_tokens",
+        "dependent_expires",
+    )
+
+    def __init__(self):
+        self.introspection = None
+        self.introspection_expires = 0.0
+        self.dependent_tokens: Optional[TokensByScope] = None
+        self.dependent_expires = 0.0
+
+
+class TokenCache:
+    """
+    Per-process cache of Globus Auth responses for incoming bearer tokens,
+    keyed by a hash of the token, so that runs and polls don't each make
+    round trips to Globus Auth.
+
+    Introspections are kept for at most introspect_ttl seconds and never
+    past the token's own expiry.  Dependent tokens are kept until
+    min_lifetime seconds before the first of them expires; within
+    refresh_ahead seconds of that, tokens with a refresh token are
+    refreshed in the background while the current ones are still served.
+    Concurrent misses for the same token wait on a single call to Globus
+    Auth.  Least recently used tokens are evicted beyond max_entries.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SshConfig.TOKEN_CACHE_MAX_ENTRIES,
+        introspect_ttl: float = SshConfig.TOKEN_INTROSPECT_TTL_SECONDS,
+        min_lifetime: float = SshConfig.TOKEN_MIN_LIFETIME_SECONDS,
+        refresh_ahead: float = SshConfig.TOKEN_REFRESH_AHEAD_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.introspect_ttl = introspect_ttl
+        self.min_lifetime = min_lifetime
+        self.refresh_ahead = refresh_ahead
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _CachedToken]" = OrderedDict()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    def _entry(self, key: str) -> _CachedToken:
+        """
+        Get or create the entry for key, call with the lock held
+        """
+        if self._pid != os.getpid():
+            self._entries = OrderedDict()
+            self._in_flight = {}
+            self._pid = os.getpid()
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _CachedToken()
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _single_flight(self, flight_key: Hashable, load: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._in_flight.get(flight_key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[flight_key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = load()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(flight_key, None)
+
+    def introspect(self, auth: AuthState):
+        """
+        auth.introspect_token(), cached
+        """
+        if not auth.bearer_token:
+            return auth.introspect_token()
+        key = token_key(auth.bearer_token)
+        with self._lock:
+            entry = self._entry(key)
+            if entry.introspection is not None and entry.introspection_expires > time.time():
+                self.hits += 1
+                return entry.introspection
+            self.misses += 1
+
+        def load():
+            response = auth.introspect_token()
+            if response is not None:
+                now = time.time()
+                expires = min(now + self.introspect_ttl, response.get("exp", now))
+                with self._lock:
+                    entry = self._entry(key)
+                    entry.introspection = response
+                    entry.introspection_expires = expires
+            return response
+
+        return self._single_flight(("introspect", key), load)
+
+    def _store_dependent_tokens(self, key: str, tokens: TokensByScope):
+        expires = min((_expires_at(t) for t in tokens.values()), default=0)
+        with self._lock:
+            entry = self._entry(key)
+            entry.dependent_tokens = tokens
+            entry.dependent_expires = expires
+
+    def _refresh(self, auth: AuthState, tokens: TokensByScope) -> Optional[TokensByScope]:
+        """
+        Refresh every token that has a refresh token, None if any can't be
+        """
+        refreshed: TokensByScope = {}
+        by_refresh_token: Dict[str, TokensByScope] = {}
+        for scope, token_data in tokens.items():
+            refresh_token = token_data.get("refresh_token")
+            if refresh_token is None:
+                return None
+            by_refresh_token.setdefault(refresh_token, {})[scope] = token_data
+        for refresh_token, scoped in by_refresh_token.items():
+            response = auth.auth_client.oauth2_refresh_token(refresh_token)
+            new_tokens = _tokens_by_scope(response)
+            for scope, token_data in scoped.items():
+                new_data = dict(token_data)
+                new_data.update(new_tokens.get(scope, {}))
+                new_data.setdefault("refresh_token", refresh_token)
+                refreshed[scope] = new_data
+        return refreshed
+
+    def _load_dependent_tokens(
+        self, auth: AuthState, key: str, stale: Optional[TokensByScope]
+    ) -> TokensByScope:
+        tokens = None
+        if stale:
+            try:
+                tokens = self._refresh(auth, stale)
+            except Exception as e:
+                logger.warning(f"Refreshing dependent tokens failed, regranting: {e}")
+        refreshed = tokens is not None
+        if not refreshed:
+            response = auth.get_dependent_tokens(bypass_cache_lookup=True)
+            tokens = _tokens_by_scope(response)
+        self._store_dependent_tokens(key, tokens)
+        if refreshed:
+            with self._lock:
+                self.refreshes += 1
+        return tokens
+
+    def _refresh_in_background(self, auth: AuthState, key: str, tokens: TokensByScope):
+        def refresh():
+            try:
+                self._single_flight(
+                    ("dependent", key),
+                    lambda: self._load_dependent_tokens(auth, key, tokens),
+                )
+            except Exception:
+                logger.exception("Background refresh of dependent tokens failed")
+
+        with self._lock:
+            if ("dependent", key) in self._in_flight:
+                return
+        threading.Thread(target=refresh, name="token-refresh", daemon=True).start()
+
+    def dependent_tokens(self, auth: AuthState) -> TokensByScope:
+        """
+        Dependent tokens of auth's bearer token by scope, each usable for
+        at least min_lifetime seconds
+        """
+        if not auth.bearer_token:
+            # Nothing to tell such callers apart by, so nothing to share
+            response = auth.get_dependent_tokens(bypass_cache_lookup=True)
+            return _tokens_by_scope(response)
+        key = token_key(auth.bearer_token)
+        now = time.time()
+        with self._lock:
+            entry = self._entry(key)
+            tokens = entry.dependent_tokens
+            usable_until = entry.dependent_expires - self.min_lifetime
+            fresh = tokens is not None and usable_until > now
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not fresh:
+            return self._single_flight(
+                ("dependent", key),
+                lambda: self._load_dependent_tokens(auth, key, tokens),
+            )
+        if usable_until - self.refresh_ahead <= now and all(
+            "refresh_token" in t for t in tokens.values()
+        ):
+            self._refresh_in_background(auth, key, tokens)
+        return tokens
+
+    def authorizer_for_scope(
+        self, auth: AuthState, scope: str
+    ) -> Optional[Union[AccessTokenAuthorizer, RefreshTokenAuthorizer]]:
+        """
+        Cached equivalent of auth.get_authorizer_for_scope(scope)
+        """
+        token_data = self.dependent_tokens(auth).get(scope)
+        if token_data is None:
+            return None
+        access_token = token_data.get("access_token")
+        refresh_token = token_data.get("refresh_token")
+        expires = _expires_at(token_data)
+        if access_token and expires > time.time() + self.min_lifetime:
+            return AccessTokenAuthorizer(access_token)
+        if refresh_token:
+            return RefreshTokenAuthorizer(
+                refresh_token,
+                auth.auth_client,
+                access_token=access_token,
+                expires_at=expires,
+            )
+        return None
+
+    def invalidate(self, token: str):
+        with self._lock:
+            self._entries.pop(token_key(token), None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "evictions": self.evictions,
+            }
+
+
+token_cache = TokenCache()
@@ -0,0 +1,70 @@
+import threading
+import time
+import uuid
+from unittest.mock import MagicMock
+
+import pytest
+from flask import Flask
+from globus_action_provider_tools.data_types import ActionStatus, ActionStatusValue
+from globus_action_provider_tools.flask.exceptions import ActionNotFound
+
+from provider import provider_bp
+from provider.output_store import output_store
+from provider.provider import save_action
+from provider.util import SshUtil
+
+
+@pytest.fixture
+def action(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    auth = MagicMock()
+    auth.effective_identity = f"urn:globus:auth:identity:{uuid.uuid4()}"
+    auth.check_authorization.return_value = True
+    status = ActionStatus(
+        status=ActionStatusValue.ACTIVE,
+        creator_id=auth.effective_identity,
+        start_time=SshUtil.iso_tz_now(),
+        details={},
+    )
+    save_action(status)
+    return status, auth
+
+
+def tail(action_id, auth, **args):
+    query = "&".join(f"{name}={value}" for name, value in args.items())
+    with Flask(__name__).test_request_context(f"/{action_id}/log?{query}"):
+        return provider_bp.action_log_callback(action_id, auth)
+
+
+def test_log_is_tailed_from_a_cursor(action):
+    status, auth = action
+    output_store.append(status.action_id, "stdout", "line 1\nline 2\né".encode())
+
+    page = tail(status.action_id, auth, limit=14)
+    assert page["data"] == "line 1\nline 2\n" and page["more"]
+    page = tail(status.action_id, auth, offset=page["next_offset"])
+    assert page["data"] == "é"
+
+    with pytest.raises(ActionNotFound):
+        tail(status.action_id, auth, output_id="someone_else_0")
+
+
+def test_wait_returns_as_soon_as_output_arrives(action):
+    status, auth = action
+    offset = tail(status.action_id, auth)["next_offset"]
+
+    def write():
+        time.sleep(0.05)
+        output_store.append(status.action_id, "stdout", b"done\n")
+        output_store.notify_written()
+
+    threading.Thread(target=write).start()
+    start = time.monotonic()
+    page = tail(status.action_id, auth, offset=offset, wait=10)
+    assert page["data"] == "done\n"
+    assert time.monotonic() - start < 5
+
+    status.status = ActionStatusValue.SUCCEEDED
+    save_action(status)
+    page = tail(status.action_id, auth, offset=page["next_offset"], wait=10)
+    assert page["data"] == "" and not page["more"]
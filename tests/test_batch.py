@@ -0,0 +1,75 @@
+import time
+import uuid
+from unittest.mock import MagicMock, patch
+
+from flask import Flask, g
+from globus_action_provider_tools.data_types import (
+    ActionStatus,
+    ActionStatusValue,
+)
+
+from provider.cache import action_cache
+from provider.config import SshConfig
+from provider.local_db import LocalStore
+from provider.provider import (
+    action_release_many,
+    action_status_many,
+    get_status,
+    save_action,
+)
+from provider.util import SshUtil
+
+
+def test_get_many_reads_every_shard(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = LocalStore("many", shard_count=3)
+    store.put_many([(f"key{i}", f"value{i}") for i in range(10)])
+    store.put("expired", "value", expires_at=time.time() - 1)
+
+    keys = [f"key{i}" for i in range(10)] + ["expired", "missing", "bad;key"]
+    assert store.get_many(keys) == {f"key{i}": f"value{i}" for i in range(10)}
+
+
+def make_action(creator_id, status=ActionStatusValue.SUCCEEDED):
+    action = ActionStatus(
+        status=status,
+        creator_id=creator_id,
+        start_time=SshUtil.iso_tz_now(),
+        details={},
+    )
+    save_action(action)
+    return action.action_id
+
+
+def call(view, action_ids, auth):
+    app = Flask(__name__)
+    with app.test_request_context(json={"action_ids": action_ids}):
+        g.auth_state = auth
+        response, code = view()
+        return response.get_json()
+
+
+def test_statuses_are_read_together_and_released(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Statuses are read as stored rather than run here
+    monkeypatch.setattr(SshConfig, "ASYNC_EXECUTION", True)
+    me = f"urn:globus:auth:identity:{uuid.uuid4()}"
+    auth = MagicMock()
+    auth.effective_identity = me
+    auth.check_authorization.side_effect = lambda allowed, **kwargs: me in allowed
+    done = make_action(me)
+    running = make_action(me, ActionStatusValue.ACTIVE)
+    other = make_action(f"urn:globus:auth:identity:{uuid.uuid4()}")
+    action_cache.clear()
+
+    with patch.object(LocalStore, "get", side_effect=AssertionError("read one by one")):
+        result = call(action_status_many, [done, running, other, "missing"], auth)
+    assert [a["action_id"] for a in result["actions"]] == [done, running]
+    assert result["not_found"] == [other, "missing"]
+
+    result = call(action_release_many, [done, running, other], auth)
+    assert [a["action_id"] for a in result["actions"]] == [done]
+    assert result["not_complete"] == [running]
+    assert result["not_found"] == [other]
+    assert get_status(done) is None
+    assert get_status(running) is not None
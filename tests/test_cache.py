@@ -0,0 +1,96 @@
+import time
+import uuid
+from unittest.mock import patch
+
+from flask import Flask
+from globus_action_provider_tools.data_types import (
+    ActionRequest,
+    ActionStatus,
+    ActionStatusValue,
+)
+
+from provider import provider_bp
+from provider.cache import ActionCache, action_cache
+from provider.expiry import expiry_sweeper
+from provider.provider import (
+    _refresh_introspection,
+    ap_description,
+    get_status_and_request,
+    save_action,
+)
+
+
+def make_status(status=ActionStatusValue.SUCCEEDED):
+    return ActionStatus(
+        status=status,
+        creator_id=f"urn:globus:auth:identity:{uuid.uuid4()}",
+        details={"output_size": 0},
+    )
+
+
+def make_request():
+    return ActionRequest(request_id=str(uuid.uuid4()), body={"command": "ls"})
+
+
+def test_lru_eviction_and_counters():
+    cache = ActionCache(max_entries=2)
+    actions = [make_status() for _ in range(3)]
+    cache.put("a", actions[0])
+    cache.put("b", actions[1])
+    assert cache.get("a")[0].action_id == actions[0].action_id
+    cache.put("c", actions[2])
+
+    # "b" was least recently used
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    assert cache.stats() == {
+        "size": 2,
+        "max_entries": 2,
+        "hits": 2,
+        "misses": 1,
+        "evictions": 1,
+    }
+
+
+def test_entries_are_copies_and_expire():
+    cache = ActionCache(ttl_seconds=60, active_ttl_seconds=0.01)
+    finished, active = make_status(), make_status(ActionStatusValue.ACTIVE)
+    cache.put("finished", finished, make_request())
+    cache.put("active", active)
+
+    cached, _ = cache.get("finished")
+    cached.details["output_size"] = 10
+    assert cache.get("finished")[0].details["output_size"] == 0
+    assert cache.is_complete("finished")
+
+    time.sleep(0.02)
+    assert cache.get("active") is None
+    assert not cache.is_complete("active")
+    cache.invalidate("finished")
+    assert cache.get("finished") is None
+
+
+def test_finished_actions_are_read_and_written_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    status, request = make_status(), make_request()
+    save_action(status, request)
+
+    with patch("provider.provider.get_action_database") as database:
+        save_action(status, request)
+        read_status, read_request = get_status_and_request(status.action_id)
+    assert not database.called
+    assert read_status.action_id == status.action_id
+    assert read_request.request_id == request.request_id
+
+
+def test_introspection_includes_cache_and_expiry_stats():
+    app = Flask(__name__)
+    app.add_url_rule("/", endpoint=f"{provider_bp.name}.action_introspect")
+    with app.test_request_context("/"):
+        _refresh_introspection()
+    described = ap_description.dict()
+    assert described["action_cache_stats"] == action_cache.stats()
+    assert "hits" in described["action_cache_stats"]
+    assert described["expiry_sweeper_stats"] == expiry_sweeper.stats()
+    assert "actions_reaped" in described["expiry_sweeper_stats"]
+    assert "output_files_reaped" in described["expiry_sweeper_stats"]
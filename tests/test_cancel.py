@@ -0,0 +1,180 @@
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from unittest.mock import MagicMock, patch
+
+from globus_action_provider_tools.data_types import (
+    ActionRequest,
+    ActionStatus,
+    ActionStatusValue,
+)
+
+from provider import provider_bp
+from provider.cancel import CancelRegistry, root_action_id
+from provider.capture import OutputCapture
+from provider.config import SshConfig
+from provider.local_db import get_action_database
+from provider.output_store import OutputStore
+from provider.provider import (
+    _run_in_background,
+    fail_action,
+    fail_interrupted_actions,
+    save_action,
+)
+from provider.util import SshUtil
+from tests.test_capture import HangingChannel
+
+SERVER = "ssh.my.server.edu"
+
+
+def test_cancel_stops_tracked_channels_of_servers_and_steps(tmp_path):
+    registry = CancelRegistry()
+    channel = HangingChannel()
+    capture = OutputCapture("abc_0", store=OutputStore(str(tmp_path)), poll_interval=0.01)
+
+    def run():
+        with registry.track("abc_0", channel):
+            capture.run(channel, cancelled=registry.watcher("abc_0"))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(0.05)
+    assert registry.cancel("abc")
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert channel.closed and capture.cancelled
+    assert registry.is_cancelled("abc_s1") and root_action_id("abc_s1") == "abc"
+    assert not registry.cancel("other")
+
+
+def test_watcher_polls_the_store_at_most_every_interval():
+    registry = CancelRegistry(poll_interval=60)
+    checks = []
+
+    def check_stored(action_id):
+        checks.append(action_id)
+        return len(checks) > 1
+
+    cancelled = registry.watcher("abc_1", check_stored)
+    assert not cancelled() and not cancelled()
+    assert checks == ["abc"]
+
+    registry.forget("abc")
+    assert cancelled() and cancelled()
+    assert checks == ["abc", "abc"]
+
+
+def test_cancelled_action_stops_and_keeps_its_output(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(SshConfig, "ASYNC_EXECUTION", True)
+    scope = SshConfig.KNOWN_SERVER_SCOPES[SERVER]["scope"]
+    token_cache = MagicMock()
+    token_cache.dependent_tokens.return_value = {scope: {"access_token": "token"}}
+    token_cache.introspect.return_value = {"username": "joe"}
+    channel = HangingChannel()
+    channel.stdout.append(b"partial\n")
+    started = threading.Event()
+
+    @contextlib.contextmanager
+    def sessions(*args, **kwargs):
+        started.set()
+        yield lambda: channel
+
+    auth = MagicMock()
+    auth.effective_identity = f"urn:globus:auth:identity:{uuid.uuid4()}"
+    auth.check_authorization.return_value = True
+    request = ActionRequest(
+        request_id=str(uuid.uuid4()), body={"ssh_server": SERVER, "command": "sleep 1000"}
+    )
+    with patch("provider.provider.token_cache", token_cache), patch(
+        "provider.provider.ssh_pool.sessions", side_effect=sessions
+    ):
+        status, _ = provider_bp.action_run_callback(request, auth)
+        assert started.wait(5)
+        status = provider_bp.action_cancel_callback(status.action_id, auth)
+        assert status.status == ActionStatusValue.FAILED
+        assert status.details.code == "Cancelled"
+
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            status = provider_bp.action_status_callback(status.action_id, auth)
+            if getattr(status.details, "output_size", None) is not None:
+                break
+            time.sleep(0.01)
+
+    assert channel.closed
+    assert status.details.code == "Cancelled"
+    assert status.details.ssh_output == "partial\n"
+
+
+def test_result_does_not_overwrite_a_cancellation_from_another_worker(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    auth = MagicMock()
+    auth.effective_identity = f"urn:globus:auth:identity:{uuid.uuid4()}"
+    request = ActionRequest(
+        request_id=str(uuid.uuid4()), body={"ssh_server": SERVER, "command": "hostname"}
+    )
+    action = ActionStatus(
+        status=ActionStatusValue.ACTIVE,
+        creator_id=auth.effective_identity,
+        start_time=SshUtil.iso_tz_now(),
+        details={},
+    )
+    save_action(action, request=request)
+
+    def worker(action, request, auth):
+        # Cancelled through another process while the command ran
+        cancelled = fail_action(action.copy(deep=True), "Cancelled", code="Cancelled")
+        get_action_database().store_action_request(
+            cancelled, request=request, action_id=action.action_id
+        )
+        action.status = ActionStatusValue.SUCCEEDED
+        action.completion_time = SshUtil.iso_tz_now()
+        action.details = {"exit_code": 0, "output_size": 3}
+        return action
+
+    with patch("provider.provider._ssh_worker", side_effect=worker):
+        _run_in_background(action, request, auth)
+
+    stored, _ = get_action_database().get_action_request(action.action_id)
+    assert stored.status == ActionStatusValue.FAILED
+    assert stored.details["code"] == "Cancelled"
+    assert stored.details["output_size"] == 3
+
+
+def test_actions_of_dead_workers_fail_at_startup(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dead = subprocess.Popen([sys.executable, "-c", ""])
+    dead.wait()
+    host = socket.gethostname()
+    workers = {
+        "dead": f"{host}:{dead.pid}",
+        "alive": f"{host}:{os.getppid()}",
+        "elsewhere": f"other-{host}:{dead.pid}",
+    }
+    actions = {}
+    for name, worker in workers.items():
+        action = ActionStatus(
+            status=ActionStatusValue.ACTIVE,
+            creator_id=f"urn:globus:auth:identity:{uuid.uuid4()}",
+            details={"worker": worker},
+        )
+        request = ActionRequest(request_id=action.action_id, body={"command": "hostname"})
+        save_action(action, request=request)
+        actions[name] = action.action_id
+
+    assert fail_interrupted_actions() == 1
+    statuses = {
+        name: get_action_database().get_action_request(action_id)[0]
+        for name, action_id in actions.items()
+    }
+    assert statuses["dead"].status == ActionStatusValue.FAILED
+    assert statuses["dead"].details["code"] == "Interrupted"
+    assert statuses["alive"].status == ActionStatusValue.ACTIVE
+    assert statuses["elsewhere"].status == ActionStatusValue.ACTIVE
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import deque
+from unittest.mock import MagicMock
+
+import pytest
+
+from provider.capture import OutputCapture
+from provider.output_store import OutputStore
+
+
+class FakeChannel:
+    """
+    Scripted stand-in for a paramiko Channel that sends EOF once both
+    streams have been read and, like OpenSSH, its exit status shortly after
+    """
+
+    def __init__(self, stdout=(), stderr=(), exit_status=0):
+        self.stdout = deque(stdout)
+        self.stderr = deque(stderr)
+        self.exit_status = exit_status
+        self.closed = False
+        self.status_event = threading.Event()
+        self._exit_timer = None
+
+    @property
+    def eof_received(self):
+        if self.stdout or self.stderr:
+            return False
+        if self._exit_timer is None:
+            self._exit_timer = threading.Timer(0.02, self.status_event.set)
+            self._exit_timer.start()
+        return True
+
+    def exec_command(self, command):
+        self.command = command
+
+    def recv_ready(self):
+        return bool(self.stdout)
+
+    def recv_stderr_ready(self):
+        return bool(self.stderr)
+
+    def recv(self, nbytes):
+        return self.stdout.popleft()
+
+    def recv_stderr(self, nbytes):
+        return self.stderr.popleft()
+
+    def exit_status_ready(self):
+        return self.closed or self.status_event.is_set()
+
+    def recv_exit_status(self):
+        self.status_event.wait()
+        return self.exit_status
+
+    def close(self):
+        self.closed = True
+
+
+class HangingChannel(FakeChannel):
+    """
+    A command that keeps running without writing anything
+    """
+
+    remote_chanid = 0
+    eof_received = False
+
+    def __init__(self):
+        super().__init__()
+        self.transport = MagicMock()
+
+    def exit_status_ready(self):
+        return False
+
+
+@pytest.fixture
+def store(tmp_path):
+    return OutputStore(str(tmp_path / "output"))
+
+
+def test_streams_are_interleaved_into_store(store):
+    channel = FakeChannel(
+        stdout=[b"line 1\n", b"line 2\n"], stderr=[b"warning\n", b"again\n"]
+    )
+    capture = OutputCapture("action1", store=store)
+    capture.run(channel)
+
+    assert capture.text("stdout") == "line 1\nline 2\n"
+    assert capture.text("stderr") == "warning\nagain\n"
+    assert not capture.truncated("stdout")
+    assert capture.exit_status == 0
+
+
+def test_exit_status_sent_after_eof_is_waited_for(store):
+    channel = FakeChannel(stdout=[b"partial\n"], exit_status=2)
+    capture = OutputCapture("action4", store=store, poll_interval=0.01)
+    capture.run(channel, deadline=time.monotonic() + 5)
+
+    assert capture.exit_status == 2
+    assert not capture.timed_out and not channel.closed
+
+
+def test_limits_are_enforced_while_draining(store):
+    channel = FakeChannel(stdout=[b"x" * 10] * 5, stderr=[b"e" * 10] * 3)
+    capture = OutputCapture("action2", store=store, max_stdout=25, max_stderr=5)
+    capture.run(channel)
+
+    assert store.size("action2", "stdout") == 25
+    assert store.size("action2", "stderr") == 5
+    assert capture.received["stdout"] == 50
+    assert capture.truncated("stdout") and capture.truncated("stderr")
+    assert not channel.stdout and not channel.stderr
+
+
+def test_output_store_rejects_path_like_ids(store):
+    with pytest.raises(ValueError):
+        store.append("../escape", "stdout", b"data")
+    store.delete("action2")
+    assert store.read("action2", "stdout") == b""
+
+
+def test_command_is_stopped_at_deadline(store):
+    channel = HangingChannel()
+    capture = OutputCapture("action3", store=store, poll_interval=0.01)
+    capture.run(channel, deadline=time.monotonic() + 0.05)
+
+    assert capture.timed_out and capture.exit_status is None
+    assert channel.closed
+    # SIGTERM was requested for the remote command
+    message = channel.transport._send_user_message.call_args[0][0]
+    assert b"signal" in message.asbytes() and b"TERM" in message.asbytes()
@@ -0,0 +1,133 @@
+import threading
+import time
+import uuid
+from unittest.mock import MagicMock, patch
+
+import pytest
+from globus_action_provider_tools.data_types import (
+    ActionRequest,
+    ActionStatus,
+    ActionStatusValue,
+)
+
+from provider.config import SshConfig
+from provider.fanout import expand_servers, fan_out, is_fanout
+from provider.provider import _fanout_worker, _with_output_page, fail_action
+from provider.util import SshUtil
+
+SERVERS = list(SshConfig.KNOWN_SERVER_SCOPES)
+
+
+def test_groups_are_expanded_in_order_without_duplicates():
+    group = next(iter(SshConfig.SERVER_GROUPS))
+    members = SshConfig.SERVER_GROUPS[group]
+
+    assert expand_servers([members[-1], group, "other.example.edu"]) == (
+        [members[-1]] + members[:-1] + ["other.example.edu"]
+    )
+    assert is_fanout({"ssh_server": group})
+    assert is_fanout({"ssh_server": ["one.example.edu"]})
+    assert not is_fanout({"ssh_server": "one.example.edu"})
+
+
+def test_parallelism_is_limited_and_fail_fast_skips():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def run_one(index, server):
+        with lock:
+            running.append(server)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(server)
+        return {"status": "SUCCEEDED"}
+
+    servers = [f"s{i}.example.edu" for i in range(6)]
+    results = fan_out(servers, run_one, max_parallel=2)
+    assert list(results) == servers
+    assert max(peak) == 2
+    assert all(r["elapsed_ms"] >= 0 for r in results.values())
+
+    results = fan_out(
+        servers,
+        lambda i, s: {"status": "FAILED", "error": "boom"},
+        max_parallel=1,
+        failure_mode="fail_fast",
+    )
+    assert [r["status"] for r in results.values()] == ["FAILED"] + ["SKIPPED"] * 5
+
+
+def _worker(action, request, auth):
+    if request.body["ssh_server"] == SERVERS[0]:
+        return fail_action(action, "exit status 1")
+    action.status = ActionStatusValue.SUCCEEDED
+    action.completion_time = SshUtil.iso_tz_now()
+    action.details = {"output_size": 0, "exit_code": 0, "execution_time_ms": 1}
+    return action
+
+
+@pytest.mark.parametrize(
+    "failure_mode, status, code",
+    [
+        ("any", ActionStatusValue.FAILED, "PartialFailure"),
+        ("all", ActionStatusValue.SUCCEEDED, None),
+    ],
+)
+def test_details_are_aggregated_per_server(failure_mode, status, code):
+    auth = MagicMock()
+    auth.effective_identity = f"urn:globus:auth:identity:{uuid.uuid4()}"
+    action = ActionStatus(
+        status=ActionStatusValue.ACTIVE,
+        creator_id=auth.effective_identity,
+        start_time=SshUtil.iso_tz_now(),
+        details={},
+    )
+    request = ActionRequest(
+        request_id=str(uuid.uuid4()),
+        body={"ssh_server": SERVERS, "command": "hostname", "failure_mode": failure_mode},
+    )
+    with patch("provider.provider._ssh_worker", side_effect=_worker):
+        action = _fanout_worker(action, request, auth)
+
+    assert action.status == status
+    assert getattr(action.details, "code", None) == code
+    action = _with_output_page(action, request)
+    servers = action.details["servers"] if code is None else action.details.servers
+    assert servers[SERVERS[0]]["status"] == "FAILED"
+    assert "exit status 1" in servers[SERVERS[0]]["error"]
+    assert servers[SERVERS[1]]["exit_code"] == 0
+    assert servers[SERVERS[1]]["output_id"] == f"{action.action_id}_1"
+    assert servers[SERVERS[1]]["ssh_output"] == ""
+
+
+def test_steps_are_run_on_every_server():
+    auth = MagicMock()
+    auth.effective_identity = f"urn:globus:auth:identity:{uuid.uuid4()}"
+    action = ActionStatus(
+        status=ActionStatusValue.ACTIVE,
+        creator_id=auth.effective_identity,
+        start_time=SshUtil.iso_tz_now(),
+        details={},
+    )
+    commands = ["hostname", "uptime"]
+    request = ActionRequest(
+        request_id=str(uuid.uuid4()),
+        body={"ssh_server": SERVERS, "commands": commands},
+    )
+    seen = []
+
+    def worker(action, request, auth):
+        seen.append((request.body["ssh_server"], request.body.get("commands")))
+        action.status = ActionStatusValue.SUCCEEDED
+        action.completion_time = SshUtil.iso_tz_now()
+        action.details = {"exit_code": 0}
+        return action
+
+    with patch("provider.provider._ssh_worker", side_effect=worker):
+        action = _fanout_worker(action, request, auth)
+
+    assert action.status == ActionStatusValue.SUCCEEDED
+    assert sorted(seen) == sorted((server, commands) for server in SERVERS)
+    assert set(action.details["servers"]) == set(SERVERS)
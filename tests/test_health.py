@@ -0,0 +1,106 @@
+import time
+import uuid
+from unittest.mock import MagicMock, patch
+
+import pytest
+from globus_action_provider_tools.data_types import (
+    ActionRequest,
+    ActionStatus,
+    ActionStatusValue,
+)
+from paramiko import AuthenticationException
+
+from provider.config import SshConfig
+from provider.health import CLOSED, HALF_OPEN, OPEN, CircuitOpen, HealthTracker
+from provider.provider import _update_action_state, ap_description
+from provider.ssh_pool import SshConnectionPool
+
+SERVER = "ssh.my.server.edu"
+
+
+def test_consecutive_failures_open_circuit_until_probe_succeeds():
+    health = HealthTracker(failure_threshold=3, open_seconds=0.05)
+    for _ in range(3):
+        health.check(SERVER)
+        health.record(SERVER, 10.0, TimeoutError("timed out"))
+    assert health.snapshot()[SERVER]["state"] == OPEN
+    with pytest.raises(CircuitOpen):
+        health.check(SERVER)
+
+    time.sleep(0.06)
+    health.check(SERVER)
+    assert health.snapshot()[SERVER]["state"] == HALF_OPEN
+    # Only one probe at a time
+    with pytest.raises(CircuitOpen):
+        health.check(SERVER)
+
+    health.record(SERVER, 0.2)
+    snapshot = health.snapshot()[SERVER]
+    assert snapshot["state"] == CLOSED
+    assert snapshot["times_opened"] == 1
+    assert snapshot["connect_p50_ms"] == 200.0
+    assert "TimeoutError" in snapshot["last_error"]
+
+
+def test_failed_probe_reopens_and_failure_rate_trips():
+    health = HealthTracker(failure_threshold=100, min_samples=4, failure_rate=0.5, open_seconds=0.01)
+    for ok in (True, False, True, False):
+        health.record(SERVER, 0.1, None if ok else OSError("refused"))
+    assert health.retry_after(SERVER) > 0
+
+    time.sleep(0.02)
+    health.check(SERVER)
+    health.record(SERVER, 0.1, OSError("refused"))
+    assert health.snapshot()[SERVER]["state"] == OPEN
+
+
+def test_pool_reports_session_outcomes():
+    health = HealthTracker(failure_threshold=2)
+    pool = SshConnectionPool(health=health)
+    transport = MagicMock()
+    transport.auth_password.side_effect = AuthenticationException("bad token")
+    with patch("provider.ssh_pool.Transport", return_value=transport), patch.object(
+        SshConnectionPool, "_open_socket"
+    ):
+        with pytest.raises(AuthenticationException):
+            with pool.session(SERVER, "joe", "token"):
+                pass
+        transport.start_client.side_effect = OSError("No route to host")
+        with pytest.raises(OSError):
+            with pool.session(SERVER, "joe", "token"):
+                pass
+
+    snapshot = health.snapshot()[SERVER]
+    # Rejected credentials say nothing about the server's health
+    assert snapshot["attempts"] == 2
+    assert snapshot["consecutive_failures"] == 1
+
+
+@pytest.mark.parametrize("inactive", [False, True])
+def test_actions_for_unavailable_server_fail_fast(monkeypatch, inactive):
+    monkeypatch.setattr(SshConfig, "ASYNC_EXECUTION", True)
+    monkeypatch.setattr(SshConfig, "CIRCUIT_OPEN_INACTIVE", inactive)
+    health = HealthTracker(failure_threshold=1)
+    health.record(SERVER, 10.0, TimeoutError("timed out"))
+    monkeypatch.setattr("provider.provider.server_health", health)
+
+    auth = MagicMock()
+    action = ActionStatus(
+        status=ActionStatusValue.ACTIVE,
+        creator_id=f"urn:globus:auth:identity:{uuid.uuid4()}",
+        details={},
+    )
+    request = ActionRequest(
+        request_id=str(uuid.uuid4()), body={"ssh_server": SERVER, "command": "ls"}
+    )
+    action = _update_action_state(action, request, auth)
+
+    expected = ActionStatusValue.INACTIVE if inactive else ActionStatusValue.FAILED
+    assert action.status == expected
+    assert action.details.code == "ServerUnavailable"
+
+
+def test_introspection_includes_server_health():
+    ap_description.server_health = HealthTracker().snapshot()
+    described = ap_description.dict()
+    assert described["server_health"][SERVER]["state"] == CLOSED
@@ -0,0 +1,148 @@
+import contextlib
+import time
+import uuid
+from functools import partial
+from unittest.mock import MagicMock, patch
+
+import pytest
+from globus_action_provider_tools.data_types import (
+    ActionRequest,
+    ActionStatus,
+    ActionStatusValue,
+)
+
+from provider.capture import OutputCapture
+from provider.config import SshConfig
+from provider.output_store import OutputStore
+from provider.pipeline import failed_step, run_pipeline, with_environment
+from provider.provider import _ssh_worker
+from provider.util import SshUtil
+from tests.test_capture import FakeChannel, HangingChannel
+
+SERVER = "ssh.my.server.edu"
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Keep the action database of the worker out of the source tree
+    monkeypatch.chdir(tmp_path)
+    return OutputStore(str(tmp_path / "output"))
+
+
+def test_environment_values_are_quoted():
+    command = with_environment("echo $GREETING", {"GREETING": "it's me", "N": "1"})
+    assert command == "export GREETING='it'\"'\"'s me' N=1; echo $GREETING"
+    assert with_environment("ls", None) == "ls"
+
+
+@pytest.mark.parametrize(
+    "stop_on_failure, statuses",
+    [
+        (True, ["SUCCEEDED", "FAILED", "SKIPPED"]),
+        (False, ["SUCCEEDED", "FAILED", "SUCCEEDED"]),
+    ],
+)
+def test_steps_report_exit_codes_and_stop_on_failure(store, stop_on_failure, statuses):
+    channels = [
+        FakeChannel(stdout=[b"one\n"]),
+        FakeChannel(stderr=[b"no such file\n"], exit_status=2),
+        FakeChannel(stdout=[b"three\n"]),
+    ]
+    executed = []
+
+    def run_command(channel, output_id, command):
+        executed.append(command)
+        capture = OutputCapture(output_id, store=store)
+        capture.run(channel)
+        return capture
+
+    steps = run_pipeline(
+        "action1",
+        ["cd /scratch", "module load x", "./run"],
+        channels[0],
+        partial(channels.pop, 1),
+        run_command,
+        stop_on_failure=stop_on_failure,
+        environment={"DIR": "/scratch"},
+    )
+
+    assert [s["status"] for s in steps] == statuses
+    assert executed[0] == "export DIR=/scratch; cd /scratch"
+    assert steps[0]["command"] == "cd /scratch"
+    assert steps[1]["exit_code"] == 2 and steps[1]["stderr"] == "no such file\n"
+    assert store.read(steps[0]["output_id"], "stdout") == b"one\n"
+    assert failed_step(steps) == "Step 2 of 3 (module load x) failed with exit code 2"
+
+
+def _run_worker(store, body, new_channel):
+    scope = SshConfig.KNOWN_SERVER_SCOPES[SERVER]["scope"]
+    token_cache = MagicMock()
+    token_cache.dependent_tokens.return_value = {scope: {"access_token": "token"}}
+    token_cache.introspect.return_value = {"username": "joe"}
+    sessions = []
+
+    @contextlib.contextmanager
+    def open_sessions(*args, **kwargs):
+        opened = []
+        sessions.append(opened)
+        yield lambda: opened.append(new_channel()) or opened[-1]
+
+    action = ActionStatus(
+        status=ActionStatusValue.ACTIVE,
+        creator_id=f"urn:globus:auth:identity:{uuid.uuid4()}",
+        start_time=SshUtil.iso_tz_now(),
+        details={},
+    )
+    request = ActionRequest(
+        request_id=str(uuid.uuid4()), body=dict(body, ssh_server=SERVER)
+    )
+    with patch("provider.provider.token_cache", token_cache), patch(
+        "provider.provider.ssh_pool.sessions", side_effect=open_sessions
+    ), patch("provider.provider.OutputCapture", partial(OutputCapture, store=store)):
+        action = _ssh_worker(action, request, MagicMock())
+    return action, sessions
+
+
+def test_pipeline_runs_on_one_transport(store):
+    action, sessions = _run_worker(
+        store,
+        {"commands": ["hostname", "uptime", "date"]},
+        lambda: FakeChannel(stdout=[b"ok\n"]),
+    )
+
+    assert action.status == ActionStatusValue.SUCCEEDED
+    assert len(sessions) == 1 and len(sessions[0]) == 3
+    assert [s["command"] for s in action.details["steps"]] == ["hostname", "uptime", "date"]
+    assert action.details["exit_code"] == 0
+    assert {"token", "exec", "output_read"} <= set(action.details["timing_ms"])
+
+
+def test_exit_status_decides_success(store):
+    action, _ = _run_worker(
+        store,
+        {"command": "module load x"},
+        lambda: FakeChannel(stderr=[b"loading x\n"]),
+    )
+    assert action.status == ActionStatusValue.SUCCEEDED
+    assert action.details["stderr"] == "loading x\n"
+
+    action, _ = _run_worker(
+        store, {"command": "false"}, lambda: FakeChannel(exit_status=1)
+    )
+    assert action.status == ActionStatusValue.FAILED
+    assert action.details.code == "Failed"
+    assert action.details.exit_code == 1
+
+
+def test_timeout_is_capped_and_reported(store, monkeypatch):
+    monkeypatch.setattr(SshConfig, "COMMAND_MAX_TIMEOUT_SECONDS", 0.05)
+    start = time.monotonic()
+    action, sessions = _run_worker(
+        store, {"command": "sleep 1000", "timeout_seconds": 3600}, HangingChannel
+    )
+
+    assert time.monotonic() - start < 5
+    assert action.status == ActionStatusValue.FAILED
+    assert action.details.code == "Timeout"
+    assert action.details.timed_out and action.details.timeout_seconds == 0.05
+    assert sessions[0][0].closed
@@ -0,0 +1,171 @@
+import socket
+import time
+
+import pytest
+
+from benchmarks.resp_server import RespServer
+from globus_action_provider_tools.data_types import (
+    ActionRequest,
+    ActionStatus,
+    ActionStatusValue,
+)
+from provider.local_db import ActionDatabase, LocalStore
+from provider.redis_store import RedisError, RedisOutputStore, RedisStore
+
+
+@pytest.fixture
+def resp_server():
+    with RespServer() as server:
+        yield server
+
+
+def test_redis_store_get_put_delete(resp_server):
+    store = RedisStore(resp_server.url, namespace="test_actions")
+    assert store.get("missing") is None
+    assert store.put("key1", b"value1")
+    assert store.put_many([("key2", b"value2"), ("key3", "value3")]) == 2
+    assert store.get("key1") == b"value1"
+    assert store.get("key3") == b"value3"
+    assert sorted(store.items()) == [
+        ("key1", b"value1"),
+        ("key2", b"value2"),
+        ("key3", b"value3"),
+    ]
+
+    store.delete("key1")
+    assert store.get("key1") is None
+    with pytest.raises(ValueError):
+        store.put("bad:key", b"value")
+
+    store.put("expiring", b"value", expires_at=time.time() + 60)
+    store.put("expired", b"value", expires_at=time.time() - 1)
+    assert store.get("expiring") == b"value"
+    assert store.get("expired") is None
+
+    store.delete_database()
+    assert list(store.items()) == []
+
+
+def test_redis_store_namespaces_and_errors(resp_server):
+    first = RedisStore(resp_server.url, namespace="first")
+    second = RedisStore(resp_server.url, namespace="second")
+    first.put("key", b"first")
+    assert second.get("key") is None
+    with pytest.raises(RedisError):
+        first._execute("NOT_A_COMMAND")
+    # The connection stays usable after an error reply
+    assert first.get("key") == b"first"
+
+
+def test_action_database_on_redis(resp_server):
+    action_db = ActionDatabase(store=RedisStore(resp_server.url, "globus_actions"))
+    status = ActionStatus(
+        status=ActionStatusValue.ACTIVE,
+        creator_id="urn:globus:auth:identity:00000000-0000-0000-0000-000000000000",
+        details={},
+    )
+    request = ActionRequest(request_id="request", body={"command": "ls"})
+    action_db.store_action_request(status, request=request, action_id=status.action_id)
+
+    read_status, read_request = action_db.get_action_request(status.action_id)
+    assert read_status.action_id == status.action_id
+    assert read_request.body == {"command": "ls"}
+    action_db.delete_action_request(status.action_id)
+    assert action_db.get_action_request(status.action_id) == (None, None)
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        monkeypatch.chdir(tmp_path)
+        yield LocalStore("test_changes")
+    else:
+        with RespServer() as server:
+            yield RedisStore(server.url, namespace="test_changes")
+
+
+def test_put_counts_only_changed_values(store):
+    assert store.put_many([("key1", b"value1"), ("key2", b"value2")]) == 2
+    assert store.put_many([("key1", b"value1"), ("key2", b"value2")]) == 0
+    assert store.put_many([("key1", b"value1"), ("key2", b"other")]) == 1
+    assert store.put("key3", "text")
+    assert not store.put("key3", "text")
+    assert store.put_many([("key2", b"other", time.time() - 1)]) == 1
+    assert store.get("key2") is None
+
+
+def test_redis_store_get_many(resp_server):
+    store = RedisStore(resp_server.url, namespace="test_many")
+    store.put_many([("key1", b"value1"), ("key2", b"value2")])
+    assert store.get_many(["key2", "missing", "key1", "bad:key"]) == {
+        "key1": b"value1",
+        "key2": b"value2",
+    }
+
+
+def test_redis_store_put_if_tag(resp_server):
+    store = RedisStore(resp_server.url, namespace="test_cas")
+    store.put("key1", b"first")
+    tag = store.tag("key1")
+    assert store.put_if_tag("key1", b"second", tag)
+    assert not store.put_if_tag("key1", b"third", tag)
+    assert store.get("key1") == b"second"
+
+    # Written by another client between WATCH and EXEC
+    other = RedisStore(resp_server.url, namespace="test_cas")
+    tag = store.tag("key1")
+    execute = store._connection().execute
+
+    def meddle(*args):
+        reply = execute(*args)
+        if args[0] == "GET":
+            other.put("key1", b"other")
+        return reply
+
+    store._connection().execute = meddle
+    assert not store.put_if_tag("key1", b"mine", tag)
+    assert store.get("key1") == b"other"
+
+
+def test_redis_store_resends_only_what_the_server_never_read(resp_server):
+    store = RedisStore(resp_server.url, namespace="test_retry")
+    store.put("key", b"value")
+    # Closed while idle: reconnected before sending
+    store._connection().sock.shutdown(socket.SHUT_RDWR)
+    assert store.get("key") == b"value"
+
+    store._connection().sock.settimeout(0.05)
+    resp_server.latency = 0.2
+    commands = resp_server.commands
+    with pytest.raises(socket.timeout):
+        store.put("key", b"other")
+    time.sleep(0.3)
+    resp_server.latency = 0
+    # Timed out waiting for the reply: the write was not sent again
+    assert resp_server.commands == commands + 1
+    assert store.get("key") == b"other"
+
+
+def test_output_is_shared_through_redis(resp_server):
+    # Written on one pod, read and released on another
+    writer = RedisOutputStore(resp_server.url, retention_seconds=60)
+    reader = RedisOutputStore(resp_server.url, retention_seconds=60)
+    with writer.writer("action", "stdout") as f:
+        f.write(b"line 1\n")
+        f.write("é\n".encode())
+    writer.append("action", "stderr", b"oops")
+
+    assert reader.size("action", "stdout") == 10
+    assert reader.read("action", "stdout") == "line 1\né\n".encode()
+    assert reader.read("action", "stdout", offset=7, limit=2) == "é".encode()
+    assert reader.read("action", "stdout", offset=7, limit=0) == b""
+    assert reader.read("action", "stderr") == b"oops"
+    assert reader.wait_for("action", "stdout", 5, timeout=0) == 10
+    _, expires_at = resp_server.data[b"ssh_output:action.stdout"]
+    assert 0 < expires_at - time.time() <= 60
+
+    reader.delete("action")
+    assert writer.size("action", "stdout") == 0
+    assert writer.read("action", "stderr") == b""
+    with pytest.raises(ValueError):
+        writer.size("../action", "stdout")
@@ -0,0 +1,212 @@
+import contextlib
+import socket
+import threading
+import time
+import uuid
+from unittest.mock import MagicMock, patch
+
+import pytest
+from globus_action_provider_tools.data_types import (
+    ActionRequest,
+    ActionStatus,
+    ActionStatusValue,
+)
+from paramiko.ssh_exception import (
+    AuthenticationException,
+    ChannelException,
+    NoValidConnectionsError,
+    SSHException,
+)
+
+import provider.provider
+from provider import provider_bp
+from provider.config import SshConfig
+from provider.executor import ActionExecutor
+from provider.provider import _dispatch_action, save_action
+from provider.retry import RetryPolicy, RetryTimer, is_retryable, retry_policy
+
+SERVER = "ssh.my.server.edu"
+
+
+@pytest.mark.parametrize(
+    "error, retryable",
+    [
+        (socket.timeout("timed out"), True),
+        (ConnectionResetError(104, "Connection reset by peer"), True),
+        (NoValidConnectionsError({("10.0.0.1", 22): OSError("refused")}), True),
+        (ChannelException(2, "Connect failed"), True),
+        (SSHException("Error reading SSH protocol banner"), True),
+        (SSHException("Incompatible ssh server"), False),
+        (AuthenticationException("Authentication failed."), False),
+        (socket.gaierror(-2, "Name or service not known"), False),
+        (ValueError("bug"), False),
+    ],
+)
+def test_errors_are_classified(error, retryable):
+    assert is_retryable(error) is retryable
+
+
+def test_backoff_is_capped_and_bounded_by_attempts_and_deadline():
+    policy = RetryPolicy(max_attempts=4, base_delay=1, max_delay=3, deadline=100)
+    attempts = []
+    delays = [policy.record_failure(attempts, socket.timeout()) for _ in range(4)]
+    assert all(0 <= d <= cap for d, cap in zip(delays, (1, 2, 3)))
+    assert delays[-1] is None
+    assert [a["attempt"] for a in attempts] == [1, 2, 3, 4]
+    assert all(a["retryable"] for a in attempts)
+
+    assert policy.record_failure([], AuthenticationException("no")) is None
+    policy = RetryPolicy(max_attempts=10, base_delay=10, max_delay=10, deadline=0)
+    assert policy.record_failure([], socket.timeout()) is None
+
+
+def test_timer_runs_callbacks_in_due_order():
+    timer = RetryTimer()
+    done = threading.Event()
+    calls = []
+    timer.call_later(0.05, lambda: (calls.append("late"), done.set()))
+    timer.call_later(0.01, calls.append, "early")
+    assert done.wait(5)
+    assert calls == ["early", "late"]
+    assert timer.pending() == 0
+
+
+@contextlib.contextmanager
+def _fake_ssh(failures):
+    """
+    Patch out the tokens, SSH sessions and output of actions, the first
+    session of each server in failures raising the errors listed for it.
+    Yields the servers sessions were opened to, in order.
+    """
+    scope = SshConfig.KNOWN_SERVER_SCOPES[SERVER]["scope"]
+    token_cache = MagicMock()
+    token_cache.dependent_tokens.return_value = {scope: {"access_token": "token"}}
+    token_cache.introspect.return_value = {"username": "joe"}
+    opened = []
+
+    @contextlib.contextmanager
+    def sessions(server, *args, **kwargs):
+        opened.append(server)
+        if failures.get(server):
+            raise failures[server].pop(0)
+        yield MagicMock
+
+    capture = MagicMock()
+    capture.return_value.text.return_value = ""
+    capture.return_value.stored = {"stdout": 0}
+    capture.return_value.truncated.return_value = False
+    capture.return_value.exit_status = 0
+    capture.return_value.timed_out = False
+    capture.return_value.cancelled = False
+
+    with patch("provider.provider.token_cache", token_cache), patch(
+        "provider.provider.ssh_pool.sessions", side_effect=sessions
+    ), patch("provider.provider.OutputCapture", capture):
+        yield opened
+
+
+def _auth():
+    auth = MagicMock()
+    auth.effective_identity = f"urn:globus:auth:identity:{uuid.uuid4()}"
+    auth.check_authorization.return_value = True
+    return auth
+
+
+def test_connect_failures_are_retried_without_blocking(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(SshConfig, "ASYNC_EXECUTION", True)
+    monkeypatch.setattr(retry_policy, "base_delay", 0.01)
+    monkeypatch.setattr(retry_policy, "max_delay", 0.01)
+    failures = {SERVER: [ChannelException(1, "open failed"), socket.timeout("timed out")]}
+
+    auth = _auth()
+    request = ActionRequest(
+        request_id=str(uuid.uuid4()), body={"ssh_server": SERVER, "command": "hostname"}
+    )
+    with _fake_ssh(failures):
+        status, _ = provider_bp.action_run_callback(request, auth)
+        deadline = time.time() + 5
+        while not status.is_complete() and time.time() < deadline:
+            time.sleep(0.01)
+            status = provider_bp.action_status_callback(status.action_id, auth)
+
+    assert status.status == ActionStatusValue.SUCCEEDED
+    assert [a["retryable"] for a in status.details["attempts"]] == [True, True]
+    assert "ChannelException" in status.details["attempts"][0]["error"]
+
+
+@pytest.mark.parametrize("servers", [SERVER, [SERVER, "ssh.globustest.org"]])
+def test_synchronous_run_returns_before_the_retry_is_due(
+    tmp_path, monkeypatch, servers
+):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(SshConfig, "ASYNC_EXECUTION", False)
+    delay = 0.5
+    monkeypatch.setattr(retry_policy, "backoff", lambda attempt: delay)
+    failures = {SERVER: [socket.timeout("timed out")]}
+
+    auth = _auth()
+    request = ActionRequest(
+        request_id=str(uuid.uuid4()), body={"ssh_server": servers, "command": "hostname"}
+    )
+    with _fake_ssh(failures) as opened:
+        started = time.monotonic()
+        status, _ = provider_bp.action_run_callback(request, auth)
+        assert time.monotonic() - started < delay / 2
+        assert status.status == ActionStatusValue.ACTIVE
+        assert 0 < status.details["next_attempt_in_ms"] <= delay * 1000
+        attempted = len(opened)
+
+        # Polled before the next attempt is due: nothing is run
+        status = provider_bp.action_status_callback(status.action_id, auth)
+        assert status.status == ActionStatusValue.ACTIVE
+        assert len(opened) == attempted
+
+        time.sleep(delay)
+        status = provider_bp.action_status_callback(status.action_id, auth)
+        assert status.status == ActionStatusValue.SUCCEEDED
+        assert opened.count(SERVER) == 2
+        assert len(opened) == attempted + 1
+
+    details = status.details
+    if isinstance(servers, list):
+        details = details["servers"][SERVER]
+        assert status.details["succeeded"] == 2
+    assert [a["retryable"] for a in details["attempts"]] == [True]
+
+
+def test_saturated_executor_takes_the_action_later(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(SshConfig, "EXECUTOR_SATURATED_RETRY_SECONDS", 0.01)
+    executor = ActionExecutor(max_workers=1, max_pending=0)
+    monkeypatch.setattr(provider.provider, "action_executor", executor)
+    busy = threading.Event()
+    assert executor.submit(busy.wait, 5) is not None
+    ran_in = []
+
+    def worker(action, request, auth):
+        ran_in.append(threading.current_thread().name)
+        action.status = ActionStatusValue.SUCCEEDED
+        action.details = {"exit_code": 0}
+        return action
+
+    auth = MagicMock()
+    auth.effective_identity = f"urn:globus:auth:identity:{uuid.uuid4()}"
+    request = ActionRequest(
+        request_id=str(uuid.uuid4()), body={"ssh_server": SERVER, "command": "hostname"}
+    )
+    action = ActionStatus(
+        status=ActionStatusValue.ACTIVE, creator_id=auth.effective_identity, details={}
+    )
+    save_action(action, request=request)
+    with patch("provider.provider._ssh_worker", side_effect=worker):
+        assert _dispatch_action(action, request, auth).status == ActionStatusValue.ACTIVE
+        time.sleep(0.05)
+        assert not ran_in
+        busy.set()
+        deadline = time.time() + 5
+        while not ran_in and time.time() < deadline:
+            time.sleep(0.01)
+    executor.shutdown()
+
+    assert ran_in and ran_in[0].startswith("ssh-action")
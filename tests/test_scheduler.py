@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+from provider.config import SshConfig
+from provider.scheduler import ServerBusy, ServerScheduler
+
+SERVER = "ssh.my.server.edu"
+
+
+def test_slots_are_limited_and_handed_out_round_robin():
+    scheduler = ServerScheduler(default_limit=1, max_queued=10)
+    started = []
+
+    def starter(name):
+        return lambda waited: started.append(name)
+
+    scheduler.schedule(SERVER, "alice", starter("alice-1"))
+    for name in ("alice-2", "alice-3"):
+        scheduler.schedule(SERVER, "alice", starter(name))
+    scheduler.schedule(SERVER, "bob", starter("bob-1"))
+    assert started == ["alice-1"]
+    assert scheduler.stats()[SERVER] == {
+        "limit": 1,
+        "active": 1,
+        "queued": 3,
+        "identities_waiting": 2,
+    }
+
+    for _ in range(4):
+        scheduler.release(SERVER)
+    # bob's first action isn't stuck behind all of alice's
+    assert started == ["alice-1", "alice-2", "bob-1", "alice-3"]
+    assert scheduler.stats()[SERVER]["active"] == 0
+
+
+def test_full_queue_raises_server_busy(monkeypatch):
+    monkeypatch.setitem(
+        SshConfig.KNOWN_SERVER_SCOPES,
+        "busy.server.edu",
+        {"scope": "scope", "max_sessions": 2},
+    )
+    scheduler = ServerScheduler(default_limit=8, max_queued=1)
+    for _ in range(3):
+        scheduler.schedule("busy.server.edu", "alice", lambda waited: None)
+    with pytest.raises(ServerBusy):
+        scheduler.schedule("busy.server.edu", "bob", lambda waited: None)
+    assert scheduler.stats()["busy.server.edu"]["limit"] == 2
+
+
+def test_blocking_slot_waits_and_times_out():
+    scheduler = ServerScheduler(default_limit=1, max_queued=10)
+    waits = []
+    with scheduler.slot(SERVER, "alice"):
+        with pytest.raises(ServerBusy):
+            with scheduler.slot(SERVER, "bob", timeout=0.01):
+                pass
+
+        def wait_for_slot():
+            with scheduler.slot(SERVER, "bob", timeout=5) as waited:
+                waits.append(waited)
+
+        thread = threading.Thread(target=wait_for_slot)
+        thread.start()
+        while not scheduler.stats()[SERVER]["queued"]:
+            time.sleep(0.001)
+    thread.join()
+
+    assert waits and waits[0] > 0
+    assert scheduler.stats()[SERVER] == {
+        "limit": 1,
+        "active": 0,
+        "queued": 0,
+        "identities_waiting": 0,
+    }
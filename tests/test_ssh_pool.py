@@ -0,0 +1,89 @@
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from provider.ssh_pool import SshConnectionPool, token_fingerprint
+
+
+@pytest.fixture
+def transports():
+    opened = []
+
+    def new_transport(sock):
+        transport = MagicMock()
+        transport.is_active.return_value = True
+        opened.append(transport)
+        return transport
+
+    with patch("provider.ssh_pool.Transport", side_effect=new_transport), patch.object(
+        SshConnectionPool, "_open_socket"
+    ):
+        yield opened
+
+
+def test_transport_is_reused_across_sessions(transports):
+    pool = SshConnectionPool(max_per_server=2, idle_timeout=60)
+    for _ in range(3):
+        with pool.session("ssh.my.server.edu", "joe", "token-1") as channel:
+            channel.exec_command("hostname")
+
+    assert len(transports) == 1
+    transports[0].auth_password.assert_called_once_with("joe", "token-1")
+    assert transports[0].open_session.call_count == 3
+    assert pool.size("ssh.my.server.edu") == 1
+
+
+def test_pool_keys_on_token_and_evicts_rotated(transports):
+    pool = SshConnectionPool(max_per_server=4, idle_timeout=60)
+    with pool.session("ssh.my.server.edu", "joe", "token-1"):
+        pass
+    with pool.session("ssh.my.server.edu", "joe", "token-2"):
+        pass
+
+    assert len(transports) == 2
+    transports[0].close.assert_called_once()
+    assert pool.size("ssh.my.server.edu") == 1
+    assert token_fingerprint("token-1") != token_fingerprint("token-2")
+
+
+def test_idle_and_dead_transports_are_evicted(transports):
+    pool = SshConnectionPool(max_per_server=4, idle_timeout=0)
+    with pool.session("ssh.my.server.edu", "joe", "token-1"):
+        pass
+    pool.evict_idle()
+    assert pool.size() == 0
+
+    pool = SshConnectionPool(max_per_server=4, idle_timeout=60)
+    with pool.session("ssh.my.server.edu", "joe", "token-1"):
+        pass
+    transports[-1].is_active.return_value = False
+    with pool.session("ssh.my.server.edu", "joe", "token-1"):
+        pass
+    assert len(transports) == 3
+
+
+def test_idle_transports_are_evicted_in_the_background(transports):
+    pool = SshConnectionPool(max_per_server=4, idle_timeout=0.05, evict_interval=0.01)
+    with pool.session("ssh.my.server.edu", "joe", "token-1"):
+        pass
+    pool.start()
+    try:
+        deadline = time.monotonic() + 5
+        while pool.size() and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        pool.stop()
+    assert pool.size() == 0
+    transports[0].close.assert_called_once()
+
+
+def test_max_per_server_cap(transports):
+    pool = SshConnectionPool(max_per_server=1, idle_timeout=60, max_channels=1)
+    with pool.session("ssh.my.server.edu", "joe", "token-1"):
+        # The only pooled transport is busy, so this one is not kept
+        with pool.session("ssh.my.server.edu", "joe", "token-1"):
+            assert pool.size("ssh.my.server.edu") == 1
+    assert len(transports) == 2
+    transports[1].close.assert_called_once()
+    assert pool.size("ssh.my.server.edu") == 1
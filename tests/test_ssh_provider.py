@@ -1,4 +1,5 @@
 import copy
+import threading
 import uuid
 from functools import partial
 from typing import Any, Dict, NamedTuple
@@ -7,12 +8,19 @@ from unittest.mock import MagicMock, patch
 import pytest
 from flask import Flask
 from flask.testing import FlaskClient
-from globus_action_provider_tools.data_types import ActionStatusValue
+from globus_action_provider_tools.data_types import (
+    ActionRequest,
+    ActionStatus,
+    ActionStatusValue,
+)
 import globus_action_provider_tools.testing.fixtures
 
 import provider
 from provider import provider_bp
 from provider.config import SshConfig
+from provider.executor import action_executor
+from provider.output_store import output_store
+from provider.provider import _with_output_page
 
 
 @pytest.fixture
@@ -198,3 +206,76 @@ def test_release_for_missing_action(
     release_response = config.app_client.post(release_endpoint)
 
     assert release_response.status_code == 404
+
+
+@pytest.fixture
+def local_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+
+
+def make_auth_state():
+    auth = MagicMock()
+    auth.effective_identity = f"urn:globus:auth:identity:{uuid.uuid4()}"
+    auth.check_authorization.return_value = True
+    auth.get_authorizer_for_scope.return_value = MagicMock()
+    return auth
+
+
+def make_action_request(**body):
+    body.setdefault("ssh_server", "ssh.my.server.edu")
+    body.setdefault("command", "hostname")
+    return ActionRequest(request_id=str(uuid.uuid4()), body=body)
+
+
+def test_async_run_returns_active_and_completes(local_db, monkeypatch):
+    monkeypatch.setattr(SshConfig, "ASYNC_EXECUTION", True)
+    started = threading.Event()
+    release = threading.Event()
+
+    def fake_worker(action, request, auth):
+        started.set()
+        release.wait(5)
+        action.status = ActionStatusValue.SUCCEEDED
+        action.details = {"ssh_output": "login01"}
+        return action
+
+    auth = make_auth_state()
+    with patch("provider.provider._ssh_worker", side_effect=fake_worker):
+        status, code = provider_bp.action_run_callback(make_action_request(), auth)
+        assert code == 202
+        assert status.status == ActionStatusValue.ACTIVE
+        assert started.wait(5)
+
+        stored = provider_bp.action_status_callback(status.action_id, auth)
+        assert stored.status == ActionStatusValue.ACTIVE
+
+        release.set()
+        action_executor.shutdown(wait=True)
+
+    stored = provider_bp.action_status_callback(status.action_id, auth)
+    assert stored.status == ActionStatusValue.SUCCEEDED
+    assert stored.details["ssh_output"] == "login01"
+    assert stored.details["queue_wait_ms"] >= 0
+
+
+def test_output_is_paged_by_limit_and_offset(local_db):
+    output = ("é" * 10).encode("utf-8")
+    request = make_action_request(limit=5)
+    action = ActionStatus(
+        status=ActionStatusValue.SUCCEEDED,
+        creator_id=make_auth_state().effective_identity,
+        details={"output_size": len(output), "output_truncated": False},
+    )
+    output_store.append(action.action_id, "stdout", output)
+
+    page = _with_output_page(action, request)
+    # A page never splits a multi-byte character
+    assert page.details["ssh_output"] == "éé"
+    assert page.details["output_next_offset"] == 4
+    assert "ssh_output" not in action.details
+
+    request.body["offset"] = 16
+    page = _with_output_page(action, request)
+    assert page.details["ssh_output"] == "éé"
+    assert page.details["output_next_offset"] is None
@@ -0,0 +1,57 @@
+import uuid
+
+import pytest
+from globus_action_provider_tools.data_types import (
+    ActionRequest,
+    ActionStatus,
+    ActionStatusValue,
+)
+
+from benchmarks.auth import StubAuthState
+from benchmarks.load import SERVER, routed_to
+from benchmarks.ssh_server import SshServer
+from provider.output_store import output_store
+from provider.provider import _ssh_worker
+from provider.util import SshUtil
+
+
+@pytest.fixture
+def ssh_server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with SshServer(passwords={"ssh-token"}) as server, routed_to(server):
+        yield server
+
+
+def run(command, token="token"):
+    auth = StubAuthState(token)
+    action = ActionStatus(
+        status=ActionStatusValue.ACTIVE,
+        creator_id=auth.effective_identity,
+        start_time=SshUtil.iso_tz_now(),
+        details={},
+    )
+    request = ActionRequest(
+        request_id=str(uuid.uuid4()),
+        body={"ssh_server": SERVER, "command": command},
+    )
+    return _ssh_worker(action, request, auth)
+
+
+def test_commands_run_over_a_real_ssh_session(ssh_server):
+    action = run("run output=5000 latency=0.01")
+    assert action.status == ActionStatusValue.SUCCEEDED
+    assert action.details["exit_code"] == 0
+    assert action.details["output_size"] == 5000
+    assert len(output_store.read(action.action_id, "stdout")) == 5000
+
+    action = run("run exit=3 stderr=10")
+    assert action.status == ActionStatusValue.FAILED
+    assert "status 3" in action.details.description
+    # Both commands went through one pooled transport
+    assert ssh_server.logins == 1 and ssh_server.commands == 2
+
+
+def test_wrong_token_is_refused(ssh_server):
+    action = run("run", token="someone-else")
+    assert action.status == ActionStatusValue.FAILED
+    assert ssh_server.commands == 0
@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+import time
+import uuid
+from unittest.mock import MagicMock
+
+import pytest
+from flask import Flask, g
+from globus_action_provider_tools.data_types import ActionStatus, ActionStatusValue
+from globus_action_provider_tools.errors import AuthenticationError
+from werkzeug.routing import Rule
+
+from provider import provider_bp
+from provider.local_db import LocalStore
+from provider.provider import _add_status_etag, _status_not_modified, save_action
+from provider.util import SshUtil
+
+
+def test_version_changes_only_with_the_value(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # A table from before versions existed
+    conn = sqlite3.connect("versions.sqlitedb")
+    conn.execute("CREATE TABLE versions(id primary key, value text, expires_at real)")
+    conn.execute("INSERT INTO versions values ('old', 'a', NULL)")
+    conn.commit()
+    conn.close()
+
+    store = LocalStore("versions")
+    assert store.tag("old") == "1"
+    assert store.tag("missing") is None
+    store.put("old", "a")
+    assert store.tag("old") == "1"
+    store.put("old", "b")
+    assert store.tag("old") == "2"
+
+
+@pytest.fixture
+def action(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    auth = MagicMock()
+    auth.effective_identity = f"urn:globus:auth:identity:{uuid.uuid4()}"
+    auth.check_authorization.return_value = True
+    status = ActionStatus(
+        status=ActionStatusValue.SUCCEEDED,
+        creator_id=auth.effective_identity,
+        start_time=SshUtil.iso_tz_now(),
+        completion_time=SshUtil.iso_tz_now(),
+        details={},
+    )
+    save_action(status)
+    return status, auth
+
+
+def poll(action_id, auth, etag=None, wait=0):
+    """
+    The status response, or 304 Not Modified if _status_not_modified
+    short-circuits the request
+    """
+    headers = {"If-None-Match": f'"{etag}"'} if etag else {}
+    with Flask(__name__).test_request_context(
+        f"/actions/{action_id}?wait={wait}", headers=headers
+    ) as ctx:
+        ctx.request.url_rule = Rule(
+            "/actions/<action_id>", endpoint=f"{provider_bp.name}.action_status"
+        )
+        ctx.request.view_args = {"action_id": action_id}
+        g.auth_state = auth
+        response = _status_not_modified()
+        if response is None:
+            provider_bp.action_status_callback(action_id, auth)
+            response = _add_status_etag(Flask.response_class("{}", 200))
+        return response
+
+
+def test_unchanged_status_is_not_modified(action):
+    status, auth = action
+    response = poll(status.action_id, auth)
+    etag, _ = response.get_etag()
+    assert response.status_code == 200 and etag
+
+    assert poll(status.action_id, auth, etag).status_code == 304
+
+    # Someone not allowed to view the action is never told it exists
+    auth.check_authorization.return_value = False
+    with pytest.raises(AuthenticationError):
+        poll(status.action_id, auth, etag)
+
+
+def test_wait_returns_as_soon_as_the_status_changes(action):
+    status, auth = action
+    etag, _ = poll(status.action_id, auth).get_etag()
+
+    start = time.monotonic()
+    assert poll(status.action_id, auth, etag, wait=0.2).status_code == 304
+    assert time.monotonic() - start >= 0.2
+
+    def update():
+        time.sleep(0.05)
+        status.details = {"exit_code": 0}
+        save_action(status, force=True)
+
+    threading.Thread(target=update).start()
+    start = time.monotonic()
+    response = poll(status.action_id, auth, etag, wait=10)
+    assert response.status_code == 200
+    assert response.get_etag()[0] != etag
+    assert time.monotonic() - start < 5
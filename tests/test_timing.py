@@ -0,0 +1,55 @@
+import time
+from unittest.mock import MagicMock, patch
+
+from provider import timing
+from provider.config import SshConfig
+from provider.ssh_pool import SshConnectionPool
+
+
+def test_elapsed_time_keeps_whole_seconds():
+    timer = timing.PhaseTimer()
+    timer.started_ns -= 3_200_000_000
+    assert 3200 <= timer.elapsed_ms() < 4200
+
+
+def test_phases_only_count_for_the_active_timer():
+    with timing.phase("exec"):
+        pass
+    timer = timing.PhaseTimer()
+    timer.add("queue_wait", 2_500_000)
+    with timing.activate(timer):
+        with timing.phase("exec"):
+            time.sleep(0.01)
+        timer.add("exec", 1_000_000)
+    exec_ns = timer.phases_ns["exec"]
+    with timing.phase("exec"):
+        pass
+
+    assert timing.current() is None
+    assert timer.phases_ns["exec"] == exec_ns
+    breakdown = timer.breakdown_ms()
+    assert 11 <= breakdown["exec"] < 1000
+    assert breakdown["queue_wait"] == 2.5
+
+
+def test_new_transport_reports_connect_phases():
+    transport = MagicMock()
+    pool = SshConnectionPool()
+    timer = timing.PhaseTimer()
+    with patch("provider.ssh_pool.Transport", return_value=transport), patch.object(
+        SshConnectionPool, "_open_socket"
+    ) as open_socket, timing.activate(timer):
+        with pool.session("ssh.my.server.edu", "joe", "token"):
+            pass
+        with pool.session("ssh.my.server.edu", "joe", "token"):
+            pass
+
+    assert set(timer.phases_ns) == {
+        "tcp_connect",
+        "key_exchange",
+        "ssh_auth",
+        "session_open",
+    }
+    # The second session reused the transport
+    assert transport.auth_password.call_count == 1
+    assert open_socket.call_args[0][:2] == ("ssh.my.server.edu", SshConfig.SSH_PORT)
@@ -0,0 +1,132 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+from globus_sdk.authorizers import AccessTokenAuthorizer, RefreshTokenAuthorizer
+
+from provider.token_cache import TokenCache, token_key
+
+SSH_SCOPE = "https://auth.globus.org/scopes/ssh.my.server.edu/ssh"
+
+
+def token_response(expires_in, refresh_token=None, access_token="ssh-token"):
+    token_data = {
+        "scope": SSH_SCOPE,
+        "access_token": access_token,
+        "expires_at_seconds": int(time.time() + expires_in),
+    }
+    if refresh_token:
+        token_data["refresh_token"] = refresh_token
+    response = MagicMock()
+    response.by_resource_server = {"ssh.my.server.edu": token_data}
+    return response
+
+
+def make_auth_state(token="bearer-token", expires_in=3600, refresh_token=None):
+    auth = MagicMock()
+    auth.bearer_token = token
+    auth.introspect_token.return_value = {
+        "username": "user@example.org",
+        "exp": time.time() + 3600,
+    }
+    auth.get_dependent_tokens.return_value = token_response(expires_in, refresh_token)
+    return auth
+
+
+def test_introspection_is_cached_per_token_hash():
+    cache = TokenCache()
+    auth = make_auth_state()
+    assert cache.introspect(auth)["username"] == "user@example.org"
+    assert cache.introspect(make_auth_state())["username"] == "user@example.org"
+    assert auth.introspect_token.call_count == 1
+    assert token_key("bearer-token") in cache._entries
+    assert "bearer-token" not in cache._entries
+
+    other = make_auth_state(token="other-token")
+    cache.introspect(other)
+    assert other.introspect_token.call_count == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_introspection_respects_token_expiry():
+    cache = TokenCache(introspect_ttl=3600)
+    auth = make_auth_state()
+    auth.introspect_token.return_value = {"username": "user", "exp": time.time() - 1}
+    cache.introspect(auth)
+    cache.introspect(auth)
+    assert auth.introspect_token.call_count == 2
+
+
+def test_callers_without_a_token_are_not_cached():
+    cache = TokenCache()
+    first = make_auth_state(token=None)
+    second = make_auth_state(token="")
+    second.get_dependent_tokens.return_value = token_response(3600, access_token="other")
+    assert cache.dependent_tokens(first)[SSH_SCOPE]["access_token"] == "ssh-token"
+    assert cache.dependent_tokens(second)[SSH_SCOPE]["access_token"] == "other"
+    assert second.get_dependent_tokens.call_count == 1
+    assert not cache._entries
+
+
+def test_concurrent_misses_make_one_grant():
+    cache = TokenCache()
+    auth = make_auth_state()
+    response = auth.get_dependent_tokens.return_value
+
+    def slow_grant(**kwargs):
+        time.sleep(0.1)
+        return response
+
+    auth.get_dependent_tokens.side_effect = slow_grant
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.dependent_tokens(auth)))
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert auth.get_dependent_tokens.call_count == 1
+    assert all(r[SSH_SCOPE]["access_token"] == "ssh-token" for r in results)
+
+
+def test_expiring_tokens_are_regranted_or_refreshed_ahead():
+    cache = TokenCache(min_lifetime=60, refresh_ahead=600)
+    auth = make_auth_state(expires_in=30)
+    cache.dependent_tokens(auth)
+    cache.dependent_tokens(auth)
+    # Too close to expiry to be used and no refresh token: grant again
+    assert auth.get_dependent_tokens.call_count == 2
+
+    auth = make_auth_state(token="refreshable", expires_in=300, refresh_token="rt")
+    auth.auth_client.oauth2_refresh_token.return_value = token_response(
+        3600, access_token="refreshed-token"
+    )
+    cache.dependent_tokens(auth)
+    # Still usable: served as is while the refresh runs
+    assert cache.dependent_tokens(auth)[SSH_SCOPE]["access_token"] == "ssh-token"
+    deadline = time.time() + 5
+    while cache.stats()["refreshes"] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+
+    tokens = cache.dependent_tokens(auth)
+    assert tokens[SSH_SCOPE]["access_token"] == "refreshed-token"
+    assert tokens[SSH_SCOPE]["refresh_token"] == "rt"
+    auth.auth_client.oauth2_refresh_token.assert_called_once_with("rt")
+    assert auth.get_dependent_tokens.call_count == 1
+
+
+def test_authorizers_and_lru_eviction():
+    cache = TokenCache(max_entries=1)
+    auth = make_auth_state()
+    assert isinstance(cache.authorizer_for_scope(auth, SSH_SCOPE), AccessTokenAuthorizer)
+    assert cache.authorizer_for_scope(auth, "missing-scope") is None
+
+    expiring = make_auth_state(token="expiring", expires_in=30, refresh_token="rt")
+    expiring.auth_client.oauth2_refresh_token.side_effect = Exception("unavailable")
+    authorizer = cache.authorizer_for_scope(expiring, SSH_SCOPE)
+    assert isinstance(authorizer, RefreshTokenAuthorizer)
+    assert cache.stats()["evictions"] == 1
+    assert token_key("bearer-token") not in cache._entries
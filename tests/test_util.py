@@ -1,13 +1,23 @@
+import json
+import sqlite3
+import threading
+import time
 import uuid
 
+import arrow
+import dill
 import pytest
 from provider.util import SshUtil
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from random import randrange
 import logging
-from provider.local_db import ActionDatabase, LocalStore
+from provider import codec
+from provider.expiry import ExpirySweeper
+from provider.local_db import ActionDatabase, KeyValueStore, LocalStore
+from provider.output_store import OutputStore
 
 from globus_action_provider_tools.data_types import (
+    ActionFailedDetails,
     ActionRequest,
     ActionStatus,
     ActionStatusValue,
@@ -80,3 +90,231 @@ class TestSshUtil(object):
         #     assert False, 'Expected ValueError'
         # except ValueError:
         #     pass
+
+
+def test_local_store_reuses_wal_connection():
+    store = LocalStore(_TEST_DB_FILE)
+    store.put('reused_key', 'value')
+    conn = store._connection()
+    assert store._connection() is conn
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert store.get('reused_key') == 'value'
+    store.delete('reused_key')
+    assert store.get('reused_key') is None
+
+
+def test_local_store_connections_are_per_thread():
+    store = LocalStore(_TEST_DB_FILE)
+    store.put('thread_key', 'main')
+    seen = {}
+
+    def read():
+        seen['conn'] = store._connection()
+        seen['value'] = store.get('thread_key')
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    reader.join()
+    assert seen['value'] == 'main'
+    assert seen['conn'] is not store._connection()
+    store.delete('thread_key')
+
+
+def test_connections_of_finished_threads_are_closed():
+    store = LocalStore(_TEST_DB_FILE)
+    opened = []
+
+    def read():
+        opened.append(store._connection())
+        store.get('thread_key')
+
+    for _ in range(3):
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join()
+    for conn in opened[:2]:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute('select 1')
+
+
+def test_stores_must_implement_the_whole_interface():
+    class Partial(KeyValueStore):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_local_store_put_skips_unchanged_values():
+    store = LocalStore(_TEST_DB_FILE)
+    assert store.put('upsert_key', 'first')
+    assert not store.put('upsert_key', 'first')
+    assert store.put('upsert_key', 'second')
+    assert store.get('upsert_key') == 'second'
+
+    assert store.put_many([('upsert_key', 'second'), ('batch_key', 'new')]) == 1
+    assert store.get('batch_key') == 'new'
+    store.delete('upsert_key')
+    store.delete('batch_key')
+
+
+def test_local_store_put_if_tag_only_replaces_that_version():
+    store = LocalStore(_TEST_DB_FILE)
+    store.put('cas_key', 'first')
+    tag = store.tag('cas_key')
+    assert store.put_if_tag('cas_key', 'second', tag)
+    assert not store.put_if_tag('cas_key', 'third', tag)
+    assert store.get('cas_key') == 'second'
+    store.delete('cas_key')
+    assert not store.put_if_tag('cas_key', 'fourth', store.tag('cas_key'))
+    assert store.get('cas_key') is None
+
+
+def _make_status_and_request(**details):
+    action_id = 'codec_action_' + str(randrange(50))
+    status = ActionStatus(
+        status=ActionStatusValue.FAILED,
+        creator_id=f"urn:globus:auth:identity:{str(uuid.uuid4())}",
+        monitor_by={f"urn:globus:groups:id:{str(uuid.uuid4())}"},
+        completion_time=SshUtil.iso_tz_now(),
+        details=ActionFailedDetails(code="Failed", description="Error: boom", **details),
+    )
+    request = ActionRequest(request_id=action_id, body={'command': 'ls', 'limit': 10})
+    return status, request
+
+
+def test_codecs_must_implement_dumps_and_loads():
+    class EncodeOnly(codec.ActionCodec):
+        name = "encode-only"
+
+        def dumps(self, status, request):
+            return b""
+
+    with pytest.raises(TypeError):
+        EncodeOnly()
+
+
+@pytest.mark.parametrize("codec_name", ["json", "json+zlib", "dill"])
+def test_codec_round_trip(codec_name):
+    status, request = _make_status_and_request(exit_code=2)
+    encoded = codec.get_codec(codec_name).encode(status, request)
+    decoded_status, decoded_request, used = codec.decode(encoded)
+
+    assert used.name == codec_name
+    assert decoded_status.action_id == status.action_id
+    assert decoded_status.monitor_by == status.monitor_by
+    assert decoded_status.details["exit_code"] == 2
+    assert decoded_request == request
+
+
+def test_json_rows_decode_like_validated_models():
+    status, request = _make_status_and_request(exit_code=2)
+    status.release_after = timedelta(days=30)
+    request.deadline = datetime.now(timezone.utc)
+    encoded = codec.get_codec("json").encode(status, request)
+    decoded_status, decoded_request, _ = codec.decode(encoded)
+
+    stored = json.loads(encoded.split(b":", 2)[2])
+    assert decoded_status == ActionStatus.parse_obj(stored["status"])
+    assert decoded_request == ActionRequest.parse_obj(stored["request"])
+    assert decoded_status.status == ActionStatusValue.FAILED
+    assert decoded_status.details.code == "Failed"
+    assert isinstance(decoded_status.completion_time, datetime)
+    assert decoded_status.release_after == timedelta(days=30)
+
+
+def test_legacy_dill_rows_are_migrated_on_read():
+    status, request = _make_status_and_request()
+    action_db = ActionDatabase(table_name=_TEST_DB_FILE, codec="json")
+    action_db.put(status.action_id, dill.dumps({'status': status, 'request': request}))
+
+    read_status, read_request = action_db.get_action_request(status.action_id)
+    assert read_status.action_id == status.action_id
+    assert read_request.body == request.body
+    assert action_db.get(status.action_id).startswith(b'v1:json:')
+    action_db.delete_action_request(status.action_id)
+
+
+def test_sharded_store_and_rebalance():
+    store = LocalStore(_TEST_DB_FILE + '_sharded', shard_count=1)
+    store.put_many(('key_%d' % i, 'value_%d' % i) for i in range(50))
+
+    assert LocalStore.rebalance(store.db_table, 1, 4, batch_size=7) == 50
+    sharded = LocalStore(store.db_table, shard_count=4)
+    assert {sharded.shard_for('key_%d' % i) for i in range(50)} == {0, 1, 2, 3}
+    assert sharded.get('key_42') == 'value_42'
+    assert sorted(sharded.items()) == sorted(('key_%d' % i, 'value_%d' % i) for i in range(50))
+    assert store.get('key_42') is None
+
+    sharded.delete('key_42')
+    assert sharded.get('key_42') is None
+    sharded.delete_database()
+    store.delete_database()
+
+
+def test_expired_rows_are_hidden_and_swept_in_batches():
+    store = LocalStore(_TEST_DB_FILE + '_expiry')
+    now = time.time()
+    store.put_many(('old_%d' % i, 'value', now - 10) for i in range(5))
+    store.put('current', 'value', expires_at=now + 3600)
+    store.put('forever', 'value')
+
+    assert store.get('old_0') is None
+    assert store.get('current') == 'value'
+    assert sorted(key for key, _ in store.items()) == ['current', 'forever']
+    assert store.sweep_expired(batch_size=2) == 5
+    assert store.sweep_expired(now=now + 7200) == 1
+    store.vacuum(pages=10)
+    assert [key for key, _ in store.items()] == ['forever']
+    store.delete_database()
+
+
+def test_tables_without_expiry_are_migrated(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conn = sqlite3.connect(_TEST_DB_FILE + '.sqlitedb')
+    conn.execute("CREATE TABLE %s(id primary key, value text)" % _TEST_DB_FILE)
+    conn.execute("INSERT INTO %s VALUES ('legacy', 'value')" % _TEST_DB_FILE)
+    conn.commit()
+    conn.close()
+
+    store = LocalStore(_TEST_DB_FILE)
+    assert store.get('legacy') == 'value'
+    store.put('legacy', 'value', expires_at=time.time() - 1)
+    assert store.sweep_expired() == 1
+    store.delete_database()
+
+
+def test_saving_a_finished_action_again_keeps_its_version():
+    action_db = ActionDatabase(table_name=_TEST_DB_FILE, retention_seconds=60)
+    status, request = _make_status_and_request()
+    action_db.store_action_request(status, request=request, action_id=status.action_id)
+    tag = action_db.action_tag(status.action_id)
+    time.sleep(0.01)
+    action_db.store_action_request(status, request=request, action_id=status.action_id)
+    assert action_db.action_tag(status.action_id) == tag
+    assert action_db.expires_at(status) == arrow.get(status.completion_time).timestamp() + 60
+    action_db.delete_action_request(status.action_id)
+
+
+def test_sweeper_reaps_completed_actions_and_output(tmp_path):
+    action_db = ActionDatabase(table_name=_TEST_DB_FILE, retention_seconds=60)
+    completed, request = _make_status_and_request()
+    active = ActionStatus(
+        status=ActionStatusValue.ACTIVE,
+        creator_id=completed.creator_id,
+        details={},
+    )
+    action_db.store_action_requests([(completed, request), (active, request)])
+    output = OutputStore(str(tmp_path / 'output'))
+    output.append(completed.action_id, 'stdout', b'done')
+
+    sweeper = ExpirySweeper(retention_seconds=60)
+    assert sweeper.sweep(action_db, output) == {'actions_reaped': 0, 'output_files_reaped': 0}
+    reaped = sweeper.sweep(action_db, output, now=time.time() + 120)
+    assert reaped == {'actions_reaped': 1, 'output_files_reaped': 1}
+    assert sweeper.stats()['actions_reaped'] == 1
+
+    assert action_db.get_action_request(completed.action_id) == (None, None)
+    assert action_db.get_action_request(active.action_id)[0].action_id == active.action_id
+    action_db.delete_action_request(active.action_id)